@@ -33,3 +33,39 @@ variable "scheduler_interval" {
   default     = "5 minutes"
   description = "The interval of execution of the scheduler."
 }
+
+variable "region_concurrency" {
+  type        = "string"
+  default     = "1"
+  description = "The number of regions processed at the same time."
+}
+
+variable "log_level" {
+  type        = "string"
+  default     = "INFO"
+  description = "The level of the logs, DEBUG includes the details of each instance."
+}
+
+variable "metrics_namespace" {
+  type        = "string"
+  default     = ""
+  description = "CloudWatch namespace where to publish the metrics of each run, none when empty."
+}
+
+variable "event_triggers" {
+  type        = "string"
+  default     = "false"
+  description = "When \"true\" the scheduler also runs on the instances that change state or scheduler tags."
+}
+
+variable "state_table" {
+  type        = "string"
+  default     = ""
+  description = "Name of a DynamoDB table created to store the state of the instances between runs, none when empty."
+}
+
+variable "fanout_shards" {
+  type        = "string"
+  default     = ""
+  description = "Shards of each region processed by separate invocations, like \"1,us-east-1=4\", no fan-out when empty."
+}
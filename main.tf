@@ -46,11 +46,34 @@ resource "aws_lambda_function" "tag_scheduler" {
   source_code_hash    = "${base64sha256(file(local.code_zip_file))}"
   environment {
     variables {
-      RUN_ON_REGIONS  = "${join(",", var.run_on_regions)}"
+      RUN_ON_REGIONS     = "${join(",", var.run_on_regions)}"
+      REGION_CONCURRENCY = "${var.region_concurrency}"
+      LOG_LEVEL          = "${var.log_level}"
+      METRICS_NAMESPACE  = "${var.metrics_namespace}"
+      STATE_STORE        = "${var.state_table != "" ? "dynamodb:${var.state_table}" : ""}"
+      FANOUT_SHARDS      = "${var.fanout_shards}"
     }
   }
 }
 
+##  State of the instances  ##
+
+resource "aws_dynamodb_table" "tag_scheduler_state" {
+  count               = "${var.state_table != "" ? 1 : 0}"
+  name                = "${var.state_table}"
+  billing_mode        = "PAY_PER_REQUEST"
+  hash_key            = "region"
+  range_key           = "instance"
+  attribute {
+    name              = "region"
+    type              = "S"
+  }
+  attribute {
+    name              = "instance"
+    type              = "S"
+  }
+}
+
 ##  Scheduled event  ##
 
 resource "aws_cloudwatch_event_rule" "tag_scheduler" {
@@ -66,6 +89,51 @@ resource "aws_cloudwatch_event_target" "tag_scheduler" {
   arn                 = "${aws_lambda_function.tag_scheduler.arn}"
 }
 
+##  Targeted events  ##
+
+resource "aws_cloudwatch_event_rule" "tag_scheduler_state_change" {
+  count               = "${var.event_triggers == "true" ? 1 : 0}"
+  name                = "${local.scheduler_name}StateChange"
+  description         = "Rule to trigger ${local.scheduler_name} function when an EC2 instance changes state"
+  event_pattern       = <<PATTERN
+{
+  "source": ["aws.ec2"],
+  "detail-type": ["EC2 Instance State-change Notification"],
+  "detail": { "state": ["running", "stopped"] }
+}
+PATTERN
+}
+
+resource "aws_cloudwatch_event_target" "tag_scheduler_state_change" {
+  count               = "${var.event_triggers == "true" ? 1 : 0}"
+  rule                = "${aws_cloudwatch_event_rule.tag_scheduler_state_change.name}"
+  target_id           = "${local.scheduler_name}StateChange"
+  arn                 = "${aws_lambda_function.tag_scheduler.arn}"
+}
+
+resource "aws_cloudwatch_event_rule" "tag_scheduler_tag_change" {
+  count               = "${var.event_triggers == "true" ? 1 : 0}"
+  name                = "${local.scheduler_name}TagChange"
+  description         = "Rule to trigger ${local.scheduler_name} function when the scheduler tags of an instance change"
+  event_pattern       = <<PATTERN
+{
+  "source": ["aws.tag"],
+  "detail-type": ["Tag Change on Resource"],
+  "detail": {
+    "service": ["ec2", "rds"],
+    "changed-tag-keys": [{ "prefix": "scheduler-" }]
+  }
+}
+PATTERN
+}
+
+resource "aws_cloudwatch_event_target" "tag_scheduler_tag_change" {
+  count               = "${var.event_triggers == "true" ? 1 : 0}"
+  rule                = "${aws_cloudwatch_event_rule.tag_scheduler_tag_change.name}"
+  target_id           = "${local.scheduler_name}TagChange"
+  arn                 = "${aws_lambda_function.tag_scheduler.arn}"
+}
+
 ##  Function permissions  ##
 
 resource "aws_lambda_permission" "tag_scheduler" {
@@ -76,6 +144,24 @@ resource "aws_lambda_permission" "tag_scheduler" {
   source_arn          = "${aws_cloudwatch_event_rule.tag_scheduler.arn}"
 }
 
+resource "aws_lambda_permission" "tag_scheduler_state_change" {
+  count               = "${var.event_triggers == "true" ? 1 : 0}"
+  statement_id        = "AllowExecutionFromStateChange"
+  action              = "lambda:InvokeFunction"
+  function_name       = "${aws_lambda_function.tag_scheduler.function_name}"
+  principal           = "events.amazonaws.com"
+  source_arn          = "${aws_cloudwatch_event_rule.tag_scheduler_state_change.arn}"
+}
+
+resource "aws_lambda_permission" "tag_scheduler_tag_change" {
+  count               = "${var.event_triggers == "true" ? 1 : 0}"
+  statement_id        = "AllowExecutionFromTagChange"
+  action              = "lambda:InvokeFunction"
+  function_name       = "${aws_lambda_function.tag_scheduler.function_name}"
+  principal           = "events.amazonaws.com"
+  source_arn          = "${aws_cloudwatch_event_rule.tag_scheduler_tag_change.arn}"
+}
+
 ##  Role  ##
 
 resource "aws_iam_role" "tag_scheduler" {
@@ -122,6 +208,21 @@ data "aws_iam_policy_document" "tag_scheduler_permissions" {
     ]
     resources         = ["*"]
   }
+  statement {
+    actions           = [
+      # To store the state of the instances
+      "dynamodb:Query",
+      "dynamodb:BatchWriteItem"
+    ]
+    resources         = ["arn:aws:dynamodb:*:*:table/${var.state_table != "" ? var.state_table : local.scheduler_name}"]
+  }
+  statement {
+    actions           = [
+      # To hand off the work left when running out of time and to fan out
+      "lambda:InvokeFunction"
+    ]
+    resources         = ["arn:aws:lambda:*:*:function:${local.scheduler_name}"]
+  }
 }
 
 resource "aws_iam_policy" "tag_scheduler_permissions" {
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Time taken to check the daily schedulers of a synthetic fleet when each
+# instance has its own run, deciding its specs again, and when all the
+# instances share the run, as evaluate_region() does, deciding each distinct
+# spec once.
+#
+# Usage, from the "src" directory:
+#   python -m benchmark.bench_daily [instances]
+#
+
+from __future__ import print_function
+
+import sys
+from timeit import default_timer
+from collections import OrderedDict
+
+import tagscheduler.tagscheduler as ts
+from benchmark.fleet import generate_fleet
+
+
+def check_all(instances, schedulers, run, shared):
+    """
+    Decisions of all the "schedulers" of the "instances" in the "run", shared
+    by all the instances or copied without decisions for each of them
+    """
+    result = []
+    for instance, i_schedulers in zip(instances, schedulers):
+        context = ts.EvaluationContext.of(instance, run if shared else run._replace(decisions={}))
+        result.extend(s.check(context) for s in i_schedulers)
+    return result
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 100000
+
+    fleet = generate_fleet(['bench'], count, 0, OrderedDict([('daily', 1)]))
+    instances = [ts.EC2Schedulable(object(), i) for i in fleet['bench']['ec2']]
+    schedulers = [ts.build_instance_schedulers(i) for i in instances]
+    run = ts.RunContext.create()
+
+    # The first path also fills the caches of the local dates and UTC times
+    start = default_timer()
+    own = check_all(instances, schedulers, run, False)
+    own_seconds = default_timer() - start
+
+    start = default_timer()
+    shared = check_all(instances, schedulers, run, True)
+    shared_seconds = default_timer() - start
+
+    if shared != own:
+        print("The decisions of the two paths differ", file=sys.stderr)
+        sys.exit(1)
+
+    print("Instances: %d, daily schedulers: %d, distinct specs: %d" % (count, len(own), len(run.decisions)))
+    print("%-10s %10s %14s" % ("run", "seconds", "schedulers/s"))
+    print("%-10s %10.3f %14d" % ("own", own_seconds, len(own) / own_seconds))
+    print("%-10s %10.3f %14d" % ("shared", shared_seconds, len(shared) / shared_seconds))
+    print("Speedup: %.1fx" % (own_seconds / shared_seconds))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
+
+# vim: ft=python:ts=4:sw=4
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Throughput, API calls and peak memory of run_tagscheduler on a synthetic
+# fleet served by a fake boto3 session.
+#
+# Usage, from the "src" directory:
+#   python -m benchmark.bench_pipeline [regions] [ec2] [rds] [latency_ms] [workers]
+#
+
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import resource
+from timeit import default_timer
+from mock import patch
+
+import tagscheduler.tagscheduler as ts
+from tagscheduler.logger import set_level
+from tagscheduler.metrics import metrics
+from tagscheduler.statestore import FileStateStore
+from benchmark.fleet import *
+
+
+def peak_memory_kb():
+    """ Peak resident memory of the process, in KB on Linux """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_pipeline(fleet, latency=0.0, workers=1, rds_tag_list=True, store=None):
+    """
+    Runs the scheduler once on "fleet" and returns a dictionary with the
+    wall-clock seconds, the instances evaluated and skipped, the API calls
+    made by operation and the peak memory of the process
+    """
+    calls = ApiCalls()
+
+    def session(region_name=None):
+        return FakeSession(fleet, latency, calls, rds_tag_list, region_name)
+
+    # Each run counts the calls of its own sessions
+    ts.clear_sessions()
+    with patch('boto3.session.Session', session):
+        start = default_timer()
+        ts.run_tagscheduler(list(fleet.keys()), workers, None, store)
+        elapsed = default_timer() - start
+
+    return {
+        'seconds': elapsed,
+        'instances': metrics.counter("instances"),
+        'skipped': metrics.counter("skipped"),
+        'actions': metrics.counter("actions"),
+        'calls': dict(calls.calls),
+        'peak_memory_kb': peak_memory_kb(),
+    }
+
+
+def main(argv):
+    args = [float(a) for a in argv[1:]]
+    region_count, ec2_count, rds_count, latency_ms, workers = (args + [4, 1000, 200, 0, 1][len(args):])[:5]
+
+    # Only the errors are logged, the report is printed at the end
+    set_level("ERROR")
+
+    regions = ["region-%02d" % i for i in range(int(region_count))]
+    memory_before = peak_memory_kb()
+    fleet = generate_fleet(regions, int(ec2_count), int(rds_count))
+    memory_fleet = peak_memory_kb()
+
+    print("Regions: %d, EC2: %d, RDS: %d per region, latency: %dms, workers: %d" % (
+        region_count, ec2_count, rds_count, latency_ms, workers
+    ))
+    print("%-16s %10s %12s %10s %8s %8s %12s" % (
+        "case", "seconds", "instances/s", "instances", "skipped", "calls", "peak_mem_kb"
+    ))
+
+    # The state of the last case is written by a first run
+    directory = tempfile.mkdtemp()
+    store = FileStateStore(os.path.join(directory, "state.json"))
+
+    # The first run compiles all the tag values, the following find them in
+    # the cache like the warm invocations of the Lambda
+    ts.Scheduler.spec_cache.clear()
+    cases = [
+        ("cold", True, None),
+        ("warm", True, None),
+        ("warm-listtags", False, None),
+        ("warm-state", True, store),
+    ]
+    try:
+        for name, rds_tag_list, case_store in cases:
+            if case_store is not None:
+                run_pipeline(fleet, 0.0, int(workers), rds_tag_list, case_store)
+
+            result = run_pipeline(fleet, latency_ms / 1000.0, int(workers), rds_tag_list, case_store)
+            instances = result['instances'] + result['skipped']
+            print("%-16s %10.3f %12.0f %10d %8d %8d %12d" % (
+                name, result['seconds'], instances / result['seconds'], instances,
+                result['skipped'], sum(result['calls'].values()), result['peak_memory_kb']
+            ))
+            for call, count in sorted(result['calls'].items()):
+                print("    %-30s %8d" % (call, count))
+    finally:
+        shutil.rmtree(directory)
+
+    print("Peak memory before the fleet: %d KB, after generating it: %d KB" % (memory_before, memory_fleet))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
+
+# vim: ft=python:ts=4:sw=4
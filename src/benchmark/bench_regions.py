@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+#
+# Wall-clock time of run_tagscheduler against the fake boto3 session of
+# benchmark.fleet for different numbers of region workers.
+#
+# Usage, from the "src" directory:
+#   python -m benchmark.bench_regions [regions] [latency_ms]
+#
+
+from __future__ import print_function
+
+import sys
+import time
+from mock import patch
+
+import tagscheduler.tagscheduler as ts
+from benchmark.fleet import FakeSession, generate_fleet
+from tagscheduler.logger import set_level
+
+
+def run(regions, workers):
+    """ Returns the wall-clock seconds of a run """
+    ts.clear_sessions()
+    start = time.time()
+    ts.run_tagscheduler(regions, workers)
+    return time.time() - start
+
+
+def main(argv):
+    region_count = int(argv[1]) if len(argv) > 1 else 16
+    latency = (float(argv[2]) if len(argv) > 2 else 200.0) / 1000.0
+    regions = ["region-%02d" % i for i in range(region_count)]
+
+    # Regions without instances, the time is spent only on the describe calls
+    fleet = generate_fleet(regions, 0, 0)
+    session = lambda region_name=None: FakeSession(fleet, latency, region_name=region_name)
+
+    # Only the errors are logged, the results are printed at the end
+    set_level("ERROR")
+
+    results = []
+    with patch('boto3.session.Session', session):
+        for workers in [1, 2, 4, 8, 16]:
+            results.append((workers, run(regions, workers)))
+
+    print("Regions: %d, latency per describe call: %dms" % (region_count, latency * 1000))
+    print("%8s %10s %8s" % ("workers", "seconds", "speedup"))
+    for workers, elapsed in results:
+        print("%8d %10.3f %7.1fx" % (workers, elapsed, results[0][1] / elapsed))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
+
+# vim: ft=python:ts=4:sw=4
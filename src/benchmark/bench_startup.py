@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Latency of the startup path of an invocation, the list of regions and the
+# boto3 sessions and clients of each region, in a cold container and in a
+# warm one that reuses the cached ones. The sessions and clients are real,
+# the DescribeRegions call is served by the fake session of benchmark.fleet.
+#
+# Usage, from the "src" directory:
+#   python -m benchmark.bench_startup [regions] [invocations] [latency_ms]
+#
+
+from __future__ import print_function
+
+import sys
+from timeit import default_timer
+from mock import patch
+
+import tagscheduler.tagscheduler as ts
+from benchmark.fleet import ApiCalls, FakeSession, generate_fleet
+
+
+def invocation(regions):
+    """ Returns the seconds of the startup path of an invocation """
+    start = default_timer()
+    for region in ts.get_regions([]):
+        session = ts.get_session(region)
+        for _, service in ts.INSTANCE_TYPES.itervalues():
+            session.client(service, region_name=region)
+    return default_timer() - start
+
+
+def measure(regions, invocations, cold):
+    """
+    Average seconds of the invocations, clearing the caches before each one
+    when "cold" or after a first invocation that fills them otherwise
+    """
+    ts.clear_sessions()
+    if not cold:
+        invocation(regions)
+
+    elapsed = []
+    for _ in range(invocations):
+        if cold:
+            ts.clear_sessions()
+        elapsed.append(invocation(regions))
+    return sum(elapsed) / len(elapsed)
+
+
+def main(argv):
+    region_count = int(argv[1]) if len(argv) > 1 else 16
+    invocations = int(argv[2]) if len(argv) > 2 else 5
+    latency = (float(argv[3]) if len(argv) > 3 else 100.0) / 1000.0
+
+    # Real boto3 regions, they must be known to the endpoint resolver
+    regions = ts.boto3.session.Session().get_available_regions('ec2')[:region_count]
+    calls = ApiCalls()
+    fake = FakeSession(generate_fleet(regions, 0, 0), latency, calls)
+
+    with patch('boto3.client', lambda service, **kwargs: fake.client(service)):
+        cold = measure(regions, invocations, True)
+        describe_cold = calls.calls['ec2.DescribeRegions']
+        warm = measure(regions, invocations, False)
+        describe_warm = calls.calls['ec2.DescribeRegions'] - describe_cold
+
+    print("Regions: %d, invocations: %d, latency of DescribeRegions: %dms" % (
+        len(regions), invocations, latency * 1000
+    ))
+    print("%-6s %12s %16s" % ("case", "ms/invoke", "DescribeRegions"))
+    print("%-6s %12.1f %16d" % ("cold", cold * 1000, describe_cold))
+    print("%-6s %12.1f %16d" % ("warm", warm * 1000, describe_warm))
+    print("Speedup: %.1fx" % (cold / warm if warm > 0 else float('inf')))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
+
+# vim: ft=python:ts=4:sw=4
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#
+# Synthetic fleet of EC2 and RDS instances behind a fake boto3 session, to
+# run the whole scheduling pipeline offline.
+#
+
+from __future__ import print_function
+
+import random
+import fnmatch
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import pytz as tz
+from botocore.hooks import HierarchicalEmitter
+
+
+# Relative weights of the kinds of scheduler tags assigned to the instances.
+# Instances of kind "none" only have tags not related to the scheduler
+DEFAULT_TAG_MIX = OrderedDict([
+    ('daily', 50),
+    ('timer', 15),
+    ('fixed', 10),
+    ('ignore', 5),
+    ('none', 20),
+])
+
+# Time zones used by the generated daily schedulers
+TIME_ZONES = ["", "Europe-London", "Europe-Rome", "America-New_York", "Asia-Tokyo", "Canada-Yukon"]
+
+# Days used by the generated daily schedulers
+DAYS = ["", "weekdays", "weekends", "mon.wed.fri"]
+
+# Time of reference of the generated launch and stop times
+FLEET_EPOCH = datetime(2018, 1, 1, tzinfo=tz.utc)
+
+
+def scheduler_tags(kind, rnd):
+    """
+    A list of tags with a scheduler of type "kind", chosen with the random
+    generator "rnd"
+    """
+    if kind == "daily":
+        value = "%02d00/%02d00/%s/%s" % (
+            rnd.randint(5, 10), rnd.randint(17, 22), rnd.choice(DAYS), rnd.choice(TIME_ZONES)
+        )
+        tags = [{'Key': "scheduler-daily", 'Value': value.rstrip("/")}]
+        # Some instances also have a second schedule that overrides the first
+        if rnd.random() < 0.2:
+            tags.append({'Key': "scheduler-daily-weekend", 'Value': "/0000/sat"})
+        return tags
+
+    if kind == "timer":
+        value = "%s/%d" % (rnd.choice(["start", "stop"]), rnd.choice([30, 60, 120, 480]))
+        return [{'Key': "scheduler-timer", 'Value': value}]
+
+    if kind == "fixed":
+        return [{'Key': "scheduler-fixed", 'Value': rnd.choice(["start", "stop"])}]
+
+    if kind == "ignore":
+        return [
+            {'Key': "scheduler-ignore_all", 'Value': "ignore"},
+            {'Key': "scheduler-fixed-z", 'Value': "stop"},
+        ]
+
+    return []
+
+
+def generate_fleet(regions, ec2_count, rds_count, tag_mix=None, seed=0):
+    """
+    Generates "ec2_count" EC2 instances and "rds_count" RDS instances in each
+    region in "regions". The scheduler tags are chosen according to the
+    weights of "tag_mix", DEFAULT_TAG_MIX by default. The same seed always
+    generates the same fleet.
+
+    It returns a dictionary {region: {'ec2': [...], 'rds': [...]}} with items
+    in the format of DescribeInstances and DescribeDBInstances
+    """
+    tag_mix = tag_mix or DEFAULT_TAG_MIX
+    kinds = list(tag_mix.keys())
+    weights = [tag_mix[k] for k in kinds]
+    rnd = random.Random(seed)
+
+    def pick_kind():
+        point = rnd.uniform(0, sum(weights))
+        for kind, weight in zip(kinds, weights):
+            point -= weight
+            if point <= 0:
+                return kind
+        return kinds[-1]
+
+    fleet = OrderedDict()
+    for region in regions:
+        ec2 = []
+        for i in range(ec2_count):
+            tags = [{'Key': "Name", 'Value': "ec2-%s-%d" % (region, i)}] + scheduler_tags(pick_kind(), rnd)
+            event_time = FLEET_EPOCH - timedelta(minutes=rnd.randint(0, 60 * 24 * 7))
+            instance = {
+                'InstanceId': "i-%s-%08x" % (region, i),
+                'State': {'Name': rnd.choice(["running", "stopped"])},
+                'Tags': tags,
+            }
+            if instance['State']['Name'] == "running":
+                instance['LaunchTime'] = event_time
+                instance['StateTransitionReason'] = ""
+            else:
+                instance['StateTransitionReason'] = "User initiated (%s)" % event_time.strftime('%Y-%m-%d %H:%M:%S GMT')
+            ec2.append(instance)
+
+        rds = []
+        for i in range(rds_count):
+            identifier = "db-%s-%d" % (region, i)
+            rds.append({
+                'DbiResourceId': "db-%s-%08x" % (region, i),
+                'DBInstanceIdentifier': identifier,
+                'DBInstanceArn': "arn:aws:rds:%s:000000000000:db:%s" % (region, identifier),
+                'DBInstanceStatus': rnd.choice(["available", "stopped"]),
+                'TagList': [{'Key': "Name", 'Value': identifier}] + scheduler_tags(pick_kind(), rnd),
+            })
+
+        fleet[region] = {'ec2': ec2, 'rds': rds}
+
+    return fleet
+
+
+class ApiCalls(object):
+    """
+    Thread safe count of the API calls made to the fake clients, by
+    "<service>.<operation>"
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {}
+
+    def add(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def total(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+
+class FakeSession(object):
+    """
+    Fake of boto3.session.Session serving the instances of "fleet". Each API
+    call, and each page of the describe calls, takes "latency" seconds and is
+    counted in "calls". With "rds_tag_list" False the RDS describe responses
+    don't include the TagList, like older versions of the API
+    """
+    def __init__(self, fleet, latency=0.0, calls=None, rds_tag_list=True, region_name=None):
+        self.fleet = fleet
+        self.latency = latency
+        self.calls = calls if calls is not None else ApiCalls()
+        self.rds_tag_list = rds_tag_list
+        self.region_name = region_name
+        self.events = HierarchicalEmitter()
+
+    def client(self, service, region_name=None):
+        region = region_name or self.region_name
+        if service == 'ec2':
+            return FakeEC2Client(self, region)
+        if service == 'rds':
+            return FakeRDSClient(self, region)
+        raise ValueError("Unsupported service %s" % service)
+
+
+class FakeClient(object):
+    """ Base of the fake boto3 clients """
+    service = None
+
+    def __init__(self, session, region):
+        self.session = session
+        self.region = region
+        self.resources = session.fleet.get(region, {'ec2': [], 'rds': []})
+
+    def call(self, operation):
+        self.session.calls.add("%s.%s" % (self.service, operation))
+        if self.session.latency > 0:
+            time.sleep(self.session.latency)
+
+    def get_paginator(self, operation_name):
+        return FakePaginator(self, operation_name)
+
+
+class FakePaginator(object):
+    """ Pages of the items returned by the describe method of a fake client """
+    def __init__(self, client, operation_name):
+        self.client = client
+        self.operation_name = operation_name
+
+    def paginate(self, **kwargs):
+        page_size = kwargs.get('PaginationConfig', {}).get('PageSize', 100)
+        operation, items, page = getattr(self.client, self.operation_name)(**kwargs)
+        for i in range(0, max(len(items), 1), page_size):
+            self.client.call(operation)
+            yield page(items[i:i + page_size])
+
+
+class FakeEC2Client(FakeClient):
+    service = 'ec2'
+
+    def describe_instances(self, Filters=[], **kwargs):
+        instances = self.resources['ec2']
+        for f in Filters:
+            if f['Name'] == 'tag-key':
+                instances = [
+                    i for i in instances
+                    if any(fnmatch.fnmatchcase(t['Key'], v) for t in i['Tags'] for v in f['Values'])
+                ]
+            elif f['Name'] == 'instance-id':
+                values = set(f['Values'])
+                instances = [i for i in instances if i['InstanceId'] in values]
+        return 'DescribeInstances', instances, lambda items: {'Reservations': [{'Instances': items}]}
+
+    def describe_regions(self):
+        self.call('DescribeRegions')
+        return {'Regions': [{'RegionName': r} for r in self.session.fleet.keys()]}
+
+    def start_instances(self, InstanceIds):
+        self.call('StartInstances')
+
+    def stop_instances(self, InstanceIds):
+        self.call('StopInstances')
+
+
+class FakeRDSClient(FakeClient):
+    service = 'rds'
+
+    # Field of the instances matched by each filter
+    FILTER_FIELDS = {'dbi-resource-id': 'DbiResourceId', 'db-instance-id': 'DBInstanceArn'}
+
+    def describe_db_instances(self, Filters=[], **kwargs):
+        instances = self.resources['rds']
+        for f in Filters:
+            values = set(f['Values'])
+            field = FakeRDSClient.FILTER_FIELDS[f['Name']]
+            instances = [i for i in instances if i[field] in values]
+        if not self.session.rds_tag_list:
+            instances = [dict((k, v) for k, v in i.items() if k != 'TagList') for i in instances]
+        return 'DescribeDBInstances', instances, lambda items: {'DBInstances': items}
+
+    def list_tags_for_resource(self, ResourceName):
+        self.call('ListTagsForResource')
+        for i in self.resources['rds']:
+            if i['DBInstanceArn'] == ResourceName:
+                return {'TagList': i['TagList']}
+        return {'TagList': []}
+
+    def start_db_instance(self, DBInstanceIdentifier):
+        self.call('StartDBInstance')
+
+    def stop_db_instance(self, DBInstanceIdentifier):
+        self.call('StopDBInstance')
+
+# vim: ft=python:ts=4:sw=4
@@ -25,28 +25,211 @@
 
 from __future__ import print_function
 
+import json
 import boto3
+import boto3.session
+import threading
+from cache import TTLCache
+from collections import OrderedDict
+from metrics import instrument_session
+from throttling import throttle_session
 from schedulable import *
 
 
+# Number of resources requested in each page of the describe calls, and
+# number of IDs in each describe call of a targeted run
+PAGE_SIZE = 100
+
+# Schedulable class and boto3 client of each type of instance
+INSTANCE_TYPES = OrderedDict([
+    ('EC2', (EC2Schedulable, 'ec2')),
+    ('RDS', (RDSSchedulable, 'rds')),
+])
+
+# Seconds the list of regions is reused by the runs of a warm container
+REGIONS_TTL_SECONDS = 3600
+
+# Seconds the sessions and clients are reused by the runs of a warm
+# container, well within the validity of the Lambda credentials
+SESSIONS_TTL_SECONDS = 900
+
+regions_cache = TTLCache(REGIONS_TTL_SECONDS)
+sessions_cache = TTLCache(SESSIONS_TTL_SECONDS)
+clients_cache = TTLCache(SESSIONS_TTL_SECONDS)
+
+
 def get_all_regions():
     """
-    Returns a list of available AWS regions
+    Returns a list of available AWS regions. The list is cached for
+    REGIONS_TTL_SECONDS
+    """
+    return list(regions_cache.lookup('regions', lambda: [
+        x['RegionName'] for x in get_client('ec2').describe_regions()['Regions']
+    ]))
+
+
+def invoke_function(function, payload):
+    """
+    Invokes asynchronously the Lambda function "function", a name or ARN,
+    with "payload" as event
+    """
+    get_client('lambda').invoke(
+        FunctionName=function, InvocationType="Event", Payload=json.dumps(payload)
+    )
+
+
+def get_client(service):
+    """
+    A client of the default boto3 session, cached for SESSIONS_TTL_SECONDS.
+    Clients are thread safe, unlike sessions
+    """
+    return clients_cache.lookup(service, lambda: boto3.client(service))
+
+
+def get_session(region):
+    """
+    The session of a region, see create_session(), with its clients. Both are
+    cached for SESSIONS_TTL_SECONDS so the runs of a warm container don't
+    create them again
+    """
+    return sessions_cache.lookup(region, lambda: RegionClients(create_session(region)))
+
+
+def clear_sessions():
+    """ Removes from the caches all the regions, sessions and clients """
+    regions_cache.clear()
+    sessions_cache.clear()
+    clients_cache.clear()
+
+
+class RegionClients(object):
+    """
+    A boto3 session that creates each client only once, with the same
+    client() method as the session
+    """
+    def __init__(self, session):
+        self.session = session
+        self.region_name = session.region_name
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def client(self, service, region_name=None):
+        with self._lock:
+            key = (service, region_name)
+            if key not in self._clients:
+                self._clients[key] = self.session.client(service, region_name=region_name)
+            return self._clients[key]
+
+
+def create_session(region):
+    """
+    Returns a new boto3 session bound to a region. A session is not thread
+    safe so each region being processed must use its own. The API calls made
+    through the session are timed in the run metrics and rate limited, see
+    throttle_session()
+    """
+    return throttle_session(instrument_session(boto3.session.Session(region_name=region)), region)
+
+
+def get_all_instances(region, session=None, tag_prefix=None, ids=None):
+    """
+    Returns the type of instances managed by the scheduler, each with a
+    generator of its instances. The instances are fetched one page at a time
+    while the generators are consumed. The clients are created from "session"
+    when provided, otherwise from the default boto3 session. When "tag_prefix"
+    is given only the instances with at least one tag "<tag_prefix>-*" are
+    returned. When "ids" is given, a dictionary {type: [id, ...]}, only those
+    types and instances are fetched
+    """
+    if session is None:
+        session = boto3
+
+    instances = OrderedDict()
+    for i_type, fetch in [('EC2', get_ec2_instances), ('RDS', get_rds_instances)]:
+        if ids is not None and i_type not in ids:
+            continue
+        client = session.client(INSTANCE_TYPES[i_type][1], region_name=region)
+        instances[i_type] = fetch(client, tag_prefix, ids[i_type] if ids is not None else None)
+
+    return instances
+
+
+def get_ec2_instances(ec2, tag_prefix=None, ids=None):
     """
-    return [x['RegionName'] for x in boto3.client('ec2').describe_regions()['Regions']]
+    Generator of all the EC2 instances of the region of the client "ec2", or
+    only of the instance IDs in "ids". The filter on "tag_prefix" is applied
+    by the EC2 API
+    """
+    filters = []
+    if tag_prefix is not None:
+        filters.append({'Name': 'tag-key', 'Values': ["%s-*" % tag_prefix]})
+
+    paginator = ec2.get_paginator('describe_instances')
+    for id_filters in get_id_filters([('instance-id', ids)]):
+        for page in paginator.paginate(Filters=filters + id_filters, PaginationConfig={'PageSize': PAGE_SIZE}):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    yield EC2Schedulable(ec2, instance)
 
 
-def get_all_instances(region):
+def get_rds_instances(rds, tag_prefix=None, ids=None):
     """
-    Returns a list of all the type of instances, and their instances, managed
-    by the scheduler
+    Generator of all the RDS instances of the region of the client "rds", or
+    only of the resource IDs or ARNs in "ids". The RDS API doesn't filter on
+    tags so "tag_prefix" is checked on the TagList of the response, when
+    present, before building the instance
     """
-    ec2 = boto3.resource('ec2', region_name=region)
-    rds = boto3.client('rds', region_name=region)
+    if ids is not None:
+        arns = [i for i in ids if i.startswith("arn:")]
+        ids = [('dbi-resource-id', [i for i in ids if not i.startswith("arn:")]), ('db-instance-id', arns)]
+
+    paginator = rds.get_paginator('describe_db_instances')
+    for id_filters in get_id_filters(ids):
+        for page in paginator.paginate(Filters=id_filters, PaginationConfig={'PageSize': PAGE_SIZE}):
+            for instance in page['DBInstances']:
+                if tag_prefix is not None and 'TagList' in instance:
+                    if not has_tag_prefix(instance['TagList'], tag_prefix):
+                        continue
+                yield RDSSchedulable(rds, instance)
 
-    return {
-        'EC2': [EC2Schedulable(ec2, i) for i in ec2.instances.all()],
-        'RDS': [RDSSchedulable(rds, i) for i in rds.describe_db_instances()['DBInstances']]
-    }
+
+def get_id_filters(ids):
+    """
+    The lists of describe filters needed to fetch the instances in "ids", a
+    list of (filter_name, [id, ...]), each filter with up to PAGE_SIZE IDs.
+    A single empty list of filters, to fetch all the instances, when "ids"
+    is None
+    """
+    if ids is None:
+        return [[]]
+
+    filters = []
+    for name, values in ids:
+        if values is None:
+            return [[]]
+        for i in range(0, len(values), PAGE_SIZE):
+            filters.append([{'Name': name, 'Values': values[i:i + PAGE_SIZE]}])
+    return filters
+
+
+def get_record_instances(region, i_type, records, session=None):
+    """
+    Rebuilds the instances of type "i_type" described by records made with
+    Schedulable.to_record(), without calling any describe API
+    """
+    if session is None:
+        session = boto3
+
+    i_class, service = INSTANCE_TYPES[i_type]
+    client = session.client(service, region_name=region)
+    return [i_class.from_record(client, r) for r in records]
+
+
+def has_tag_prefix(tags, tag_prefix):
+    """
+    Checks if any of the tags has a key that starts with "<tag_prefix>-"
+    """
+    tag_prefix = "%s-" % tag_prefix
+    return any(t['Key'].startswith(tag_prefix) for t in tags)
 
 # vim: ft=python:ts=4:sw=4
\ No newline at end of file
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import threading
+from timeit import default_timer
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Thread safe mapping that keeps up to "maxsize" items, discarding the least
+    recently used ones. It counts the hits and misses of the lookups
+    """
+    def __init__(self, maxsize=128):
+        if maxsize < 1:
+            raise ValueError("The size of the cache must be at least 1.")
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def lookup(self, key, compute):
+        """
+        Returns the value cached for "key". On a miss the value is created
+        calling compute() and stored in the cache
+        """
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+                self.hits += 1
+            except KeyError:
+                value = compute()
+                self.misses += 1
+
+            self._items[key] = value
+            if len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+            return value
+
+    def clear(self):
+        """ Removes all the items and resets the counters """
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """ Size, hits and misses of the cache """
+        return {'size': len(self._items), 'hits': self.hits, 'misses': self.misses}
+
+
+class TTLCache(object):
+    """
+    Thread safe mapping whose items expire "ttl" seconds after being
+    created, to reuse them across the runs of a warm Lambda container. It
+    counts the hits and misses of the lookups
+    """
+    def __init__(self, ttl):
+        if ttl <= 0:
+            raise ValueError("The TTL of the cache must be positive.")
+
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def lookup(self, key, compute):
+        """
+        Returns the value cached for "key". When missing or expired the value
+        is created calling compute() and stored in the cache
+        """
+        with self._lock:
+            now = default_timer()
+            try:
+                value, expires = self._items[key]
+                if now < expires:
+                    self.hits += 1
+                    return value
+            except KeyError:
+                pass
+
+            value = compute()
+            self.misses += 1
+            self._items[key] = (value, now + self.ttl)
+            return value
+
+    def clear(self):
+        """ Removes all the items and resets the counters """
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """ Size, hits and misses of the cache """
+        return {'size': len(self._items), 'hits': self.hits, 'misses': self.misses}
+
+# vim: ft=python:ts=4:sw=4
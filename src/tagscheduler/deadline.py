@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+from timeit import default_timer
+
+
+# Seconds kept free before the Lambda timeout to hand off the work left
+HANDOFF_MARGIN_SECONDS = 20.0
+
+
+class Deadline(object):
+    """
+    The time by which a run must have finished its work. A Deadline without
+    seconds never expires, like the runs from the command line
+    """
+    def __init__(self, seconds=None):
+        self.deadline = default_timer() + seconds if seconds is not None else None
+
+    @classmethod
+    def of_lambda(cls, context, margin=HANDOFF_MARGIN_SECONDS):
+        """
+        The Deadline of a Lambda invocation, "margin" seconds before its
+        timeout. It never expires when the context doesn't tell the time left
+        """
+        try:
+            remaining = context.get_remaining_time_in_millis() / 1000.0
+        except (AttributeError, TypeError):
+            return cls()
+        return cls(max(0.0, remaining - margin))
+
+    def remaining(self):
+        """ Seconds left, None when there is no deadline """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - default_timer())
+
+    def expired(self):
+        return self.deadline is not None and default_timer() >= self.deadline
+
+# vim: ft=python:ts=4:sw=4
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+from collections import OrderedDict
+from awsobjects import INSTANCE_TYPES
+from logger import *
+
+
+# Detail type of the EventBridge events of EC2 instances changing state
+EC2_STATE_CHANGE = "EC2 Instance State-change Notification"
+
+# Detail type of the EventBridge events of tags changing on a resource
+TAG_CHANGE = "Tag Change on Resource"
+
+
+def parse_event(event):
+    """
+    The resources to evaluate for the Lambda "event", as a dictionary
+    {region: {type: [id, ...]}}. Supported events are:
+     - a list of targets {"targets": [{"region": ..., "type": ..., "id": ...}]}
+       where "type" is EC2 or RDS and "id" is the ID of the instance as
+       written in a plan, and optionally of regions {"regions": [...]} whose
+       resources are all evaluated, mapped to None. See continuation_event()
+     - an EC2 Instance State-change Notification
+     - a Tag Change on Resource of EC2 or RDS instances
+    It returns None for any other event, like the scheduled ones, which run
+    on all the resources
+    """
+    if not isinstance(event, dict):
+        return None
+
+    if 'targets' in event or 'regions' in event:
+        targets = OrderedDict()
+        for target in event.get('targets') or []:
+            try:
+                add_target(targets, target['region'], target['type'], target['id'])
+            except (KeyError, TypeError, ValueError) as e:
+                log.warning("Invalid target", extra=log_fields(target=target, error=str(e)))
+        targets = unique_targets(targets)
+        for region in event.get('regions') or []:
+            targets[region] = None
+        return targets
+
+    detail_type = event.get('detail-type')
+
+    if event.get('source') == "aws.ec2" and detail_type == EC2_STATE_CHANGE:
+        targets = OrderedDict()
+        add_target(targets, event['region'], 'EC2', event['detail']['instance-id'])
+        return targets
+
+    if event.get('source') == "aws.tag" and detail_type == TAG_CHANGE:
+        targets = OrderedDict()
+        for arn in event.get('resources', []):
+            target = parse_arn(arn)
+            if target is None:
+                log.warning("Unsupported resource", extra=log_fields(arn=arn))
+                continue
+            add_target(targets, *target)
+        return unique_targets(targets)
+
+    return None
+
+
+def parse_arn(arn):
+    """
+    The (region, type, id) of the ARN of an EC2 or RDS instance, None for
+    other resources. RDS instances are identified by their ARN
+    """
+    fields = arn.split(":", 5)
+    if len(fields) < 6 or fields[0] != "arn":
+        return None
+
+    service, region, resource = fields[2], fields[3], fields[5]
+    if service == "ec2" and resource.startswith("instance/"):
+        return region, 'EC2', resource.split("/", 1)[1]
+    if service == "rds" and resource.startswith("db:"):
+        return region, 'RDS', arn
+
+    return None
+
+
+def add_target(targets, region, i_type, instance_id):
+    """ Adds an instance to the targets """
+    i_type = i_type.upper()
+    if i_type not in INSTANCE_TYPES:
+        raise ValueError("Unknown type %s" % i_type)
+
+    targets.setdefault(region, OrderedDict()).setdefault(i_type, []).append(instance_id)
+
+
+def unique_targets(targets):
+    """ Removes the instances listed more than once, keeping the order """
+    for i_types in targets.itervalues():
+        for i_type, ids in i_types.iteritems():
+            i_types[i_type] = list(OrderedDict.fromkeys(ids))
+    return targets
+
+
+def split_targets(targets, size):
+    """
+    Splits the targets, as returned by parse_event(), into a list of targets
+    of at most "size" instances each. Whole regions, mapped to None, go with
+    the first of them
+    """
+    chunks = [OrderedDict()]
+    count = 0
+    for region, i_types in targets.iteritems():
+        if i_types is None:
+            chunks[0][region] = None
+            continue
+        for i_type, ids in i_types.iteritems():
+            for instance_id in ids:
+                if count == size:
+                    chunks.append(OrderedDict())
+                    count = 0
+                chunks[-1].setdefault(region, OrderedDict()).setdefault(i_type, []).append(instance_id)
+                count += 1
+    return chunks
+
+
+def continuation_event(targets, regions=(), handoffs=0, shard=None):
+    """
+    The event that makes a new invocation continue the work of a run: the
+    instances in "targets", as returned by parse_event(), and all the
+    resources of "regions". "handoffs" counts the runs that passed the work.
+    With a "shard" (index, count) only the instances of the shard are
+    evaluated, see parse_shard()
+    """
+    event = {
+        'targets': [
+            {'region': region, 'type': i_type, 'id': instance_id}
+            for region, i_types in targets.iteritems()
+            for i_type, ids in i_types.iteritems()
+            for instance_id in ids
+        ],
+        'regions': list(regions),
+        'handoffs': handoffs,
+    }
+    if shard is not None:
+        event['shard'] = list(shard)
+    return event
+
+
+def parse_shard(event):
+    """
+    The shard (index, count) of the instances an event is limited to, from
+    {"shard": [index, count]}, or None for all the instances
+    """
+    if not isinstance(event, dict) or event.get('shard') is None:
+        return None
+    try:
+        index, count = [int(x) for x in event['shard']]
+    except (TypeError, ValueError) as e:
+        log.warning("Invalid shard", extra=log_fields(shard=event['shard']))
+        return None
+    if count < 1 or not 0 <= index < count:
+        log.warning("Invalid shard", extra=log_fields(shard=event['shard']))
+        return None
+    return index, count
+
+
+def event_handoffs(event):
+    """ How many runs passed the work of "event" along, 0 for new work """
+    if not isinstance(event, dict):
+        return 0
+    try:
+        return max(0, int(event.get('handoffs', 0)))
+    except (TypeError, ValueError):
+        return 0
+
+# vim: ft=python:ts=4:sw=4
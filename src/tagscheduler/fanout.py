@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import zlib
+from abc import ABCMeta, abstractmethod
+from awsobjects import invoke_function
+from collections import OrderedDict
+from events import add_target, continuation_event, split_targets
+from logger import *
+from metrics import Metrics
+
+
+# Most instances targeted by the event of a worker or of a continuation, to
+# stay within the limit of the payload of asynchronous Lambda invocations
+MAX_WORKER_TARGETS = 2000
+
+
+def parse_fanout_shards(value):
+    """
+    Parses the shards of the fan-out: the number of shards of each region,
+    optionally followed by the number of some regions, like
+    "1,us-east-1=4". Returns (shards, {region: shards}) or None when "value"
+    is empty. Raises ValueError when invalid
+    """
+    fields = [f.strip() for f in (value or "").split(",") if f.strip()]
+    if not fields:
+        return None
+
+    default, overrides = 1, {}
+    for field in fields:
+        if "=" in field:
+            region, shards = [x.strip() for x in field.split("=", 1)]
+            overrides[region] = int(shards)
+        else:
+            default = int(field)
+
+    if min([default] + overrides.values()) < 1:
+        raise ValueError("The number of shards must be at least 1")
+
+    return default, overrides
+
+
+def in_shard(instance_id, shard):
+    """
+    Checks if an instance belongs to the shard (index, count). The same ID is
+    always in the same shard, in every invocation
+    """
+    index, count = shard
+    return (zlib.crc32(instance_id) & 0xffffffff) % count == index
+
+
+def worker_events(regions, shards, discover=None):
+    """
+    The events of the workers processing "regions", one for each shard of
+    each region. "shards" is returned by parse_fanout_shards().
+
+    "discover" is a function that returns the instance IDs of a region, as
+    {type: [id, ...]}. When it is given, each region with more than one
+    shard is described only once, here. Each worker then gets the IDs of its
+    shard as targets, so it describes only its own instances. Shards larger
+    than MAX_WORKER_TARGETS are split among more workers and empty shards
+    get no worker. Without "discover", or when it fails, every worker
+    describes the whole region and keeps only the instances of its shard
+    """
+    default, overrides = shards
+    events = []
+    for region in regions:
+        count = overrides.get(region, default)
+        if count == 1:
+            events.append(continuation_event({}, [region]))
+            continue
+
+        ids = None
+        if discover is not None:
+            try:
+                ids = discover(region)
+            except Exception as e:
+                log.exception("Discovery Exception", extra=log_fields(region=region))
+
+        if ids is None:
+            for index in range(count):
+                events.append(continuation_event({}, [region], shard=(index, count)))
+            continue
+
+        for index in range(count):
+            shard_ids = [
+                (i_type, instance_id)
+                for i_type, i_ids in ids.iteritems() for instance_id in i_ids
+                if in_shard(instance_id, (index, count))
+            ]
+            if not shard_ids:
+                continue
+            targets = OrderedDict()
+            for i_type, instance_id in shard_ids:
+                add_target(targets, region, i_type, instance_id)
+            for chunk in split_targets(targets, MAX_WORKER_TARGETS):
+                events.append(continuation_event(chunk))
+
+    return events
+
+
+class Invoker(object):
+    """
+    Runs a worker of the fan-out with an event and returns its result, None
+    when it runs asynchronously
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def invoke(self, event):
+        pass
+
+
+class LambdaInvoker(Invoker):
+    """ Invokes asynchronously a Lambda function for each worker """
+    def __init__(self, function):
+        self.function = function
+
+    def invoke(self, event):
+        invoke_function(self.function, event)
+        return None
+
+
+class LocalInvoker(Invoker):
+    """
+    Runs each worker in this process calling "handler" like Lambda does, to
+    run the fan-out without AWS
+    """
+    def __init__(self, handler):
+        self.handler = handler
+
+    def invoke(self, event):
+        return self.handler(event, None)
+
+
+def fan_out(events, invoker):
+    """
+    Invokes a worker for each event and returns the summary of the fan-out
+    as reported by Metrics. The counters returned by the workers that run
+    synchronously are added up in the summary
+    """
+    summary = Metrics()
+    for event in events:
+        try:
+            with summary.timer("invocation"):
+                result = invoker.invoke(event)
+            summary.incr("invocations")
+
+        except Exception as e:
+            summary.incr("errors.invocation")
+            log.exception("Invocation Exception", extra=log_fields(
+                regions=event.get('regions'), shard=event.get('shard')
+            ))
+            continue
+
+        if isinstance(result, dict):
+            summary.incr("workers.completed")
+            for name, value in result.get('counters', {}).iteritems():
+                summary.incr(name, value)
+
+    return summary.report()
+
+# vim: ft=python:ts=4:sw=4
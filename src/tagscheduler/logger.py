@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import logging
+from datetime import datetime
+from collections import OrderedDict
+
+
+# Name of the logger used by all the modules
+LOGGER_NAME = "tagscheduler"
+
+# Level of logging when not configured with LOG_LEVEL
+DEFAULT_LOG_LEVEL = "INFO"
+
+# Keys of the JSON object set by the formatter, that fields can't replace
+RESERVED_KEYS = ('time', 'level', 'message', 'exception')
+
+# Prefix added to the fields named like a reserved key
+FIELD_PREFIX = "field_"
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats each record as a JSON object on a single line. The items of the
+    dictionary "fields", passed with the "extra" argument of the logging
+    calls, are added to the object, with FIELD_PREFIX in front of the ones
+    named like one of the RESERVED_KEYS
+    """
+    def format(self, record):
+        entry = OrderedDict([
+            ('time', datetime.utcfromtimestamp(record.created).isoformat() + "Z"),
+            ('level', record.levelname),
+            ('message', record.getMessage()),
+        ])
+        for key, value in getattr(record, 'fields', {}).items():
+            if key in RESERVED_KEYS:
+                key = FIELD_PREFIX + key
+            entry[key] = value
+
+        if record.exc_info and record.exc_info[0] is not None:
+            entry['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+def get_logger():
+    """
+    The logger of the Tag Scheduler, writing JSON lines on the standard output
+    at the level set with LOG_LEVEL
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    if len(logger.handlers) == 0:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+        logger.propagate = False
+        set_level(os.environ.get('LOG_LEVEL', DEFAULT_LOG_LEVEL))
+    return logger
+
+
+def set_level(level):
+    """ Changes the logging level, falling back to the default if not valid """
+    logger = logging.getLogger(LOGGER_NAME)
+    try:
+        logger.setLevel(str(level).strip().upper())
+    except ValueError:
+        logger.setLevel(DEFAULT_LOG_LEVEL)
+
+
+def log_fields(**kwargs):
+    """ The "extra" argument of the logging calls for structured fields """
+    return {'fields': OrderedDict(sorted(kwargs.items()))}
+
+
+log = get_logger()
+
+# vim: ft=python:ts=4:sw=4
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import json
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+
+
+# Key used to keep the start time of an API call in the botocore context
+API_CALL_START = "tagscheduler_start"
+
+
+class Metrics(object):
+    """
+    Thread safe counters and timers of a run of the scheduler
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._timers = {}
+
+    def reset(self):
+        """ Removes all the values collected """
+        with self._lock:
+            self._counters = {}
+            self._timers = {}
+
+    def incr(self, name, value=1):
+        """ Increments the counter "name" """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def add_time(self, name, seconds, count=1, max_seconds=None):
+        """
+        Adds "count" measures, lasting "seconds" in total, to the timer "name".
+        The longest of the measures is "max_seconds" which, when omitted, is
+        "seconds" for a single measure and unknown for many of them, so it
+        doesn't change the maximum of the timer
+        """
+        if max_seconds is None and count == 1:
+            max_seconds = seconds
+
+        with self._lock:
+            timer = self._timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += count
+            timer[1] += seconds
+            if max_seconds is not None:
+                timer[2] = max(timer[2], max_seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """ Measures the time spent in the "with" block with the timer "name" """
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.add_time(name, default_timer() - start)
+
+    def counter(self, name):
+        """ Current value of a counter """
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def report(self):
+        """ Counters and timers, with count, total and maximum seconds """
+        with self._lock:
+            return OrderedDict([
+                ('counters', OrderedDict(sorted(self._counters.items()))),
+                ('timers', OrderedDict(
+                    (name, OrderedDict([
+                        ('count', t[0]), ('seconds', round(t[1], 3)), ('max_seconds', round(t[2], 3))
+                    ])) for name, t in sorted(self._timers.items())
+                )),
+            ])
+
+    def emf(self, namespace, dimensions=None):
+        """
+        The counters and the total time of the timers as a line in CloudWatch
+        Embedded Metric Format
+        """
+        dimensions = dimensions or {}
+        with self._lock:
+            values = OrderedDict(dimensions)
+            definitions = []
+            for name, value in sorted(self._counters.items()):
+                values[name] = value
+                definitions.append({'Name': name, 'Unit': "Count"})
+            for name, t in sorted(self._timers.items()):
+                values[name] = round(t[1] * 1000.0, 3)
+                definitions.append({'Name': name, 'Unit': "Milliseconds"})
+
+        values['_aws'] = {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [sorted(dimensions.keys())],
+                'Metrics': definitions,
+            }]
+        }
+        return json.dumps(values)
+
+
+def instrument_session(session, registry=None):
+    """
+    Registers on the boto3 session the hooks that measure each API call with
+    a timer named "api.<service>.<operation>"
+    """
+    registry = registry or metrics
+
+    def before_call(model, context, **kwargs):
+        context[API_CALL_START] = default_timer()
+
+    def after_call(model, context, **kwargs):
+        start = context.pop(API_CALL_START, None)
+        if start is not None:
+            registry.add_time(
+                "api.%s.%s" % (model.service_model.service_name, model.name),
+                default_timer() - start
+            )
+
+    session.events.register('before-call', before_call, unique_id="tagscheduler-before-call")
+    session.events.register('after-call', after_call, unique_id="tagscheduler-after-call")
+    return session
+
+
+# Metrics of the current run
+metrics = Metrics()
+
+# vim: ft=python:ts=4:sw=4
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import json
+import threading
+from collections import OrderedDict
+
+
+def plan_record(region, i_type, instance, schedulers, action):
+    """
+    A line of the plan: where the instance is, its state, the schedulers that
+    have been evaluated and the action decided
+    """
+    record = OrderedDict([('region', region), ('type', i_type)])
+    record.update(instance.to_record())
+    record['schedulers'] = [scheduler_label(s) for s in schedulers]
+    record['action'] = action
+    return record
+
+
+def scheduler_label(scheduler):
+    """ Compact description of a scheduler as "<type>[-<name>]=<value>" """
+    label = scheduler.type()
+    if scheduler.name != "":
+        label += "-%s" % scheduler.name
+    return "%s=%s" % (label, scheduler.value)
+
+
+def read_plan(stream):
+    """
+    Generator of the records of a plan saved as JSON lines
+    """
+    for line in stream:
+        line = line.strip()
+        if line != "":
+            yield json.loads(line)
+
+
+class PlanWriter(object):
+    """
+    Thread safe writer of the records of a plan as JSON lines
+    """
+    def __init__(self, stream):
+        self._stream = stream
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def write(self, record):
+        line = json.dumps(record, separators=(',', ':'))
+        with self._lock:
+            self._stream.write(line + "\n")
+            self.count += 1
+
+# vim: ft=python:ts=4:sw=4
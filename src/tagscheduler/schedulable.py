@@ -29,13 +29,19 @@ import re
 import pytz as tz
 from datetime import datetime
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+from logger import *
+from throttling import retries
 
 
 class Schedulable(object):
     """
-    Any object that can be scheduled to start and stop
+    Any object that can be scheduled to start and stop. Implementations take
+    everything they need from the describe response when they are built so
+    that the scheduling never accesses the network
     """
     __metaclass__ = ABCMeta
+    __slots__ = ('_client',)
 
     def __init__(self, client, instance):
         if client is None:
@@ -44,7 +50,6 @@ class Schedulable(object):
             raise ValueError("Instance cannot be None.")
 
         self._client = client
-        self._instance = instance
 
     @abstractmethod
     def id(self):
@@ -81,58 +86,188 @@ class Schedulable(object):
         """ Stop the instance """
         raise NotImplementedError()
 
+    def to_record(self):
+        """ Minimal description of the resource, enough for from_record() """
+        return OrderedDict([('id', self.id()), ('state', self.status())])
+
+    @classmethod
+    def from_record(cls, client, record):
+        """ Builds the resource from a description made by to_record() """
+        raise NotImplementedError()
+
+    @classmethod
+    def start_batch(cls, instances):
+        """ Start a group of instances, returns how many have been started """
+        return Schedulable._single_calls(instances, lambda i: i.start())
+
+    @classmethod
+    def stop_batch(cls, instances):
+        """ Stop a group of instances, returns how many have been stopped """
+        return Schedulable._single_calls(instances, lambda i: i.stop())
+
+    @staticmethod
+    def _single_calls(instances, action):
+        """ Executes the action on each instance, isolating the failures """
+        executed = 0
+        for instance in instances:
+            try:
+                action(instance)
+                executed += 1
+            except Exception as e:
+                log.exception("Action Exception", extra=log_fields(instance=instance.id()))
+        return executed
+
 
 class EC2Schedulable(Schedulable):
     """
-    Representation of an EC2 instance being schedulable
+    Snapshot of an EC2 instance being schedulable, built from an item of the
+    response of DescribeInstances
     """
+    __slots__ = ('_id', '_status', '_start_time', '_stop_time', '_tags')
+
+    # Maximum number of instance IDs sent in a single StartInstances or
+    # StopInstances call
+    BATCH_SIZE = 50
+
     def __init__(self, client, instance):
         super(self.__class__, self).__init__(client, instance)
 
+        self._id = instance['InstanceId']
+        self._status = instance['State']['Name'].lower()
+        self._start_time = None
+        self._stop_time = None
+        self._tags = sorted(instance.get('Tags', []), key=lambda x: x['Key'])
+
+        if self._status == "running":
+            self._start_time = EC2Schedulable.parse_launch_time(instance.get('LaunchTime'))
+        elif self._status == "stopped":
+            self._stop_time = EC2Schedulable.parse_transition_time(instance.get('StateTransitionReason'))
+
+    @staticmethod
+    def parse_launch_time(launch_time):
+        """ The launch time as UTC time """
+        if not launch_time:
+            return None
+        if launch_time.tzinfo is None:
+            return tz.utc.localize(launch_time)
+        return launch_time.astimezone(tz.utc)
+
+    @staticmethod
+    def parse_transition_time(reason):
+        """ The UTC time in a reason like "User initiated (2018-05-04 03:02:01 GMT)" """
+        stop_time = re.findall('.*\((.*)\)', reason or "")
+        if len(stop_time) == 0:
+            return None
+        try:
+            stop_time = datetime.strptime(stop_time[0], '%Y-%m-%d %H:%M:%S %Z')
+        except ValueError:
+            return None
+        return tz.utc.localize(stop_time)
+
     def id(self):
-        return self._instance.instance_id
+        return self._id
 
     def start_time(self):
-        if self.status() == "running":
-            return tz.timezone('UTC').localize(
-                self._instance.launch_time,
-                is_dst=None
-            )
-        return None
+        return self._start_time
 
     def stop_time(self):
-        if self.status() == "stopped":
-            reason = self._instance.state_transition_reason
-            stop_time = re.findall('.*\((.*)\)', reason)[0]
-            stop_time = datetime.strptime(stop_time, '%Y-%m-%d %H:%M:%S %Z')
-            return tz.timezone('UTC').localize(stop_time, is_dst=None)
-        return None
+        return self._stop_time
 
     def status(self):
-        return self._instance.state['Name'].lower()
+        return self._status
 
     def tags(self):
-        return sorted(self._instance.tags, key=lambda x: x['Key'])
+        return self._tags
 
     def start(self):
-        self._instance.start()
+        retries.call(lambda: self._client.start_instances(InstanceIds=[self._id]))
         return True
 
     def stop(self):
-        self._instance.stop()
+        retries.call(lambda: self._client.stop_instances(InstanceIds=[self._id]))
         return True
 
+    @classmethod
+    def from_record(cls, client, record):
+        return cls(client, {
+            'InstanceId': record['id'],
+            'State': {'Name': record['state'] or ""},
+            'Tags': []
+        })
+
+    @classmethod
+    def start_batch(cls, instances):
+        return EC2Schedulable._batch_calls(instances, 'start_instances', lambda i: i.start())
+
+    @classmethod
+    def stop_batch(cls, instances):
+        return EC2Schedulable._batch_calls(instances, 'stop_instances', lambda i: i.stop())
+
+    @staticmethod
+    def _batch_calls(instances, method, fallback):
+        """
+        Calls the EC2 API "method" with chunks of up to BATCH_SIZE instance IDs
+        of the same client. When a chunk fails it falls back to the single
+        instance calls to isolate the instances in error
+        """
+        by_client = OrderedDict()
+        for instance in instances:
+            by_client.setdefault(id(instance._client), []).append(instance)
+
+        executed = 0
+        for client_instances in by_client.itervalues():
+            client = client_instances[0]._client
+            for i in range(0, len(client_instances), EC2Schedulable.BATCH_SIZE):
+                chunk = client_instances[i:i + EC2Schedulable.BATCH_SIZE]
+                try:
+                    retries.call(lambda: getattr(client, method)(InstanceIds=[c.id() for c in chunk]))
+                    executed += len(chunk)
+                except Exception as e:
+                    log.warning("Batch failed, using single instance calls", extra=log_fields(
+                        method=method, error=str(e), instances=len(chunk)
+                    ))
+                    executed += Schedulable._single_calls(chunk, fallback)
+
+        return executed
+
 
 class RDSSchedulable(Schedulable):
     """
-    Representation of an RDS instance being schedulable
+    Snapshot of an RDS instance being schedulable, built from an item of the
+    response of DescribeDBInstances. The tags are taken from "tags", if given,
+    or from the TagList included in the response. Only when neither is
+    available they are fetched with one ListTagsForResource call
     """
+    __slots__ = ('_id', '_identifier', '_arn', '_status', '_tags')
 
-    def __init__(self, client, instance):
+    # DBInstanceStatus of each status of a record
+    RECORD_STATUS = {'running': "available", 'stopped': "stopped"}
+
+    def __init__(self, client, instance, tags=None):
         super(self.__class__, self).__init__(client, instance)
 
+        self._id = instance['DbiResourceId']
+        self._identifier = instance['DBInstanceIdentifier']
+        self._arn = instance['DBInstanceArn']
+
+        status = instance['DBInstanceStatus'].lower()
+        if status == "available":
+            self._status = "running"
+        elif status == "stopped":
+            self._status = "stopped"
+        else:
+            self._status = None
+
+        if tags is None:
+            try:
+                tags = instance['TagList']
+            except KeyError:
+                tags = None
+
+        self._tags = sorted(tags, key=lambda x: x['Key']) if tags is not None else None
+
     def id(self):
-        return self._instance['DbiResourceId']
+        return self._id
 
     def start_time(self):
         # Not applicable for RDS
@@ -143,29 +278,34 @@ class RDSSchedulable(Schedulable):
         return None
 
     def status(self):
-        status = self._instance['DBInstanceStatus'].lower()
-        if status == "available":
-            return "running"
-        elif status == "stopped":
-            return "stopped"
-        return None
+        return self._status
 
     def tags(self):
-        tags = self._client.list_tags_for_resource(
-            ResourceName=self._instance['DBInstanceArn']
-        )
-        return sorted(tags['TagList'], key=lambda x: x['Key'])
+        if self._tags is None:
+            tags = retries.call(lambda: self._client.list_tags_for_resource(ResourceName=self._arn))
+            self._tags = sorted(tags['TagList'], key=lambda x: x['Key'])
+        return self._tags
+
+    def to_record(self):
+        record = super(self.__class__, self).to_record()
+        record['identifier'] = self._identifier
+        return record
+
+    @classmethod
+    def from_record(cls, client, record):
+        return cls(client, {
+            'DbiResourceId': record['id'],
+            'DBInstanceIdentifier': record['identifier'],
+            'DBInstanceArn': None,
+            'DBInstanceStatus': RDSSchedulable.RECORD_STATUS.get(record['state'], "unknown")
+        }, tags=[])
 
     def start(self):
-        self._client.start_db_instance(
-            DBInstanceIdentifier=self._instance['DBInstanceIdentifier']
-        )
+        retries.call(lambda: self._client.start_db_instance(DBInstanceIdentifier=self._identifier))
         return True
 
     def stop(self):
-        self._client.stop_db_instance(
-            DBInstanceIdentifier=self._instance['DBInstanceIdentifier']
-        )
+        retries.call(lambda: self._client.stop_db_instance(DBInstanceIdentifier=self._identifier))
         return True
 
 # vim: ft=python:ts=4:sw=4
\ No newline at end of file
@@ -25,21 +25,118 @@
 
 from __future__ import print_function
 
-import sys
-import traceback
 import pytz as tz
-import schedulable
 
 from abc import ABCMeta, abstractmethod
-from datetime import datetime, timedelta, time
+from cache import LRUCache
+from collections import namedtuple
+from datetime import datetime, timedelta
+from logger import *
+from timezones import local_midnight, utc_time
+
+
+# Maximum number of compiled tag values kept in memory
+SPEC_CACHE_SIZE = 1024
+
+# Maximum number of dates of which the UTC times of the daily specs are kept
+UTC_CACHE_DATES = 8
+
+# Group of the entry points of third party schedulers, each named after the
+# type of its scheduler
+SCHEDULERS_ENTRY_POINTS = "tagscheduler.schedulers"
+
+# Scheduler classes by type, filled by register_scheduler()
+SCHEDULERS = {}
+
+# Types without a scheduler, neither registered nor in the entry points
+unknown_schedulers = set()
+
+
+# Names of the days of the week as used in the tags, indexed by weekday()
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+# Bit of each day of the week in the masks of days, bit N for WEEKDAYS[N]
+DAY_BITS = dict((name, 1 << day) for day, name in enumerate(WEEKDAYS))
+
+# Masks of the groups of days. Masks are small integers, which are shared
+# by all the specs and cost no memory of their own
+ALL_DAYS = 0b1111111
+WORKING_DAYS = 0b0011111
+WEEKEND_DAYS = 0b1100000
+DAY_GROUPS = {'all': ALL_DAYS, 'weekdays': WORKING_DAYS, 'weekends': WEEKEND_DAYS}
+
+
+def day_names(mask):
+    """ Names of the days of the week in a mask of days """
+    return [name for name in WEEKDAYS if mask & DAY_BITS[name]]
+
+
+class RunContext(namedtuple('RunContext', ['now', 'time', 'day', 'decisions'])):
+    """
+    The UTC time of a run of the scheduler, frozen when the run starts, with
+    its time of the day and day of the week, as bit of the masks of days,
+    computed once for all schedulers. The decisions of the daily specs don't
+    depend on the instances and are kept for the whole run
+    """
+    __slots__ = ()
+
+    @staticmethod
+    def create(now=None):
+        """ Context for the time "now", or for the current time if omitted """
+        if now is None:
+            now = datetime.utcnow()
+        if now.tzinfo is None:
+            now = now.replace(tzinfo=tz.utc)
+        else:
+            now = now.astimezone(tz.utc)
+
+        return RunContext(
+            now,
+            now.time().replace(tzinfo=tz.utc),
+            1 << now.weekday(),
+            {}
+        )
+
+
+class EvaluationContext(namedtuple('EvaluationContext', ['run', 'status', 'status_time'])):
+    """
+    Immutable inputs of the evaluation of a scheduler: the RunContext, the
+    status of the instance and the UTC time it entered that status
+    """
+    __slots__ = ()
+
+    @property
+    def now(self):
+        """ The UTC time of the run """
+        return self.run.now
+
+    @staticmethod
+    def of(instance, run=None):
+        """ Takes the current state of the instance """
+        if run is None:
+            run = RunContext.create()
+
+        status = instance.status()
+        if status == 'running':
+            status_time = instance.start_time()
+        elif status == 'stopped':
+            status_time = instance.stop_time()
+        else:
+            status_time = None
+
+        return EvaluationContext(run, status, status_time)
 
 
 class Scheduler(object):
     """
-    A base type for any scheduler
+    A base type for any scheduler. Schedulers are never modified by check()
+    so they can be shared and evaluated concurrently
     """
     __metaclass__ = ABCMeta
 
+    # Compiled tag values shared by all the schedulers, keyed by (type, value)
+    spec_cache = LRUCache(SPEC_CACHE_SIZE)
+
     def __init__(self, instance, name, value):
         if instance is None:
             raise ValueError
@@ -47,7 +144,6 @@ class Scheduler(object):
         self._instance = instance
         self.name = name.strip() if name is not None else ""
         self.value = value.strip() if value is not None else ""
-        self._mock_now_time = None
 
     @abstractmethod
     def __str__(self):
@@ -60,34 +156,54 @@ class Scheduler(object):
         raise NotImplementedError()
 
     @abstractmethod
-    def check(self):
-        """ Checks what a scheduler would do on the instance given the tag """
+    def check(self, context=None):
+        """
+        Checks what a scheduler would do on the instance given the tag. The
+        decision depends only on the tag and on the EvaluationContext, which
+        is taken from the instance when not provided
+        """
+        raise NotImplementedError()
+
+    def next_transition(self, context=None):
+        """
+        The first UTC time after the time of the run at which check() would
+        give a different result, or None if the result doesn't change only
+        with the passing of time
+        """
+        return None
+
+    def context(self, run=None):
+        """ EvaluationContext of the instance in the run, or at the current time """
+        return EvaluationContext.of(self._instance, run)
+
+    @staticmethod
+    def parse(value):
+        """ Compiles a tag value into an immutable specification """
         raise NotImplementedError()
 
-    def now_utc(self):
-        """ Current or mock time in UTC """
-        if self._mock_now_time is not None:
-            return self._mock_now_time
-        return datetime.utcnow().replace(tzinfo=tz.utc)
+    @classmethod
+    def compile(cls, value):
+        """
+        Compiled specification of a tag value. Each distinct value is parsed
+        only once and the result is shared by all the schedulers using it
+        """
+        return Scheduler.spec_cache.lookup(
+            (cls.type(), value), lambda: cls.parse(value)
+        )
 
     @staticmethod
     def build(instance, sched_type, name, value):
         if sched_type is None:
             return None
 
-        if sched_type.lower() == DailyScheduler.type():
-            return DailyScheduler(instance, name, value)
-
-        elif sched_type.lower() == TimerScheduler.type():
-            return TimerScheduler(instance, name, value)
+        sched_type = sched_type.lower()
+        scheduler = SCHEDULERS.get(sched_type)
+        if scheduler is None:
+            scheduler = load_scheduler(sched_type)
+            if scheduler is None:
+                return None
 
-        elif sched_type.lower() == IgnoreScheduler.type():
-            return IgnoreScheduler(instance, name, value)
-
-        elif sched_type.lower() == FixedScheduler.type():
-            return FixedScheduler(instance, name, value)
-
-        return None
+        return scheduler(instance, name, value)
 
     @staticmethod
     def parse_timezone(timezone):
@@ -100,44 +216,85 @@ class Scheduler(object):
         )
 
     @staticmethod
-    def parse_time(str_time, timezone):
-        """ Parses a string time as UTC time """
+    def parse_local_time(str_time):
+        """ Parses a string time as time of the day, without time zone """
         if str_time is None:
             return None
         str_time = str_time.strip()
         if str_time == "":
             return None
 
-        # Parsing
-        time = datetime.strptime(str_time, '%H%M')
-
-        # Timezone
-        timezone = Scheduler.parse_timezone(timezone)
-        if timezone is not None:
-            time = timezone.localize(time, is_dst=None).astimezone(tz.utc)
-
-        # Only return time
-        return time.time().replace(tzinfo=tz.utc)
+        return datetime.strptime(str_time, '%H%M').time()
 
     @staticmethod
     def parse_day(days):
-        """ Parses a string day of the week into a list """
+        """
+        Parses a string day of the week into a mask of days, see DAY_BITS.
+        Unknown names of days are ignored
+        """
         if days is None:
             return None
         days = days.strip().lower()
         if days == "":
             days = "all"
 
-        if days == "weekdays":
-            return ['mon', 'tue', 'wed', 'thu', 'fri']
-        elif days == "weekends":
-            return ['sat', 'sun']
-        elif days == "all":
-            return ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+        if days in DAY_GROUPS:
+            return DAY_GROUPS[days]
+
+        mask = 0
+        for day in days.split("."):
+            mask |= DAY_BITS.get(day, 0)
+        return mask
+
+
+def register_scheduler(scheduler):
+    """
+    Class decorator that makes a Scheduler available to Scheduler.build()
+    under its type
+    """
+    SCHEDULERS[scheduler.type().lower()] = scheduler
+    unknown_schedulers.discard(scheduler.type().lower())
+    return scheduler
+
+
+def load_scheduler(sched_type):
+    """
+    Registers the scheduler of the type "sched_type" from the entry points
+    of the installed packages, or returns None if there isn't any. The entry
+    points are only read for types that are not registered, once per type
+    """
+    if sched_type in unknown_schedulers:
+        return None
+
+    try:
+        import pkg_resources
+    except ImportError:
+        pkg_resources = None
+
+    if pkg_resources is not None:
+        for entry_point in pkg_resources.iter_entry_points(SCHEDULERS_ENTRY_POINTS, sched_type):
+            try:
+                scheduler = entry_point.load()
+            except Exception:
+                log.exception("Invalid scheduler entry point", extra=log_fields(
+                    scheduler=sched_type, entry_point=str(entry_point)
+                ))
+                continue
+            SCHEDULERS[sched_type] = scheduler
+            return scheduler
 
-        return days.split(".")
+    unknown_schedulers.add(sched_type)
+    return None
 
 
+# Compiled tag value of a TimerScheduler
+TimerSpec = namedtuple('TimerSpec', ['error', 'action', 'timer'])
+
+# Compiled tag value of a DailyScheduler
+DailySpec = namedtuple('DailySpec', ['error', 'time_zone', 'start_time', 'stop_time', 'days_active'])
+
+
+@register_scheduler
 class TimerScheduler(Scheduler):
     """
     Starts or stop an instance after a predetermined amount of time.
@@ -149,34 +306,39 @@ class TimerScheduler(Scheduler):
     """
     def __init__(self, instance, name, value):
         super(self.__class__, self).__init__(instance, name, value)
-        self._error = False
+
+        self._spec = TimerScheduler.compile(self.value)
+        self._error = self._spec.error
+        self.action = self._spec.action
+        self.timer = self._spec.timer
+
+    @staticmethod
+    def parse(value):
+        """ Compiles the tag value into a TimerSpec """
+        error = TimerSpec(True, None, None)
 
         # Check for bad values
-        if self.value is None or self.value == "":
-            print("None or empty value", file=sys.stderr)
-            self._error = True
-            return
+        if value is None or value == "":
+            log.warning("None or empty value", extra=log_fields(scheduler="timer", value=value))
+            return error
 
-        fields = self.value.split("/")
+        fields = value.split("/")
 
         # Check fields
         if len(fields) != 2:
-            print("Wrong number of fields", file=sys.stderr)
-            self._error = True
-            return
+            log.warning("Wrong number of fields", extra=log_fields(scheduler="timer", value=value))
+            return error
 
         # Interpreting tag
         try:
-            self.action = fields[0].lower()
-            if self.action not in ["start", "stop"]:
-                self._error = True
-                return
+            action = fields[0].lower()
+            if action not in ["start", "stop"]:
+                return error
             minutes = int(fields[1] if fields[1] != "" else "0")
-            self.timer = timedelta(minutes=minutes)
+            return TimerSpec(False, action, timedelta(minutes=minutes))
         except Exception as e:
-            print("Exception: %s" % e.message, file=sys.stderr)
-            self._error = True
-            return
+            log.warning("Invalid value: %s" % e, extra=log_fields(scheduler="timer", value=value))
+            return error
 
     def __str__(self):
         if self._error:
@@ -190,33 +352,54 @@ class TimerScheduler(Scheduler):
     def type():
         return "timer"
 
-    def check(self):
+    def check(self, context=None):
         if self._error:
             return "error"
 
+        if context is None:
+            context = self.context()
+
         # Instance up/down time
-        if self._instance.status() == 'running':
-            instance_time = self._instance.start_time()
-            if self.action == "start":
-                self.action = None
-        elif self._instance.status() == 'stopped':
-            instance_time = self._instance.stop_time()
-            if self.action == "stop":
-                self.action = None
+        action = self.action
+        if context.status == 'running':
+            if action == "start":
+                action = None
+        elif context.status == 'stopped':
+            if action == "stop":
+                action = None
         else:
             return None
 
         # Cases when the time is not defined
-        if instance_time is None:
+        if context.status_time is None:
             return None
 
         # If the instance must be started or stopped
-        if (self.now_utc() - instance_time) > self.timer:
-            return self.action
+        if (context.now - context.status_time) > self.timer:
+            return action
 
         return None
 
+    def next_transition(self, context=None):
+        if self._error:
+            return None
+
+        if context is None:
+            context = self.context()
 
+        # Only the action opposite to the status becomes due with time
+        if (context.status, self.action) not in [('running', "stop"), ('stopped', "start")]:
+            return None
+        if context.status_time is None:
+            return None
+
+        transition = context.status_time + self.timer
+        if transition < context.now:
+            return None
+        return transition
+
+
+@register_scheduler
 class DailyScheduler(Scheduler):
     """
     Starts or stop an instance based on the specified time each one of the
@@ -238,102 +421,243 @@ class DailyScheduler(Scheduler):
        the default is UTC.
 
     """
+    # Next transitions of the compiled tag values, keyed by (spec, time of the
+    # run) as they don't depend on the instance
+    transition_cache = LRUCache(SPEC_CACHE_SIZE)
+
+    # UTC start and stop times of the compiled tag values, as the offset of
+    # the time zone changes with the date, as {local date: {spec: times}}.
+    # They are read on each check so plain dicts are used instead of an
+    # LRUCache
+    utc_cache = {}
+
+    # Dates in the time zones of the tags at the times of the recent runs,
+    # as {(time zone, UTC time): date}
+    date_cache = {}
+
     def __init__(self, instance, name, value):
         super(self.__class__, self).__init__(instance, name, value)
-        self._error = False
+
+        self._spec = DailyScheduler.compile(self.value)
+        self._error = self._spec.error
+        self.time_zone = self._spec.time_zone
+        self.start_time = self._spec.start_time
+        self.stop_time = self._spec.stop_time
+        self.days_active = self._spec.days_active
+
+    @staticmethod
+    def parse(value):
+        """ Compiles the tag value into a DailySpec """
+        error = DailySpec(True, None, None, None, None)
 
         # Check for bad values
-        if self.value is None or self.value == "":
-            print("None or empty value", file=sys.stderr)
-            self._error = True
-            return
+        if value is None or value == "":
+            log.warning("None or empty value", extra=log_fields(scheduler="daily", value=value))
+            return error
 
         # Extract the parameters
-        fields = self.value.split("/")
+        fields = value.split("/")
 
         # Check fields
         if len(fields) < 2 or len(fields) > 4:
-            print("Wrong number of fields", file=sys.stderr)
-            self._error = True
-            return
+            log.warning("Wrong number of fields", extra=log_fields(scheduler="daily", value=value))
+            return error
 
         try:
             # Time zone
-            self.time_zone = fields[3] if len(fields) > 3 and fields[3] != "" else "UTC"
+            time_zone = fields[3] if len(fields) > 3 and fields[3] != "" else "UTC"
+
+            Scheduler.parse_timezone(time_zone)
 
-            # Time the instance has to start
-            self.start_time = Scheduler.parse_time(fields[0], self.time_zone)
+            # Time the instance has to start, in the time zone
+            start_time = Scheduler.parse_local_time(fields[0])
 
-            # Time the instance has to stop
-            self.stop_time = Scheduler.parse_time(fields[1], self.time_zone)
+            # Time the instance has to stop, in the time zone
+            stop_time = Scheduler.parse_local_time(fields[1])
 
             # Parsing day
             days_active = fields[2] if len(fields) > 2 else "all"
-            self.days_active = Scheduler.parse_day(days_active)
+            days_active = Scheduler.parse_day(days_active)
+
+            return DailySpec(False, time_zone, start_time, stop_time, days_active)
 
         except Exception as e:
-            print("-" * 80, file=sys.stderr)
-            traceback.print_exc(file=sys.stderr)
-            print("-" * 80, file=sys.stderr)
-            self._error = True
-            return
+            log.exception("Invalid value", extra=log_fields(scheduler="daily", value=value))
+            return error
 
     def __str__(self):
         if self._error:
             return "DailyScheduler: ERROR"
 
-        return "DailyScheduler, Name: \"%s\", Start: %sUTC, Stop: %sUTC, Days: %s" % (
+        return "DailyScheduler, Name: \"%s\", Start: %s, Stop: %s, Time Zone: %s, Days: %s" % (
             self.name,
             self.start_time,
             self.stop_time,
-            ','.join(self.days_active)
+            self.time_zone,
+            ','.join(day_names(self.days_active))
         )
 
     @staticmethod
     def type():
         return "daily"
 
-    def check(self):
+    def check(self, context=None):
         # Protection in case of None value
         if self._error:
             return "error"
 
+        if context is None:
+            context = self.context()
+
+        # Instances with the same spec get the same decision in a run
+        decisions = context.run.decisions
+        try:
+            return decisions[self._spec]
+        except KeyError:
+            pass
+
+        date = DailyScheduler.local_date(self._spec.time_zone, context.now)
+        start_time, stop_time = DailyScheduler.utc_times(self._spec, date)
+        decision = self.decision(context.run.day, context.run.time, start_time, stop_time)
+        decisions[self._spec] = decision
+        return decision
+
+    @staticmethod
+    def local_date(time_zone, now):
+        """ The date in the time zone "time_zone" of a tag at the UTC time "now" """
+        key = (time_zone, now)
+        try:
+            return DailyScheduler.date_cache[key]
+        except KeyError:
+            pass
+
+        date = now.astimezone(Scheduler.parse_timezone(time_zone)).date()
+        if len(DailyScheduler.date_cache) >= SPEC_CACHE_SIZE:
+            DailyScheduler.date_cache.clear()
+        DailyScheduler.date_cache[key] = date
+        return date
+
+    @staticmethod
+    def utc_times(spec, date):
+        """
+        The UTC start and stop times of a valid DailySpec on the date "date"
+        of its time zone
+        """
+        try:
+            return DailyScheduler.utc_cache[date][spec]
+        except KeyError:
+            pass
+
+        zone = Scheduler.parse_timezone(spec.time_zone)
+        times = tuple(
+            None if t is None else utc_time(zone, date, t)
+            for t in (spec.start_time, spec.stop_time)
+        )
+
+        # Only the dates of about a week, the ones of the next transitions,
+        # and up to SPEC_CACHE_SIZE specs for each date are kept
+        by_date = DailyScheduler.utc_cache.get(date)
+        if by_date is None:
+            if len(DailyScheduler.utc_cache) > UTC_CACHE_DATES:
+                DailyScheduler.utc_cache.pop(min(DailyScheduler.utc_cache), None)
+            by_date = DailyScheduler.utc_cache.setdefault(date, {})
+        if len(by_date) >= SPEC_CACHE_SIZE:
+            by_date.clear()
+        by_date[spec] = times
+        return times
+
+    def decision(self, day, now_time, start_time, stop_time):
+        """
+        The action on the UTC day of the week "day", a bit of DAY_BITS, at the
+        UTC time "now_time" with the UTC times "start_time" and "stop_time"
+        """
         # Check day of the week
-        now_weekday = self.now_utc().strftime("%a").lower()
-        if now_weekday not in self.days_active:
+        if not self.days_active & day:
             return None
 
-        now_time = self.now_utc().time().replace(tzinfo=tz.utc)
-
         # No time range specified (weird...)
-        if self.start_time is None and self.stop_time is None:
+        if start_time is None and stop_time is None:
             return None
 
         # No start time
-        if self.start_time is None:
-            if now_time >= self.stop_time:
+        if start_time is None:
+            if now_time >= stop_time:
                 return "stop"
             return None
 
         # No stop time
-        if self.stop_time is None:
-            if now_time < self.start_time:
+        if stop_time is None:
+            if now_time < start_time:
                 return "start"
             return None
 
         # When the start is after the stop
-        if self.start_time > self.stop_time:
-            self.start_time, self.stop_time = self.stop_time, self.start_time
+        if start_time > stop_time:
+            start_time, stop_time = stop_time, start_time
 
-        if now_time >= self.start_time and now_time < self.stop_time:
+        if now_time >= start_time and now_time < stop_time:
             return "start"
-        elif now_time >= self.stop_time:
+        elif now_time >= stop_time:
             return "stop"
 
         # Something else
         return None
 
+    def next_transition(self, context=None):
+        if self._error:
+            return None
+
+        if context is None:
+            context = self.context()
+
+        return DailyScheduler.transition_cache.lookup(
+            (self._spec, context.now), lambda: self._next_transition(context.run)
+        )
+
+    def _next_transition(self, run):
+        # The decision can only change at UTC midnight, when the day of the
+        # week changes, at local midnight, when the UTC start and stop times
+        # can change with the offset of the time zone, or when the UTC time of
+        # the day reaches the start and stop times of the local date. These
+        # are checked in order for a week of local days, after which the
+        # decisions repeat unless the offset changes
+        spec = self._spec
+        zone = Scheduler.parse_timezone(spec.time_zone)
+        now = run.now
+        current = self.decision(
+            run.day, run.time, *DailyScheduler.utc_times(spec, DailyScheduler.local_date(spec.time_zone, now))
+        )
+
+        candidates = set()
+        first = now.astimezone(zone).date()
+        for day in range(len(WEEKDAYS) + 1):
+            date = first + timedelta(days=day)
+            day_start = local_midnight(zone, date)
+            day_end = local_midnight(zone, date + timedelta(days=1))
+            candidates.add(day_start)
+
+            # The local day spans one or two UTC days
+            utc_midnight = day_start.replace(hour=0, minute=0, second=0, microsecond=0)
+            for utc_day in [utc_midnight, utc_midnight + timedelta(days=1)]:
+                if day_start < utc_day < day_end:
+                    candidates.add(utc_day)
+                for t in DailyScheduler.utc_times(spec, date):
+                    if t is not None:
+                        when = utc_day + timedelta(hours=t.hour, minutes=t.minute)
+                        if day_start <= when < day_end:
+                            candidates.add(when)
+
+        for when in sorted(candidates):
+            if when <= now:
+                continue
+            times = DailyScheduler.utc_times(spec, when.astimezone(zone).date())
+            if self.decision(1 << when.weekday(), when.time().replace(tzinfo=tz.utc), *times) != current:
+                return when
+
+        return None
+
 
+@register_scheduler
 class IgnoreScheduler(Scheduler):
     """
     This scheduler is meant to do no work on the instances, useful for debugging,
@@ -355,12 +679,13 @@ class IgnoreScheduler(Scheduler):
     def type():
         return "ignore_all"
 
-    def check(self):
+    def check(self, context=None):
         if self._error:
             return "error"
         return "ignore"
 
 
+@register_scheduler
 class FixedScheduler(Scheduler):
     """
     Keeps an instance always started or stopped, useful for debugging or safety.
@@ -388,7 +713,7 @@ class FixedScheduler(Scheduler):
     def type():
         return "fixed"
 
-    def check(self):
+    def check(self, context=None):
         if self._error:
             return "error"
         return self.value
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import os
+import json
+import hashlib
+import calendar
+import threading
+from abc import ABCMeta, abstractmethod
+from collections import namedtuple
+from datetime import datetime
+
+import boto3
+import pytz as tz
+import boto3.session
+from logger import *
+
+
+# Changing it invalidates all the stored states, for instance when the
+# decisions of the schedulers change for the same tags
+STATE_VERSION = 1
+
+# Maximum number of items of a DynamoDB BatchWriteItem call
+DYNAMODB_BATCH_SIZE = 25
+
+# Attempts to write the items not processed by a DynamoDB BatchWriteItem
+DYNAMODB_WRITE_ATTEMPTS = 5
+
+
+# What was decided on an instance in the last run that evaluated it. The
+# next transition is in seconds since the epoch, rounded down
+StateRecord = namedtuple('StateRecord', ['fingerprint', 'state', 'decision', 'next_transition'])
+
+
+def instance_fingerprint(instance, context):
+    """
+    A hash of everything the decision on an instance depends on, apart from
+    the time: its tags, its status and the time it entered the status
+    """
+    inputs = (STATE_VERSION, sorted((t['Key'], t['Value']) for t in instance.tags()), context.status, context.status_time)
+    return hashlib.sha1(repr(inputs)).hexdigest()
+
+
+def epoch_seconds(when):
+    """ Seconds since the epoch of a UTC datetime, None for None """
+    if when is None:
+        return None
+    return calendar.timegm(when.utctimetuple())
+
+
+def from_epoch_seconds(seconds):
+    """ UTC datetime of the seconds since the epoch, None for None """
+    if seconds is None:
+        return None
+    return datetime.fromtimestamp(seconds, tz.utc)
+
+
+def create_state_store(url, endpoint_url=None):
+    """
+    The StateStore described by "url": "file:<path>" for a FileStateStore or
+    "dynamodb:<table>" for a DynamoDBStateStore, using "endpoint_url" when
+    given. None for an empty url
+    """
+    if not url:
+        return None
+
+    backend, _, location = url.partition(":")
+    if backend == "file" and location:
+        return FileStateStore(location)
+    if backend == "dynamodb" and location:
+        return DynamoDBStateStore(location, endpoint_url=endpoint_url)
+
+    raise ValueError("Invalid state store %s" % url)
+
+
+class StateStore(object):
+    """
+    Storage of the StateRecord of the instances, by region and by instance
+    key. Implementations must be thread safe
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def load(self, region):
+        """ Dictionary {key: StateRecord} of all the instances of a region """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def save(self, region, records, removed=()):
+        """ Writes the {key: StateRecord} "records" and deletes the keys "removed" """
+        raise NotImplementedError()
+
+
+class FileStateStore(StateStore):
+    """
+    Stores the states of all the regions in a JSON file. The file is read
+    once and rewritten as a whole by each save()
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._regions = None
+
+    def _read(self):
+        if self._regions is None:
+            try:
+                with open(self.path, 'r') as f:
+                    self._regions = json.load(f)
+            except IOError:
+                self._regions = {}
+            except ValueError:
+                log.warning("Invalid state file, starting over", extra=log_fields(path=self.path))
+                self._regions = {}
+        return self._regions
+
+    def load(self, region):
+        with self._lock:
+            records = self._read().get(region, {})
+            return dict((k, StateRecord(*v)) for k, v in records.iteritems())
+
+    def save(self, region, records, removed=()):
+        with self._lock:
+            regions = self._read()
+            stored = regions.setdefault(region, {})
+            for key in removed:
+                stored.pop(key, None)
+            for key, record in records.iteritems():
+                stored[key] = list(record)
+
+            # Replaced atomically so a failed run never leaves a partial file
+            temp_path = "%s.tmp" % self.path
+            with open(temp_path, 'w') as f:
+                json.dump(regions, f)
+            os.rename(temp_path, self.path)
+
+
+class DynamoDBStateStore(StateStore):
+    """
+    Stores the states in a DynamoDB table with partition key "region" and
+    sort key "instance", both strings. "endpoint_url" can point to any
+    compatible service, like DynamoDB Local
+    """
+    def __init__(self, table, client=None, endpoint_url=None):
+        self.table = table
+        self.endpoint_url = endpoint_url
+        self._client = client
+        self._lock = threading.Lock()
+
+    def client(self):
+        """ The DynamoDB client, created on first use and shared by all threads """
+        with self._lock:
+            if self._client is None:
+                session = boto3.session.Session()
+                self._client = session.client('dynamodb', endpoint_url=self.endpoint_url)
+            return self._client
+
+    def load(self, region):
+        records = {}
+        paginator = self.client().get_paginator('query')
+        pages = paginator.paginate(
+            TableName=self.table,
+            KeyConditionExpression="#r = :r",
+            ExpressionAttributeNames={'#r': "region"},
+            ExpressionAttributeValues={':r': {'S': region}}
+        )
+        for page in pages:
+            for item in page['Items']:
+                records[item['instance']['S']] = DynamoDBStateStore.from_item(item)
+        return records
+
+    def save(self, region, records, removed=()):
+        requests = [
+            {'PutRequest': {'Item': DynamoDBStateStore.to_item(region, key, record)}}
+            for key, record in records.iteritems()
+        ]
+        requests.extend(
+            {'DeleteRequest': {'Key': {'region': {'S': region}, 'instance': {'S': key}}}}
+            for key in removed
+        )
+
+        for i in range(0, len(requests), DYNAMODB_BATCH_SIZE):
+            self._write(requests[i:i + DYNAMODB_BATCH_SIZE])
+
+    def _write(self, requests):
+        """ Writes a batch retrying the items not processed """
+        for _ in range(DYNAMODB_WRITE_ATTEMPTS):
+            response = self.client().batch_write_item(RequestItems={self.table: requests})
+            requests = response.get('UnprocessedItems', {}).get(self.table, [])
+            if not requests:
+                return
+        log.warning("State items not written", extra=log_fields(table=self.table, items=len(requests)))
+
+    @staticmethod
+    def to_item(region, key, record):
+        """ DynamoDB item of a StateRecord """
+        def string(value):
+            return {'S': value} if value is not None else {'NULL': True}
+
+        return {
+            'region': {'S': region},
+            'instance': {'S': key},
+            'fingerprint': string(record.fingerprint),
+            'state': string(record.state),
+            'decision': string(record.decision),
+            'next_transition': {'N': str(record.next_transition)} if record.next_transition is not None else {'NULL': True},
+        }
+
+    @staticmethod
+    def from_item(item):
+        """ StateRecord of a DynamoDB item """
+        def value(name):
+            return item.get(name, {}).get('S')
+
+        next_transition = item.get('next_transition', {}).get('N')
+        return StateRecord(
+            value('fingerprint'),
+            value('state'),
+            value('decision'),
+            int(next_transition) if next_transition is not None else None
+        )
+
+
+class RegionState(object):
+    """
+    The states of the instances of a region during a run: the ones loaded
+    from the StateStore and the ones updated by the run
+    """
+    def __init__(self, store, region):
+        self.store = store
+        self.region = region
+        self.records = store.load(region)
+        self.updates = {}
+        self.seen = set()
+        self.skipped = 0
+
+    @staticmethod
+    def key(i_type, instance_id):
+        return "%s:%s" % (i_type, instance_id)
+
+    def skippable(self, i_type, instance_id, fingerprint, now):
+        """
+        The stored StateRecord of an instance if it doesn't need to be
+        evaluated again: its inputs didn't change, no action was required and
+        its next transition hasn't arrived. None otherwise
+        """
+        key = RegionState.key(i_type, instance_id)
+        self.seen.add(key)
+
+        record = self.records.get(key)
+        if record is None or record.fingerprint != fingerprint or record.decision is not None:
+            return None
+        if record.next_transition is not None and record.next_transition <= epoch_seconds(now):
+            return None
+
+        self.skipped += 1
+        return record
+
+    def found(self, i_type, instance_id):
+        """ Marks an instance as found in the region, save() keeps its record """
+        self.seen.add(RegionState.key(i_type, instance_id))
+
+    def update(self, i_type, instance_id, record):
+        """ Sets the new StateRecord of an instance, written by save() if changed """
+        key = RegionState.key(i_type, instance_id)
+        self.found(i_type, instance_id)
+        if self.records.get(key) != record:
+            self.updates[key] = record
+
+    def save(self, full=True):
+        """
+        Writes the updated records. After a run on all the instances of the
+        region, "full", the records of the instances not found are deleted
+        """
+        removed = [k for k in self.records if k not in self.seen] if full else []
+        if self.updates or removed:
+            self.store.save(self.region, self.updates, removed)
+
+# vim: ft=python:ts=4:sw=4
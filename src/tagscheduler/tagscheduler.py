@@ -26,111 +26,739 @@
 from __future__ import print_function
 
 import os
-import traceback
+import re
+import sys
+import Queue
+import logging
+import threading
+from collections import OrderedDict
+from timeit import default_timer
 
 from awsobjects import *
+from deadline import Deadline
+from events import *
+from fanout import *
+from logger import *
+from metrics import metrics
+from plan import *
 from schedulers import *
 from schedulable import *
+from statestore import *
+from throttling import DEFAULT_RETRY_BUDGET, reset_throttling
+from transitions import *
 
 
 # Prefix of all tags that are schedulers
 SCHEDULER_PREFIX="scheduler"
 
+# Keys of the scheduler tags, "<prefix>-<type>[-<name>]", capturing the type
+# and the name. Anything after the name is ignored
+SCHEDULER_TAG_RE=re.compile(r'%s-([^-]*)(?:-([^-]*))?' % re.escape(SCHEDULER_PREFIX))
+
+# Number of regions processed at the same time when not configured
+DEFAULT_REGION_CONCURRENCY=1
+
+# Dimensions of the metrics in CloudWatch Embedded Metric Format
+EMF_DIMENSIONS={'Service': "TagScheduler"}
+
+# Order of execution of the actions, stopping first saves on costs
+ACTION_PRIORITY={'stop': 0, 'start': 1}
+
+# Number of times the work left by a run is handed off to a new invocation
+MAX_HANDOFFS=3
+
 
 def lambda_handler(event, context):
-    """ AWS Lambda Function entry point """
+    """
+    AWS Lambda Function entry point. Events that target specific resources,
+    see parse_event(), evaluate only those resources. The work that doesn't
+    fit in the time of the invocation is continued by a new invocation.
+    With FANOUT_SHARDS set the scheduled runs are split among workers, see
+    run_coordinator(). It returns the metrics of the run
+    """
     run_on_regions = filter(None, os.environ.get('RUN_ON_REGIONS', "").split(','))
-    run_tagscheduler(run_on_regions)
+    targets = parse_event(event)
+
+    shards = get_fanout_shards()
+    if targets is None and shards is not None:
+        return run_coordinator(run_on_regions, shards, get_invoker(context), get_state_store())
 
+    shard = parse_shard(event)
+    return run_tagscheduler(
+        run_on_regions, get_region_concurrency(), targets, get_state_store(),
+        Deadline.of_lambda(context), get_handoff(context, event_handoffs(event), shard), shard
+    )
 
-def run_tagscheduler(run_on_regions=[]):
+
+def get_handoff(context, handoffs=0, shard=None):
     """
-    Runs the schedulers on the resources of various regions
+    The function that passes the work left by a run to a new asynchronous
+    invocation of the Lambda function of "context", see hand_off(). None
+    when the function is unknown or the work has been passed too many times
     """
-    print("Running Tag Scheduler")
+    function = getattr(context, 'invoked_function_arn', None)
+    if not isinstance(function, basestring) or handoffs >= MAX_HANDOFFS:
+        return None
+    return lambda targets, regions: invoke_function(
+        function, continuation_event(targets, regions, handoffs + 1, shard)
+    )
+
 
-    # Going through all the AWS regions
+def get_fanout_shards():
+    """
+    Reads from the environment the shards of the fan-out, see
+    parse_fanout_shards(). None when not configured or invalid
+    """
     try:
-        if run_on_regions == []:
-            run_on_regions = get_all_regions()
+        return parse_fanout_shards(os.environ.get('FANOUT_SHARDS', ""))
+    except ValueError as e:
+        log.warning("Invalid fan-out shards", extra=log_fields(error=str(e)))
+        return None
+
+
+def get_invoker(context):
+    """
+    The Invoker of the workers: the Lambda function of "context" or, when
+    not running in Lambda, this process
+    """
+    function = getattr(context, 'invoked_function_arn', None)
+    if isinstance(function, basestring):
+        return LambdaInvoker(function)
+    return LocalInvoker(lambda_handler)
+
+
+def run_coordinator(run_on_regions, shards, invoker, store=None):
+    """
+    Splits a run among workers, one for each shard of each region, see
+    worker_events(), and invokes them with "invoker". The regions with more
+    than one shard are described here once, see discover_instances(), and
+    each worker is a run targeted to the instances of its shard. As the
+    workers don't see the whole region, the records of the StateStore
+    "store" of the instances not found are deleted here. It returns the
+    summary of fan_out()
+    """
+    log.info("Coordinating Tag Scheduler")
+
+    regions = get_regions(run_on_regions)
+    if regions is None:
+        return None
+
+    summary = fan_out(worker_events(regions, shards, lambda r: discover_instances(r, store)), invoker)
+    log.info("Fan-out summary", extra=log_fields(regions=len(regions), **summary))
+    return summary
+
+
+def discover_instances(region, store=None):
+    """
+    The IDs of the instances of a region with scheduler tags, as
+    {type: [id, ...]}. With a StateStore "store" the records of the other
+    instances of the region are deleted from it
+    """
+    session = get_session(region)
+    ids = OrderedDict(
+        (i_type, [instance.id() for instance in i_list])
+        for i_type, i_list in get_all_instances(region, session, SCHEDULER_PREFIX).iteritems()
+    )
+
+    state = load_region_state(store, region)
+    if state is not None:
+        for i_type, i_ids in ids.iteritems():
+            for instance_id in i_ids:
+                state.found(i_type, instance_id)
+        save_region_state(state)
+
+    return ids
+
+
+def get_region_concurrency():
+    """
+    Reads from the environment the number of regions to process concurrently
+    """
+    try:
+        concurrency = int(os.environ.get('REGION_CONCURRENCY', DEFAULT_REGION_CONCURRENCY))
+    except ValueError:
+        return DEFAULT_REGION_CONCURRENCY
+    return max(1, concurrency)
+
+
+def get_retry_budget():
+    """
+    Reads from the environment the seconds a run can spend retrying the calls
+    failed because of throttling
+    """
+    try:
+        budget = float(os.environ.get('RETRY_BUDGET', DEFAULT_RETRY_BUDGET))
+    except ValueError:
+        return DEFAULT_RETRY_BUDGET
+    return max(0.0, budget)
+
+
+def get_state_store():
+    """
+    The StateStore configured in the environment by STATE_STORE, see
+    create_state_store(), or None when not configured or invalid
+    """
+    try:
+        return create_state_store(
+            os.environ.get('STATE_STORE', ""),
+            os.environ.get('STATE_STORE_ENDPOINT') or None
+        )
+    except Exception as e:
+        log.exception("State Store Exception")
+        return None
 
-        for region in run_on_regions:
-            print("\nWorking on region \"%s\":" % region)
+
+def run_tagscheduler(run_on_regions=[], concurrency=DEFAULT_REGION_CONCURRENCY, targets=None, store=None,
+                     deadline=None, handoff=None, shard=None):
+    """
+    Runs the schedulers on the resources of various regions. When "targets"
+    is given, a dictionary {region: {type: [id, ...]}}, only those resources
+    are evaluated, or all the resources of the regions mapped to None. With a
+    StateStore "store" the instances that didn't change since their last
+    evaluation are skipped.
+
+    All the regions are evaluated before executing any action, then the
+    actions are executed by priority, see execute_pending(). Once the
+    Deadline "deadline" expires no more regions are evaluated nor actions
+    executed, and the work left is passed to "handoff", see hand_off(). With
+    a "shard" (index, count) only the instances in it are evaluated, see
+    in_shard(). It returns the metrics of the run
+    """
+    log.info("Running Tag Scheduler")
+    metrics.reset()
+
+    deadline = deadline or Deadline()
+    retry_budget = get_retry_budget()
+    if deadline.remaining() is not None:
+        retry_budget = min(retry_budget, deadline.remaining())
+    reset_throttling(retry_budget)
+
+    if targets is None:
+        run_on_regions = get_regions(run_on_regions)
+        if run_on_regions is None:
+            return metrics.report()
+    else:
+        run_on_regions = [r for r in targets if run_on_regions == [] or r in run_on_regions]
+        log.info("Targeted run", extra=log_fields(
+            regions=run_on_regions,
+            instances=sum(len(ids) for r in run_on_regions for ids in (targets[r] or {}).itervalues())
+        ))
+        if not run_on_regions:
+            return metrics.report()
+
+    # All the regions and instances are evaluated at the same time
+    run = RunContext.create()
+    index = TransitionIndex()
+    pending = []
+    deferred = []
+
+    def process(region, run):
+        if deadline.expired():
+            deferred.append(region)
+            return
+        ids = targets[region] if targets is not None else None
+        process_region(region, run, index, ids, store, pending, shard)
+
+    with metrics.timer("run"):
+        run_regions(run_on_regions, concurrency, run, process)
+        left = execute_pending(pending, deadline)
+
+    if deferred or left:
+        hand_off(handoff, deferred, left, targets)
+
+    log.info("Compiled schedulers cache", extra=log_fields(**Scheduler.spec_cache.stats()))
+    log.info("Sessions cache", extra=log_fields(**sessions_cache.stats()))
+    report_transitions(index, run)
+    report_metrics()
+    return metrics.report()
+
+
+def plan_tagscheduler(run_on_regions, stream, concurrency=DEFAULT_REGION_CONCURRENCY):
+    """
+    Runs the schedulers on the resources of various regions like
+    run_tagscheduler() but instead of starting and stopping the instances it
+    writes the decisions on "stream" as a plan, see apply_plan()
+    """
+    log.info("Planning Tag Scheduler")
+    metrics.reset()
+
+    run_on_regions = get_regions(run_on_regions)
+    if run_on_regions is None:
+        return
+
+    writer = PlanWriter(stream)
+    with metrics.timer("run"):
+        run_regions(
+            run_on_regions, concurrency, RunContext.create(),
+            lambda region, run: plan_region(region, writer, run)
+        )
+
+    log.info("Plan written", extra=log_fields(instances=writer.count))
+    report_metrics()
+
+
+def apply_plan(stream):
+    """
+    Executes the actions of a plan written by plan_tagscheduler(). The plan is
+    applied as it is, without checking the instances again
+    """
+    log.info("Applying Tag Scheduler plan")
+    metrics.reset()
+    reset_throttling(get_retry_budget())
+
+    # Group the actions by region and type of instance
+    regions = OrderedDict()
+    for record in read_plan(stream):
+        if record['action'] is None:
+            continue
+        i_types = regions.setdefault(record['region'], OrderedDict())
+        i_types.setdefault(record['type'], []).append(record)
+
+    for region, i_types in regions.iteritems():
+        try:
+            session = get_session(region)
 
             instance_actions = []
-            for i_type, i_list in get_all_instances(region).iteritems():
-                print("  Checking %s instances:" % i_type)
-                for instance in i_list:
-                    try:
-                        instance_actions.append(
-                            (instance, process_instance(instance))
-                        )
-
-                    except Exception as e:
-                        print("-" * 80, file=sys.stderr)
-                        print("Instance Exception", file=sys.stderr)
-                        traceback.print_exc(file=sys.stderr)
-                        print("-" * 80, file=sys.stderr)
-
-            # Execute the requested scheduling actions
-            execute_actions(instance_actions)
+            for i_type, records in i_types.iteritems():
+                instances = get_record_instances(region, i_type, records, session)
+                instance_actions.extend(zip(instances, [r['action'] for r in records]))
+
+            with metrics.timer("execution"):
+                executed = execute_actions(instance_actions, region)
+            metrics.incr("actions", len(instance_actions))
+            metrics.incr("executed", executed)
+
+            log.info("Region plan applied", extra=log_fields(
+                region=region, actions=len(instance_actions), executed=executed
+            ))
+
+        except Exception as e:
+            metrics.incr("errors.region")
+            log.exception("Region Exception", extra=log_fields(region=region))
+
+    report_metrics()
+
+
+def get_regions(run_on_regions):
+    """
+    The regions to work on, all the available regions if none is specified.
+    It returns None if the regions can't be retrieved
+    """
+    try:
+        if run_on_regions == []:
+            with metrics.timer("regions"):
+                return get_all_regions()
+        return run_on_regions
 
     except Exception as e:
-        print("-" * 80, file=sys.stderr)
-        print("Region Exception", file=sys.stderr)
-        traceback.print_exc(file=sys.stderr)
-        print("-" * 80, file=sys.stderr)
+        log.exception("Region Exception")
+        return None
 
 
-def process_instance(instance):
+def report_transitions(index, run):
+    """
+    Logs when the decision on an instance changes next, to tune how often
+    the scheduler runs
     """
-    Process the tags of a single instance and decides what to do with it
+    earliest = index.earliest()
+    if earliest is None:
+        log.info("No upcoming transitions")
+        return
+
+    transition, instance_id = earliest
+    log.info("Next transition", extra=log_fields(
+        instance=instance_id,
+        transition=transition.isoformat(),
+        seconds=int((transition - run.now).total_seconds()),
+        instances=len(index),
+        aligned_interval_minutes=index.aligned_interval()
+    ))
+
+
+def report_metrics():
     """
-    print("    Instance \"%s\" state is \"%s\"" % (instance.id(), instance.status()))
+    Logs the metrics collected during the run. When METRICS_NAMESPACE is set
+    they are also printed in CloudWatch Embedded Metric Format, which Lambda
+    turns into CloudWatch metrics
+    """
+    log.info("Run metrics", extra=log_fields(**metrics.report()))
+
+    namespace = os.environ.get('METRICS_NAMESPACE', "")
+    if namespace:
+        print(metrics.emf(namespace, EMF_DIMENSIONS))
+        sys.stdout.flush()
+
+
+def run_regions(regions, concurrency=DEFAULT_REGION_CONCURRENCY, run=None, process=None):
+    """
+    Calls process(region, run), process_region() by default, on each region
+    using up to "concurrency" worker threads
+    """
+    if process is None:
+        process = process_region
+
+    regions = list(regions)
+    concurrency = min(max(1, concurrency), len(regions))
+
+    # Serial execution doesn't need any worker
+    if concurrency <= 1:
+        for region in regions:
+            process(region, run)
+        return
+
+    pending = Queue.Queue()
+    for region in regions:
+        pending.put(region)
+
+    def worker():
+        while True:
+            try:
+                region = pending.get_nowait()
+            except Queue.Empty:
+                return
+            process(region, run)
+
+    workers = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+
+def process_region(region, run=None, index=None, ids=None, store=None, pending=None, shard=None):
+    """
+    Runs the schedulers on all the resources of a single region, or only on
+    the ones in "ids", a dictionary {type: [id, ...]}. Any error is contained
+    in the region so that it doesn't affect the others. The next transitions
+    of the instances are added to the TransitionIndex "index". The states of
+    the instances are read from and written to the StateStore "store". When
+    a list "pending" is given the actions are appended to it as (region,
+    type, instance, action) instead of being executed, see execute_pending().
+    With a "shard" only the instances in it are evaluated
+    """
+    try:
+        start = default_timer()
+        instances = 0
+        schedulers_count = 0
+        state = load_region_state(store, region)
+
+        instance_actions = []
+        for i_type, instance, schedulers, action in evaluate_region(region, run, index, ids, state, shard):
+            instances += 1
+            schedulers_count += len(schedulers)
+            if action is not None:
+                instance_actions.append((i_type, instance, action))
+
+        evaluated = default_timer()
+
+        # Execute the requested scheduling actions
+        executed = None
+        if pending is None:
+            with metrics.timer("execution"):
+                executed = execute_actions([(i, a) for _, i, a in instance_actions], region)
+            metrics.incr("executed", executed)
+        else:
+            pending.extend((region, t, i, a) for t, i, a in instance_actions)
+
+        # Instances with an action are never skipped, so the state doesn't
+        # depend on the actions being executed
+        skipped = 0
+        if state is not None:
+            skipped = state.skipped
+            save_region_state(state, ids is None and shard is None)
+
+        metrics.incr("instances", instances)
+        metrics.incr("skipped", skipped)
+        metrics.incr("schedulers", schedulers_count)
+        metrics.incr("actions", len(instance_actions))
+
+        summary = dict(
+            region=region,
+            instances=instances,
+            skipped=skipped,
+            schedulers=schedulers_count,
+            actions=len(instance_actions),
+            evaluation_seconds=round(evaluated - start, 3)
+        )
+        if executed is not None:
+            summary['executed'] = executed
+            summary['execution_seconds'] = round(default_timer() - evaluated, 3)
+        log.info("Region summary", extra=log_fields(**summary))
+
+    except Exception as e:
+        metrics.incr("errors.region")
+        log.exception("Region Exception", extra=log_fields(region=region))
+
+
+def execute_pending(pending, deadline=None):
+    """
+    Executes the actions collected by process_region() on all the regions.
+    All the stops are executed before the starts and, for each action, the
+    regions with more instances go first. Once the Deadline "deadline"
+    expires the remaining actions are returned as (region, type, instance,
+    action) without executing them
+    """
+    groups = OrderedDict()
+    for region, i_type, instance, action in pending:
+        groups.setdefault((action, region), []).append((i_type, instance))
+
+    order = sorted(groups, key=lambda k: (ACTION_PRIORITY.get(k[0], len(ACTION_PRIORITY)), -len(groups[k])))
+
+    left = []
+    for action, region in order:
+        instances = groups[(action, region)]
+        if deadline is not None and deadline.expired():
+            left.extend((region, t, i, action) for t, i in instances)
+            continue
+
+        try:
+            with metrics.timer("execution"):
+                executed = execute_actions([(i, action) for _, i in instances], region)
+            metrics.incr("executed", executed)
+
+        except Exception as e:
+            metrics.incr("errors.region")
+            log.exception("Region Exception", extra=log_fields(region=region))
+
+    return left
+
+
+def hand_off(handoff, regions, actions, targets=None):
+    """
+    Passes the work a run couldn't finish in time to "handoff", a function
+    that accepts the targets of the instances whose actions were not
+    executed, as returned by parse_event(), and the regions not evaluated.
+    The instances are evaluated again by the run that continues the work.
+    When the run was limited to "targets" the regions not evaluated are
+    passed as their targeted instances. The work is passed to more than
+    one invocation when there are more than MAX_WORKER_TARGETS instances
+    """
+    continued = OrderedDict()
+    full_regions = []
+    for region in regions:
+        ids = targets.get(region) if targets is not None else None
+        if ids is None:
+            full_regions.append(region)
+            continue
+        for i_type, i_ids in ids.iteritems():
+            for instance_id in i_ids:
+                add_target(continued, region, i_type, instance_id)
+
+    for region, i_type, instance, action in actions:
+        add_target(continued, region, i_type, instance.id())
+
+    metrics.incr("deferred.regions", len(regions))
+    metrics.incr("deferred.actions", len(actions))
+
+    fields = log_fields(regions=regions, actions=len(actions))
+    if handoff is None:
+        log.warning("Out of time, work left undone", extra=fields)
+        return
+
+    # Large continuations are split among several invocations, the regions
+    # to evaluate in full go with the first one
+    invocations = 0
+    for index, chunk in enumerate(split_targets(continued, MAX_WORKER_TARGETS)):
+        try:
+            handoff(chunk, full_regions if index == 0 else [])
+            invocations += 1
+        except Exception as e:
+            log.exception("Handoff Exception", extra=fields)
+
+    if invocations > 0:
+        log.warning("Out of time, work handed off", extra=log_fields(
+            regions=regions, actions=len(actions), invocations=invocations
+        ))
+
+
+def load_region_state(store, region):
+    """
+    The RegionState of a region from the StateStore "store". None when there
+    is no store or the state can't be read, to evaluate all the instances
+    """
+    if store is None:
+        return None
+    try:
+        return RegionState(store, region)
+    except Exception as e:
+        log.exception("State Exception", extra=log_fields(region=region))
+        return None
+
+
+def save_region_state(state, full=True):
+    """ Writes a RegionState, errors only mean more evaluations next time """
+    try:
+        state.save(full)
+    except Exception as e:
+        log.exception("State Exception", extra=log_fields(region=state.region))
+
+
+def plan_region(region, writer, run=None):
+    """
+    Writes with the PlanWriter "writer" the decisions of the schedulers on all
+    the resources of a single region
+    """
+    try:
+        start = default_timer()
+        instances = 0
+
+        for i_type, instance, schedulers, action in evaluate_region(region, run):
+            writer.write(plan_record(region, i_type, instance, schedulers, action))
+            instances += 1
+
+        metrics.incr("instances", instances)
+
+        log.info("Region planned", extra=log_fields(
+            region=region,
+            instances=instances,
+            evaluation_seconds=round(default_timer() - start, 3)
+        ))
+
+    except Exception as e:
+        metrics.incr("errors.region")
+        log.exception("Region Exception", extra=log_fields(region=region))
+
+
+def evaluate_region(region, run=None, index=None, ids=None, state=None, shard=None):
+    """
+    Generator of (type, instance, schedulers, action) with the decision taken
+    for each resource of the region, or for the ones in "ids" as accepted by
+    get_all_instances(). Instances in error are skipped. The time
+    spent on the schedulers, without discovery, is added to the run metrics.
+    When a TransitionIndex "index" is given the next transition of each
+    instance is added to it. With a RegionState "state" the instances that
+    don't need to be evaluated again are skipped and the others are recorded
+    in it. With a "shard" the instances outside of it are ignored
+    """
+    # Each region has its own session as they are not thread safe, reused
+    # with its clients by the next runs
+    session = get_session(region)
+
+    # All the instances share the same run, so the state has a time to
+    # compare with the next transitions and each daily spec is decided once
+    if run is None:
+        run = RunContext.create()
+
+    evaluated = 0
+    evaluation = 0.0
+    slowest = 0.0
+    try:
+        for i_type, i_list in get_all_instances(region, session, SCHEDULER_PREFIX, ids).iteritems():
+            for instance in i_list:
+                if shard is not None and not in_shard(instance.id(), shard):
+                    continue
+
+                start = default_timer()
+                try:
+                    if state is not None:
+                        context = EvaluationContext.of(instance, run)
+                        fingerprint = instance_fingerprint(instance, context)
+                        record = state.skippable(i_type, instance.id(), fingerprint, run.now)
+                        if record is not None:
+                            if index is not None:
+                                index.push(from_epoch_seconds(record.next_transition), instance.id())
+                            continue
+
+                    schedulers = build_instance_schedulers(instance)
+                    action = process_instance(instance, run, schedulers)
+
+                    if index is not None or state is not None:
+                        context = EvaluationContext.of(instance, run)
+                        transition = next_transition(schedulers, context)
+                        if index is not None:
+                            index.push(transition, instance.id())
+                        if state is not None:
+                            state.update(i_type, instance.id(), StateRecord(
+                                fingerprint, context.status, action, epoch_seconds(transition)
+                            ))
+
+                except Exception as e:
+                    metrics.incr("errors.instance")
+                    log.exception("Instance Exception", extra=log_fields(region=region, type=i_type))
+                    continue
+
+                finally:
+                    elapsed = default_timer() - start
+                    evaluation += elapsed
+                    slowest = max(slowest, elapsed)
+                    evaluated += 1
+
+                yield i_type, instance, schedulers, action
+
+    finally:
+        metrics.add_time("evaluation", evaluation, evaluated, slowest)
+
+
+def process_instance(instance, run=None, schedulers=None):
+    """
+    Process the tags of a single instance and decides what to do with it in
+    the RunContext "run", which defaults to the current time. The schedulers
+    are built from the tags when not provided
+    """
+    if schedulers is None:
+        schedulers = build_instance_schedulers(instance)
+
+    # The same state of the instance is used by all its schedulers
+    context = EvaluationContext.of(instance, run)
+
+    # Details are formatted only when they are going to be logged
+    debug = log.isEnabledFor(logging.DEBUG)
 
     # Execute the schedulers
     action = None
-    for s in build_instance_schedulers(instance):
-        print("      - Found scheduler \"%s\" with value: \"%s\":" % (s.type(), s.value))
-        print("        %s" % s)
-
+    for s in schedulers:
         # Find what the scheduler would do on the instance
-        tag_action = s.check()
-
-        print("        Tag action is: %s" % tag_action)
-        print("        Scheduler action is: ", end='')
+        tag_action = s.check(context)
 
         # Nothing required
         if tag_action is None:
             action = None
-            print("nothing.")
+            outcome = "nothing"
 
         # Actions "start"
-        elif tag_action == "start" and instance.status() == "stopped":
+        elif tag_action == "start" and context.status == "stopped":
             action = "start"
-            print("start.")
+            outcome = "start"
 
         # Actions "stop"
-        elif tag_action == "stop" and instance.status() == "running":
+        elif tag_action == "stop" and context.status == "running":
             action = "stop"
-            print("stop.")
+            outcome = "stop"
 
         # Actions "ignore"
         elif tag_action == "ignore":
             action = None
-            print("ignore all schedulers.\n      Stop processing schedulers for this instance.")
-            break
+            outcome = "ignore all schedulers"
 
         # Actions "error"
         elif tag_action == "error":
-            print("error.\n      ERROR from the scheduler, ignoring it.")
-            continue
+            outcome = "error, ignoring the scheduler"
 
         # Errors
         else:
-            print("nothing required.")
+            outcome = "nothing required"
+
+        if debug:
+            log.debug("Scheduler checked", extra=log_fields(
+                instance=instance.id(),
+                state=context.status,
+                scheduler=s.type(),
+                name=s.name,
+                value=s.value,
+                description=str(s),
+                tag_action=tag_action,
+                outcome=outcome
+            ))
+
+        # Stop processing schedulers for this instance
+        if tag_action == "ignore":
+            break
+
+    if debug:
+        log.debug("Instance checked", extra=log_fields(
+            instance=instance.id(), state=context.status, action=action
+        ))
 
-    print("      Final instance action is \"%s\"" % action)
     return action
 
 
@@ -138,66 +766,86 @@ def build_instance_schedulers(instance):
     """
     Build the list of schedulers and sort them by name
     """
-    schedulers = []
+    # Classify each tag with a single match, collecting the scheduler tags
+    # as (name, type, value). Any other tag is skipped here
+    descriptors = []
+    for tag in instance.tags():
+        match = SCHEDULER_TAG_RE.match(tag['Key'])
+        if match is not None:
+            descriptors.append((match.group(2) or "", match.group(1), tag['Value']))
+
+    # Sort by name before building, keeping the order of the tags for equal
+    # names, so that the schedulers come out already sorted
+    descriptors.sort(key=lambda d: d[0])
 
-    print("      Building and sorting list of schedulers.")
-    for t_key, t_value in [(t['Key'], t['Value']) for t in instance.tags()]:
-        # Extract the information in the Key
-        fields = t_key.split("-")
-        if len(fields) < 2:
-            continue
-
-        # Check it's a scheduler
-        scheduler_tag = fields[0]
-        if scheduler_tag != SCHEDULER_PREFIX:
-            continue
-
-        # Get the scheduler name, if any
-        scheduler_name = fields[2] if len(fields) > 2 else ""
-
-        # Get the scheduler type
-        scheduler_type = fields[1]
+    schedulers = []
+    for scheduler_name, scheduler_type, t_value in descriptors:
         scheduler = Scheduler.build(instance, scheduler_type, scheduler_name, t_value)
         if scheduler is None:
-            print("      Skipping unknown scheduler: %s" % scheduler_type)
+            log.debug("Skipping unknown scheduler", extra=log_fields(
+                instance=instance.id(), scheduler=scheduler_type
+            ))
             continue
 
         # Add the scheduler
         schedulers.append(scheduler)
 
-    # Sort the schedulers by their name
-    return sorted(schedulers, key=lambda s: s.name)
+    return schedulers
 
 
-def execute_actions(instance_actions):
+def execute_actions(instance_actions, region=None):
     """
-    Executes the start/stop actions on the required instances
+    Executes the start/stop actions on the required instances and returns
+    how many have been executed. The instances are grouped by type and action
+    so that they can be sent in batches
     """
-    print("  Execute scheduling actions:")
-    executed = 0
+    batches = OrderedDict()
     for instance, action in instance_actions:
-        if action is None:
+        if action not in ["start", "stop"]:
             continue
+        batches.setdefault((instance.__class__, action), []).append(instance)
 
-        elif action == "start":
-            print("    START instance %s" % instance.id())
-            instance.start()
-            executed += 1
-
+    executed = 0
+    for (i_class, action), instances in batches.iteritems():
+        log.info("Executing action", extra=log_fields(
+            region=region, action=action, instances=[i.id() for i in instances]
+        ))
+        if action == "start":
+            executed += i_class.start_batch(instances)
         elif action == "stop":
-            print("    STOP instance %s" % instance.id())
-            instance.stop()
-            executed += 1
+            executed += i_class.stop_batch(instances)
 
-    if executed == 0:
-        print("    No instances to start or stop.")
+    return executed
 
 
 if __name__ == '__main__':
-    """ Console entry point """
-    print("Execution from Command Line\n")
+    """
+    Console entry point. Usage:
+      tagscheduler.py                    runs the schedulers
+      tagscheduler.py plan <plan_file>   saves the decisions in a plan file
+      tagscheduler.py apply <plan_file>  executes the actions of a plan file
+    """
+    log.info("Execution from Command Line")
 
     run_on_regions = filter(None, os.environ.get('RUN_ON_REGIONS', "").split(','))
-    run_tagscheduler(run_on_regions)
+    mode = sys.argv[1] if len(sys.argv) > 1 else "run"
+
+    if mode == "run" and get_fanout_shards() is not None:
+        run_coordinator(run_on_regions, get_fanout_shards(), LocalInvoker(lambda_handler), get_state_store())
+
+    elif mode == "run":
+        run_tagscheduler(run_on_regions, get_region_concurrency(), None, get_state_store())
+
+    elif mode == "plan" and len(sys.argv) > 2:
+        with open(sys.argv[2], 'w') as plan_file:
+            plan_tagscheduler(run_on_regions, plan_file, get_region_concurrency())
+
+    elif mode == "apply" and len(sys.argv) > 2:
+        with open(sys.argv[2], 'r') as plan_file:
+            apply_plan(plan_file)
+
+    else:
+        print("Usage: %s [run | plan <plan_file> | apply <plan_file>]" % sys.argv[0], file=sys.stderr)
+        sys.exit(1)
 
 # vim: ft=python:ts=4:sw=4
\ No newline at end of file
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import time
+import random
+import threading
+from timeit import default_timer
+
+from logger import *
+from metrics import metrics
+
+
+# Error codes returned by the AWS APIs when the caller is throttled
+THROTTLING_CODES = frozenset([
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "SlowDown",
+])
+
+# Calls per second allowed at most for each service in each region
+DEFAULT_RATES = {'ec2': 20.0, 'rds': 10.0}
+DEFAULT_RATE = 10.0
+
+# The rate never drops below this, in calls per second
+MIN_RATE = 0.5
+
+# Seconds of the first retry of a throttled call, doubled at each retry
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 20.0
+
+# Seconds allowed to the retries of a run when not configured
+DEFAULT_RETRY_BUDGET = 180.0
+
+
+def is_throttling(error):
+    """ Checks if an exception of a boto3 client is a throttling error """
+    response = getattr(error, 'response', None)
+    if not isinstance(response, dict):
+        return False
+    return response.get('Error', {}).get('Code') in THROTTLING_CODES
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket allowing "rate" calls per second with bursts of
+    up to "rate" calls. The rate adapts to throttling: it halves at each
+    throttling error and grows back by a tenth of the maximum at each success
+    """
+    def __init__(self, rate):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self._tokens = float(rate)
+        self._updated = default_timer()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """ Takes a token, waiting for one if none is available """
+        while True:
+            with self._lock:
+                self._refill(default_timer())
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            metrics.add_time("throttling.wait", wait)
+            time.sleep(wait)
+
+    def throttled(self):
+        """ Halves the rate after a throttling error """
+        with self._lock:
+            self.rate = max(MIN_RATE, self.rate / 2.0)
+            self._tokens = min(self._tokens, self.rate)
+
+    def succeeded(self):
+        """ Increases the rate after a successful call """
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 10.0)
+
+
+class RateLimiter(object):
+    """
+    The TokenBucket of each (region, service), shared by all the sessions
+    and threads of a run
+    """
+    def __init__(self, rates=None):
+        self.rates = rates if rates is not None else DEFAULT_RATES
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, region, service):
+        with self._lock:
+            key = (region, service)
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(self.rates.get(service, DEFAULT_RATE))
+            return self._buckets[key]
+
+    def reset(self):
+        """ Restarts all the buckets at their maximum rate """
+        with self._lock:
+            self._buckets = {}
+
+
+class RetryPolicy(object):
+    """
+    Retries of the calls failed because of throttling, with exponential
+    backoff and jitter, as long as the run has time left
+    """
+    def __init__(self, budget=DEFAULT_RETRY_BUDGET):
+        self.reset(budget)
+
+    def reset(self, budget=DEFAULT_RETRY_BUDGET):
+        """ Starts a run that has "budget" seconds for its retries """
+        self.deadline = default_timer() + budget
+
+    def remaining(self):
+        """ Seconds left to the deadline """
+        return max(0.0, self.deadline - default_timer())
+
+    def call(self, function):
+        """
+        Calls "function" retrying it while it fails because of throttling and
+        the backoff fits in the time left. The throttling errors themselves
+        are counted and slow down the rate in the hooks of throttle_session()
+        """
+        attempt = 0
+        while True:
+            try:
+                return function()
+
+            except Exception as e:
+                if not is_throttling(e):
+                    raise
+
+                wait = random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+                if wait >= self.remaining():
+                    metrics.incr("retries.exhausted")
+                    raise
+
+                log.warning("Throttled, retrying", extra=log_fields(
+                    error=str(e), attempt=attempt + 1, wait_seconds=round(wait, 3)
+                ))
+                metrics.incr("retries")
+                time.sleep(wait)
+                attempt += 1
+
+
+def throttle_session(session, region, limiter=None):
+    """
+    Registers on the boto3 session the hooks that make every API call wait
+    for a token of the bucket of its service in the region, and that slow
+    down the bucket when botocore sees a throttling error
+    """
+    limiter = limiter or rate_limiter
+
+    def before_call(model, **kwargs):
+        limiter.bucket(region, model.service_model.service_name).acquire()
+
+    def needs_retry(response=None, operation=None, **kwargs):
+        if response is None or operation is None:
+            return None
+        parsed = response[1] if len(response) > 1 else None
+        bucket = limiter.bucket(region, operation.service_model.service_name)
+        if isinstance(parsed, dict) and parsed.get('Error', {}).get('Code') in THROTTLING_CODES:
+            metrics.incr("throttles")
+            bucket.throttled()
+        else:
+            bucket.succeeded()
+        return None
+
+    session.events.register('before-call', before_call, unique_id="tagscheduler-rate-limit")
+    session.events.register('needs-retry', needs_retry, unique_id="tagscheduler-throttled")
+    return session
+
+
+def reset_throttling(budget=DEFAULT_RETRY_BUDGET):
+    """ Starts the rate limits and the retries of a new run """
+    rate_limiter.reset()
+    retries.reset(budget)
+
+
+# Rate limits and retries of the current run
+rate_limiter = RateLimiter()
+retries = RetryPolicy()
+
+# vim: ft=python:ts=4:sw=4
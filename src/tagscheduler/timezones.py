@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import pytz as tz
+from cache import LRUCache
+from collections import namedtuple
+from datetime import datetime, timedelta, time
+
+
+# Maximum number of (time zone, date) kept in memory
+OFFSET_CACHE_SIZE = 1024
+
+MINUTES_PER_DAY = 24 * 60
+
+
+class DayOffsets(namedtuple('DayOffsets', ['offset', 'change', 'new_offset'])):
+    """
+    The UTC offsets of a time zone during a day, in minutes east of UTC.
+    "offset" applies from midnight and, when the offset changes during the
+    day, "new_offset" applies from the local time "change", in minutes from
+    midnight, otherwise "change" is None
+    """
+    __slots__ = ()
+
+    def at(self, minute):
+        """ The offset of the local time "minute", in minutes from midnight """
+        if self.change is None or minute < self.change:
+            return self.offset
+        return self.new_offset
+
+
+# Offsets of each time zone on each day, keyed by (name of the zone, date)
+offset_cache = LRUCache(OFFSET_CACHE_SIZE)
+
+
+def day_offsets(zone, day):
+    """ The DayOffsets of the pytz time zone "zone" on the date "day" """
+    return offset_cache.lookup((zone.zone, day), lambda: compute_day_offsets(zone, day))
+
+
+def compute_day_offsets(zone, day):
+    """
+    Computes the DayOffsets of a day finding, when the offset at midnight is
+    different from the one at the next midnight, the minute of the change
+    """
+    midnight = datetime(day.year, day.month, day.day)
+    start = zone.localize(midnight, is_dst=False)
+    end = zone.localize(midnight + timedelta(days=1), is_dst=False)
+
+    offset, new_offset = minutes(start.utcoffset()), minutes(end.utcoffset())
+    if offset == new_offset:
+        return DayOffsets(offset, None, offset)
+
+    # Binary search of the first UTC minute with the new offset
+    start_utc = start.astimezone(tz.utc)
+    low, high = 0, minutes(end - start)
+    while low < high:
+        middle = (low + high) // 2
+        when = start_utc + timedelta(minutes=middle)
+        if minutes(when.astimezone(zone).utcoffset()) == new_offset:
+            high = middle
+        else:
+            low = middle + 1
+
+    # The local time of the change read with the new offset, so that local
+    # times skipped or repeated by the change take the offset of standard
+    # time, like localize(is_dst=False)
+    change = low + new_offset - offset
+    return DayOffsets(offset, change, new_offset)
+
+
+def local_midnight(zone, day):
+    """ The UTC datetime of the start of the date "day" in the pytz time zone "zone" """
+    midnight = datetime(day.year, day.month, day.day)
+    return zone.localize(midnight, is_dst=False).astimezone(tz.utc)
+
+
+def local_to_utc(zone, day, minute):
+    """
+    The UTC time of the day, in minutes from midnight, of the local time
+    "minute" on the date "day" in the pytz time zone "zone"
+    """
+    return (minute - day_offsets(zone, day).at(minute)) % MINUTES_PER_DAY
+
+
+def utc_time(zone, day, local):
+    """
+    The UTC time, with tzinfo, of the local datetime.time "local" on the date
+    "day" in the pytz time zone "zone"
+    """
+    minute = local_to_utc(zone, day, local.hour * 60 + local.minute)
+    return time(minute // 60, minute % 60, tzinfo=tz.utc)
+
+
+def minutes(delta):
+    """ Whole minutes of a timedelta """
+    return int(delta.total_seconds()) // 60
+
+# vim: ft=python:ts=4:sw=4
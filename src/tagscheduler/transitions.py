@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import heapq
+import threading
+from fractions import gcd
+
+
+# Longest interval between runs suggested by TransitionIndex
+MAX_INTERVAL_MINUTES = 60
+
+
+def next_transition(schedulers, context):
+    """
+    The earliest UTC time at which any of the schedulers of an instance
+    changes its decision in the EvaluationContext "context", or None if none
+    of them changes only with time
+    """
+    transitions = [s.next_transition(context) for s in schedulers]
+    transitions = [t for t in transitions if t is not None]
+    return min(transitions) if transitions else None
+
+
+class TransitionIndex(object):
+    """
+    Thread safe heap of (next_transition, instance_id) of the instances of a
+    run, ordered by the UTC time of their next transition
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap = []
+        self._interval = MAX_INTERVAL_MINUTES
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
+
+    def push(self, transition, instance_id):
+        """ Adds the next transition of an instance, nothing if it's None """
+        if transition is None:
+            return
+
+        with self._lock:
+            heapq.heappush(self._heap, (transition, instance_id))
+
+            # Transitions on the minute, like the ones of the daily schedulers,
+            # are all hit by a schedule running every "interval" minutes from
+            # the start of the hour
+            if transition.second == 0 and transition.microsecond == 0:
+                self._interval = gcd(self._interval, transition.hour * 60 + transition.minute)
+
+    def earliest(self):
+        """ The (next_transition, instance_id) that comes first, None if empty """
+        with self._lock:
+            return self._heap[0] if self._heap else None
+
+    def aligned_interval(self):
+        """
+        The longest interval in minutes, up to MAX_INTERVAL_MINUTES, of a
+        schedule starting at each hour that runs exactly at every transition
+        on the minute
+        """
+        with self._lock:
+            return self._interval
+
+# vim: ft=python:ts=4:sw=4
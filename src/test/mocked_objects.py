@@ -28,9 +28,10 @@ from __future__ import print_function
 import tagscheduler
 from datetime import datetime, time
 from tagscheduler.schedulers import Scheduler
+from tagscheduler.schedulable import Schedulable
 
 
-class MockSchedulable:
+class MockSchedulable(Schedulable):
     def __init__(self, start_time=None, stop_time=None, status="", tags=[]):
         self._start_time = start_time
         self._stop_time = stop_time
@@ -71,11 +72,15 @@ class MockScheduler(Scheduler):
     def type(self):
         return self.schtype
 
-    def check(self):
+    def check(self, context=None):
         return self.check_result
 
 
 class MockBoto3Objects:
+    def __init__(self, pages=1):
+        self.pages_count = pages
+        self.paginate_args = {}
+
     def describe_regions(self):
         """
         Mock of boto3.client('ec2').describe_regions()
@@ -87,7 +92,7 @@ class MockBoto3Objects:
                 {"RegionName": "eu-west-2"}
         ]}
 
-    def describe_db_instances(self):
+    def describe_db_instances(self, **kwargs):
         """
         Mock of boto3.client('rds').describe_db_instances()
         """
@@ -95,31 +100,57 @@ class MockBoto3Objects:
             "DBInstances": [{}, {}]
         }
 
-    def all(self):
+    def describe_instances(self, **kwargs):
+        """
+        Mock of boto3.client('ec2').describe_instances()
+        """
+        return {
+            "Reservations": [{"Instances": [{}]}, {"Instances": [{}]}]
+        }
+
+    def get_paginator(self, operation_name):
         """
-        Mock of boto3.resource('ec2').instances.all()
+        Mock of boto3.client().get_paginator()
         """
-        return [None, None]
+        return MockPaginator(self, operation_name)
+
+
+class MockPaginator:
+    """
+    Mock of a boto3 paginator that returns the same page multiple times
+    """
+    def __init__(self, client, operation_name):
+        self.client = client
+        self.operation_name = operation_name
+
+    def paginate(self, **kwargs):
+        self.client.paginate_args[self.operation_name] = kwargs
+        operation = getattr(self.client, self.operation_name)
+        return [operation() for _ in range(self.client.pages_count)]
 
 
-class MockEC2Instance:
+class MockEC2Instance(dict):
     """
-    Mock of boto3 EC2.Instance
+    Mock of an instance in the response of boto3.client('ec2').describe_instances()
+    that also works as the client
     """
-    def __init__(self, start_return=True, stop_return=True, instance_id="", launch_time="", state_transition_reason="", client=None, status="", tags={}):
+    def __init__(self, start_return=True, stop_return=True, instance_id="", launch_time="", state_transition_reason="", status="", tags={}):
+        super(MockEC2Instance, self).__init__(
+            InstanceId=instance_id,
+            State={'Name': status},
+            StateTransitionReason=state_transition_reason,
+            Tags=[{'Key': key, 'Value': val} for key, val in tags.iteritems()]
+        )
+        if launch_time != "":
+            self['LaunchTime'] = datetime.strptime(launch_time, '%Y-%m-%d %H:%M:%S')
+
         self.start_return = start_return
         self.stop_return = stop_return
-        self.instance_id = instance_id
-        self.launch_time = datetime.strptime(launch_time, '%Y-%m-%d %H:%M:%S') if launch_time != "" else ""
-        self.state_transition_reason = state_transition_reason
-        self.client = client
-        self.state = {'Name': status}
-        self.tags = [{'Key': key, 'Value': val} for key, val in tags.iteritems()]
 
-    def start(self):
+    def start_instances(self, InstanceIds):
         return self.start_return
 
-    def stop(self):
+    def stop_instances(self, InstanceIds):
         return self.stop_return
 
 
@@ -127,7 +158,7 @@ class MockRDSInstance:
     """
     Mock of boto3 RDS.Client RDS instance information
     """
-    def __init__(self, start_return=True, stop_return=True, db_resource_id="", db_instance_status="", tags={}):
+    def __init__(self, start_return=True, stop_return=True, db_resource_id="", db_instance_status="", tags={}, tag_list=None):
         self.start_return = start_return
         self.stop_return = stop_return
         self.db_resource_id = db_resource_id
@@ -135,6 +166,7 @@ class MockRDSInstance:
         self.tags = {
             'TagList': [{'Key': key, 'Value': val} for key, val in tags.iteritems()]
         }
+        self.tag_list = [{'Key': key, 'Value': val} for key, val in tag_list.iteritems()] if tag_list is not None else None
 
     def __getitem__(self, key):
         if key == 'DBInstanceArn':
@@ -143,6 +175,10 @@ class MockRDSInstance:
             return self.db_instance_status
         elif key == 'DbiResourceId':
             return self.db_resource_id
+        elif key == 'TagList':
+            if self.tag_list is None:
+                raise KeyError(key)
+            return self.tag_list
         return None
 
     def start_db_instance(self, DBInstanceIdentifier):
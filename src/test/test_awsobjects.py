@@ -25,6 +25,7 @@
 
 from __future__ import print_function
 
+import types
 import unittest
 from mock import patch, Mock
 
@@ -36,18 +37,14 @@ from tagscheduler.schedulable import *
 class SchedulerTest(unittest.TestCase):
 
     def setUp(self):
+        clear_sessions()
+
         # Patch of boto3.client()
         self.boto3_client_patch = patch(
             'boto3.client', return_value=MockBoto3Objects()
         )
         self.boto3_client = self.boto3_client_patch.start()
 
-        # Patch of boto3.resource()
-        self.boto3_resource_patch = patch(
-            'boto3.resource', return_value=Mock(instances=MockBoto3Objects())
-        )
-        self.boto3_resource = self.boto3_resource_patch.start()
-
         # Patch of EC2Schedulable
         self.ec2_schedulable_patch = patch.object(
             EC2Schedulable, '__init__', return_value=None
@@ -63,7 +60,6 @@ class SchedulerTest(unittest.TestCase):
     def tearDown(self):
         self.ec2_schedulable_patch.stop()
         self.rds_schedulable_patch.stop()
-        self.boto3_resource_patch.stop()
         self.boto3_client_patch.stop()
 
     """ get_all_regions() """
@@ -90,25 +86,160 @@ class SchedulerTest(unittest.TestCase):
         result = get_all_instances("eu-west-2")
         self.assertListEqual(result.keys(), ['EC2', 'RDS'])
 
+    def test_get_all_instances_session(self, *args):
+        session = Mock(client=Mock(return_value=MockBoto3Objects()))
+        get_all_instances("eu-west-2", session)
+        session.client.assert_any_call('ec2', region_name="eu-west-2")
+        session.client.assert_any_call('rds', region_name="eu-west-2")
+        self.boto3_client.assert_not_called()
+
+    """ get_record_instances() """
+
+    def test_get_record_instances(self):
+        records = [{'id': "i-1", 'state': "running"}, {'id': "i-2", 'state': "stopped"}]
+        self.ec2_schedulable_patch.stop()
+        try:
+            result = get_record_instances("eu-west-2", "EC2", records)
+        finally:
+            self.ec2_schedulable_patch.start()
+        self.boto3_client.assert_called_once_with('ec2', region_name="eu-west-2")
+        self.assertListEqual([i.id() for i in result], ["i-1", "i-2"])
+
+    """ has_tag_prefix() """
+
+    def test_has_tag_prefix(self):
+        self.assertTrue(has_tag_prefix([{'Key': 'scheduler-daily'}], "scheduler"))
+
+    def test_has_tag_prefix_not_found(self):
+        self.assertFalse(has_tag_prefix([{'Key': 'scheduler'}, {'Key': 'Name'}], "scheduler"))
+
+    """ create_session() """
+
+    def test_create_session_region(self):
+        result = create_session("eu-west-2")
+        self.assertEqual(result.region_name, "eu-west-2")
+
+    """ Caches """
+
+    def test_get_all_regions_cached(self):
+        get_all_regions()
+        get_all_regions()
+        self.assertEqual(self.boto3_client.call_count, 1)
+
+    def test_get_session_cached(self):
+        session = get_session("eu-west-2")
+        self.assertIs(get_session("eu-west-2"), session)
+        self.assertIsNot(get_session("eu-west-1"), session)
+        self.assertEqual(session.region_name, "eu-west-2")
+
+    def test_get_session_clients_cached(self):
+        session = get_session("eu-west-2")
+        self.assertIs(session.client('ec2', region_name="eu-west-2"), session.client('ec2', region_name="eu-west-2"))
+        self.assertIsNot(session.client('ec2', region_name="eu-west-2"), session.client('rds', region_name="eu-west-2"))
+
+    def test_clear_sessions(self):
+        session = get_session("eu-west-2")
+        get_all_regions()
+        clear_sessions()
+        self.assertIsNot(get_session("eu-west-2"), session)
+        get_all_regions()
+        self.assertEqual(self.boto3_client.call_count, 2)
+
+    def test_get_all_instances_generators(self, *args):
+        result = get_all_instances("eu-west-2")
+        self.assertIsInstance(result['EC2'], types.GeneratorType)
+        self.assertIsInstance(result['RDS'], types.GeneratorType)
+
     """ get_all_instances() - EC2Schedulable """
 
     def test_get_all_instances_ec2_counts(self, *args):
         result = get_all_instances("eu-west-2")
-        self.assertTrue(len(result['EC2']), 2)
+        self.assertEqual(len(list(result['EC2'])), 2)
 
     def test_get_all_instances_ec2_objects(self, *args):
         result = get_all_instances("eu-west-2")
-        self.assertIsInstance(result['EC2'][0], EC2Schedulable)
+        self.assertIsInstance(next(result['EC2']), EC2Schedulable)
+
+    def test_get_all_instances_ec2_pages(self, *args):
+        self.boto3_client.return_value = MockBoto3Objects(pages=3)
+        result = get_all_instances("eu-west-2")
+        self.assertEqual(len(list(result['EC2'])), 6)
+
+    def test_get_all_instances_ec2_tag_filter(self, *args):
+        client = MockBoto3Objects()
+        self.boto3_client.return_value = client
+        list(get_all_instances("eu-west-2", tag_prefix="scheduler")['EC2'])
+        self.assertListEqual(
+            client.paginate_args['describe_instances']['Filters'],
+            [{'Name': 'tag-key', 'Values': ['scheduler-*']}]
+        )
+
+    def test_get_all_instances_ec2_no_tag_filter(self, *args):
+        client = MockBoto3Objects()
+        self.boto3_client.return_value = client
+        list(get_all_instances("eu-west-2")['EC2'])
+        self.assertListEqual(client.paginate_args['describe_instances']['Filters'], [])
+
+    def test_get_all_instances_ec2_ids(self, *args):
+        client = MockBoto3Objects()
+        self.boto3_client.return_value = client
+        result = get_all_instances("eu-west-2", tag_prefix="scheduler", ids={'EC2': ["i-1", "i-2"]})
+        list(result['EC2'])
+        self.assertListEqual(list(result.keys()), ['EC2'])
+        self.assertListEqual(client.paginate_args['describe_instances']['Filters'], [
+            {'Name': 'tag-key', 'Values': ['scheduler-*']},
+            {'Name': 'instance-id', 'Values': ["i-1", "i-2"]},
+        ])
+
+    def test_get_all_instances_ec2_ids_chunks(self, *args):
+        ids = ["i-%d" % i for i in range(PAGE_SIZE * 2 + 1)]
+        with patch.object(MockPaginator, 'paginate', return_value=[]) as paginate:
+            list(get_all_instances("eu-west-2", ids={'EC2': ids})['EC2'])
+        self.assertEqual(paginate.call_count, 3)
 
     """ get_all_instances() - RDSSchedulable """
 
     def test_get_all_instances_rds_counts(self, *args):
         result = get_all_instances("eu-west-2")
-        self.assertTrue(len(result['RDS']), 2)
+        self.assertEqual(len(list(result['RDS'])), 2)
 
     def test_get_all_instances_rds_objects(self, *args):
         result = get_all_instances("eu-west-2")
-        self.assertIsInstance(result['RDS'][0], RDSSchedulable)
+        self.assertIsInstance(next(result['RDS']), RDSSchedulable)
+
+    def test_get_all_instances_rds_tag_filter(self, *args):
+        rds = MockBoto3Objects()
+        rds.describe_db_instances = Mock(return_value={"DBInstances": [
+            {'TagList': [{'Key': 'Name', 'Value': 'db1'}]},
+            {'TagList': [{'Key': 'scheduler-daily', 'Value': '0800/1800'}]},
+            {}
+        ]})
+        self.boto3_client.return_value = rds
+        result = get_all_instances("eu-west-2", tag_prefix="scheduler")
+        self.assertEqual(len(list(result['RDS'])), 2)
+
+    def test_get_all_instances_rds_pages(self, *args):
+        self.boto3_client.return_value = MockBoto3Objects(pages=3)
+        result = get_all_instances("eu-west-2")
+        self.assertEqual(len(list(result['RDS'])), 6)
+
+    def test_get_all_instances_rds_ids(self, *args):
+        client = MockBoto3Objects()
+        self.boto3_client.return_value = client
+        arn = "arn:aws:rds:eu-west-2:123456789012:db:database-1"
+        result = get_all_instances("eu-west-2", ids={'RDS': ["db-1", arn]})
+        self.assertListEqual(list(result.keys()), ['RDS'])
+        self.assertEqual(len(list(result['RDS'])), 4)
+
+    """ get_id_filters() """
+
+    def test_get_id_filters_all(self):
+        self.assertListEqual(get_id_filters(None), [[]])
+        self.assertListEqual(get_id_filters([('instance-id', None)]), [[]])
+
+    def test_get_id_filters_empty_skipped(self):
+        result = get_id_filters([('dbi-resource-id', ["db-1"]), ('db-instance-id', [])])
+        self.assertListEqual(result, [[{'Name': 'dbi-resource-id', 'Values': ["db-1"]}]])
 
 
 # vim: ft=python:ts=4:sw=4
\ No newline at end of file
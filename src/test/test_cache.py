@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import threading
+import unittest
+from mock import patch
+
+from tagscheduler import cache
+
+from tagscheduler.cache import *
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = LRUCache(2)
+
+    """ Constructor """
+
+    def test_constructor_bad_size(self):
+        with self.assertRaises(ValueError):
+            LRUCache(0)
+
+    """ lookup() """
+
+    def test_lookup_miss_computes(self):
+        result = self.cache.lookup("a", lambda: 1)
+        self.assertEqual(result, 1)
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_lookup_hit_cached(self):
+        self.cache.lookup("a", lambda: 1)
+        result = self.cache.lookup("a", lambda: 2)
+        self.assertEqual(result, 1)
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_lookup_evicts_least_recent(self):
+        self.cache.lookup("a", lambda: 1)
+        self.cache.lookup("b", lambda: 2)
+        self.cache.lookup("a", lambda: 1)
+        self.cache.lookup("c", lambda: 3)
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.lookup("a", lambda: 10), 1)
+        self.assertEqual(self.cache.lookup("b", lambda: 20), 20)
+
+    def test_lookup_threads(self):
+        cache = LRUCache(10)
+        def worker():
+            for i in range(1000):
+                cache.lookup(i % 5, lambda: object())
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(cache.misses, 5)
+        self.assertEqual(cache.hits + cache.misses, 8000)
+
+    """ clear() and stats() """
+
+    def test_clear(self):
+        self.cache.lookup("a", lambda: 1)
+        self.cache.clear()
+        self.assertDictEqual(self.cache.stats(), {'size': 0, 'hits': 0, 'misses': 0})
+
+    def test_stats(self):
+        self.cache.lookup("a", lambda: 1)
+        self.cache.lookup("a", lambda: 1)
+        self.assertDictEqual(self.cache.stats(), {'size': 1, 'hits': 1, 'misses': 1})
+
+
+class TTLCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = TTLCache(60)
+
+    def test_constructor_bad_ttl(self):
+        with self.assertRaises(ValueError):
+            TTLCache(0)
+
+    def test_lookup_hit_before_expiry(self):
+        with patch.object(cache, 'default_timer', side_effect=[100.0, 159.0]):
+            self.cache.lookup("a", lambda: 1)
+            result = self.cache.lookup("a", lambda: 2)
+        self.assertEqual(result, 1)
+        self.assertDictEqual(self.cache.stats(), {'size': 1, 'hits': 1, 'misses': 1})
+
+    def test_lookup_expired_computes(self):
+        with patch.object(cache, 'default_timer', side_effect=[100.0, 160.0, 170.0]):
+            self.cache.lookup("a", lambda: 1)
+            self.assertEqual(self.cache.lookup("a", lambda: 2), 2)
+            self.assertEqual(self.cache.lookup("a", lambda: 3), 2)
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_clear(self):
+        self.cache.lookup("a", lambda: 1)
+        self.cache.clear()
+        self.assertDictEqual(self.cache.stats(), {'size': 0, 'hits': 0, 'misses': 0})
+
+
+# vim: ft=python:ts=4:sw=4
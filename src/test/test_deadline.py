@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import unittest
+from mock import Mock, patch
+
+from tagscheduler import deadline
+from tagscheduler.deadline import *
+
+
+class DeadlineTest(unittest.TestCase):
+
+    def test_no_deadline(self):
+        self.assertIsNone(Deadline().remaining())
+        self.assertFalse(Deadline().expired())
+
+    def test_expired(self):
+        self.assertTrue(Deadline(0).expired())
+        self.assertEqual(Deadline(0).remaining(), 0.0)
+
+    def test_remaining(self):
+        with patch.object(deadline, 'default_timer', side_effect=[100.0, 130.0]):
+            self.assertEqual(Deadline(60).remaining(), 30.0)
+
+    """ of_lambda() """
+
+    def test_of_lambda(self):
+        context = Mock()
+        context.get_remaining_time_in_millis.return_value = 60000
+        with patch.object(deadline, 'default_timer', return_value=100.0):
+            self.assertEqual(Deadline.of_lambda(context, 15).remaining(), 45.0)
+
+    def test_of_lambda_short_time(self):
+        context = Mock()
+        context.get_remaining_time_in_millis.return_value = 1000
+        self.assertTrue(Deadline.of_lambda(context).expired())
+
+    def test_of_lambda_no_context(self):
+        self.assertIsNone(Deadline.of_lambda(None).remaining())
+
+# vim: ft=python:ts=4:sw=4
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import unittest
+
+from tagscheduler.events import *
+
+
+class ParseEventTest(unittest.TestCase):
+    """ parse_event() """
+
+    def test_scheduled_event(self):
+        event = {'source': "aws.events", 'detail-type': "Scheduled Event", 'region': "eu-west-1"}
+        self.assertIsNone(parse_event(event))
+
+    def test_not_a_dictionary(self):
+        self.assertIsNone(parse_event(None))
+        self.assertIsNone(parse_event("event"))
+
+    """ Targets """
+
+    def test_targets(self):
+        result = parse_event({'targets': [
+            {'region': "eu-west-1", 'type': "EC2", 'id': "i-1"},
+            {'region': "eu-west-1", 'type': "rds", 'id': "db-1"},
+            {'region': "eu-west-2", 'type': "EC2", 'id': "i-2"},
+        ]})
+        self.assertDictEqual(result, {
+            'eu-west-1': {'EC2': ["i-1"], 'RDS': ["db-1"]},
+            'eu-west-2': {'EC2': ["i-2"]},
+        })
+
+    def test_targets_unique(self):
+        target = {'region': "eu-west-1", 'type': "EC2", 'id': "i-1"}
+        result = parse_event({'targets': [target, dict(target, id="i-2"), target]})
+        self.assertListEqual(result['eu-west-1']['EC2'], ["i-1", "i-2"])
+
+    def test_targets_invalid_skipped(self):
+        result = parse_event({'targets': [
+            {'region': "eu-west-1", 'type': "S3", 'id': "bucket"},
+            {'region': "eu-west-1", 'id': "i-1"},
+            {'region': "eu-west-1", 'type': "EC2", 'id': "i-2"},
+        ]})
+        self.assertDictEqual(result, {'eu-west-1': {'EC2': ["i-2"]}})
+
+    def test_targets_empty(self):
+        self.assertDictEqual(parse_event({'targets': []}), {})
+
+    def test_regions(self):
+        result = parse_event({'targets': [{'region': "eu-west-1", 'type': "EC2", 'id': "i-1"}],
+                              'regions': ["eu-west-2"]})
+        self.assertDictEqual(result, {'eu-west-1': {'EC2': ["i-1"]}, 'eu-west-2': None})
+
+    """ Continuations """
+
+    def test_continuation_event(self):
+        targets = {'eu-west-1': {'EC2': ["i-1", "i-2"]}}
+        event = continuation_event(targets, ["eu-west-2"], 2)
+        self.assertEqual(event_handoffs(event), 2)
+        self.assertDictEqual(parse_event(event), {'eu-west-1': {'EC2': ["i-1", "i-2"]}, 'eu-west-2': None})
+
+    def test_continuation_shard(self):
+        event = continuation_event({}, ["eu-west-1"], shard=(1, 4))
+        self.assertEqual(parse_shard(event), (1, 4))
+        self.assertIsNone(parse_shard(continuation_event({}, ["eu-west-1"])))
+
+    def test_split_targets(self):
+        targets = {'eu-west-1': {'EC2': ["i-1", "i-2", "i-3"], 'RDS': ["db-1"]}}
+        chunks = split_targets(targets, 2)
+        self.assertEqual([sum(len(ids) for ids in c['eu-west-1'].values()) for c in chunks], [2, 2])
+        self.assertEqual(sorted(i for c in chunks for ids in c['eu-west-1'].values() for i in ids),
+                         ["db-1", "i-1", "i-2", "i-3"])
+
+    def test_split_targets_whole_regions(self):
+        chunks = split_targets({'eu-west-1': None}, 2)
+        self.assertListEqual(chunks, [{'eu-west-1': None}])
+        self.assertListEqual(split_targets({}, 2), [{}])
+
+    def test_shard_invalid(self):
+        self.assertIsNone(parse_shard({'shard': [4, 4]}))
+        self.assertIsNone(parse_shard({'shard': "invalid"}))
+        self.assertIsNone(parse_shard(None))
+
+    def test_event_handoffs_new_work(self):
+        self.assertEqual(event_handoffs({'source': "aws.events"}), 0)
+        self.assertEqual(event_handoffs({'handoffs': "invalid"}), 0)
+        self.assertEqual(event_handoffs(None), 0)
+
+    """ EC2 state change """
+
+    def test_ec2_state_change(self):
+        result = parse_event({
+            'source': "aws.ec2",
+            'detail-type': EC2_STATE_CHANGE,
+            'region': "eu-west-1",
+            'detail': {'instance-id': "i-1", 'state': "stopped"},
+        })
+        self.assertDictEqual(result, {'eu-west-1': {'EC2': ["i-1"]}})
+
+    """ Tag change """
+
+    def test_tag_change(self):
+        result = parse_event({
+            'source': "aws.tag",
+            'detail-type': TAG_CHANGE,
+            'region': "eu-west-1",
+            'resources': [
+                "arn:aws:ec2:eu-west-1:123456789012:instance/i-1",
+                "arn:aws:rds:eu-west-1:123456789012:db:database-1",
+                "arn:aws:s3:::bucket",
+            ],
+            'detail': {'changed-tag-keys': ["scheduler-daily"]},
+        })
+        self.assertDictEqual(result, {'eu-west-1': {
+            'EC2': ["i-1"],
+            'RDS': ["arn:aws:rds:eu-west-1:123456789012:db:database-1"],
+        }})
+
+    """ parse_arn() """
+
+    def test_parse_arn_ec2(self):
+        result = parse_arn("arn:aws:ec2:eu-west-1:123456789012:instance/i-1")
+        self.assertEqual(result, ("eu-west-1", 'EC2', "i-1"))
+
+    def test_parse_arn_other_ec2(self):
+        self.assertIsNone(parse_arn("arn:aws:ec2:eu-west-1:123456789012:volume/vol-1"))
+
+    def test_parse_arn_invalid(self):
+        self.assertIsNone(parse_arn("i-1"))
+
+
+# vim: ft=python:ts=4:sw=4
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import unittest
+from mock import Mock, patch
+
+from tagscheduler.fanout import *
+
+
+class ParseFanoutShardsTest(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertIsNone(parse_fanout_shards(""))
+        self.assertIsNone(parse_fanout_shards(None))
+
+    def test_default(self):
+        self.assertEqual(parse_fanout_shards("2"), (2, {}))
+
+    def test_overrides(self):
+        self.assertEqual(parse_fanout_shards("us-east-1=4, eu-west-1 = 2"), (1, {'us-east-1': 4, 'eu-west-1': 2}))
+        self.assertEqual(parse_fanout_shards("3,us-east-1=4"), (3, {'us-east-1': 4}))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, parse_fanout_shards, "abc")
+        self.assertRaises(ValueError, parse_fanout_shards, "0")
+        self.assertRaises(ValueError, parse_fanout_shards, "us-east-1=0")
+
+
+class ShardTest(unittest.TestCase):
+
+    def test_each_instance_in_one_shard(self):
+        ids = ["i-%08x" % i for i in range(200)]
+        for i_id in ids:
+            self.assertEqual(sum(in_shard(i_id, (index, 3)) for index in range(3)), 1)
+
+    def test_shards_balanced(self):
+        ids = ["i-%08x" % i for i in range(1000)]
+        sizes = [len([i for i in ids if in_shard(i, (index, 4))]) for index in range(4)]
+        self.assertGreater(min(sizes), 150)
+
+    def test_single_shard(self):
+        self.assertTrue(in_shard("i-1", (0, 1)))
+
+    def test_worker_events(self):
+        events = worker_events(["r1", "r2"], (1, {'r2': 2}))
+        self.assertListEqual(
+            [(e['regions'], e.get('shard')) for e in events],
+            [(["r1"], None), (["r2"], [0, 2]), (["r2"], [1, 2])]
+        )
+
+    def test_worker_events_discovered(self):
+        ids = ["i-%08x" % i for i in range(100)]
+        events = worker_events(["r1", "r2"], (1, {'r2': 3}), lambda region: {'EC2': ids})
+        self.assertEqual(events[0]['regions'], ["r1"])
+        self.assertEqual(len(events), 4)
+        for index, event in enumerate(events[1:]):
+            self.assertEqual(event['regions'], [])
+            self.assertNotIn('shard', event)
+            self.assertTrue(all(in_shard(t['id'], (index, 3)) for t in event['targets']))
+        self.assertEqual(sorted(t['id'] for e in events[1:] for t in e['targets']), ids)
+
+    def test_worker_events_split(self):
+        ids = ["i-%08x" % i for i in range(MAX_WORKER_TARGETS * 3)]
+        events = worker_events(["r1"], (2, {}), lambda region: {'EC2': ids})
+        self.assertGreater(len(events), 2)
+        self.assertTrue(all(len(e['targets']) <= MAX_WORKER_TARGETS for e in events))
+        self.assertEqual(sum(len(e['targets']) for e in events), len(ids))
+
+    def test_worker_events_discovery_error(self):
+        events = worker_events(["r1"], (2, {}), Mock(side_effect=Exception()))
+        self.assertListEqual([(e['regions'], e.get('shard')) for e in events], [
+            (["r1"], [0, 2]), (["r1"], [1, 2])
+        ])
+
+
+class FanOutTest(unittest.TestCase):
+
+    def test_local_invoker(self):
+        handler = Mock(return_value={'counters': {'instances': 2}})
+        self.assertEqual(LocalInvoker(handler).invoke({'regions': ["r1"]}), handler.return_value)
+        handler.assert_called_once_with({'regions': ["r1"]}, None)
+
+    def test_lambda_invoker(self):
+        with patch('tagscheduler.fanout.invoke_function') as if_mock:
+            self.assertIsNone(LambdaInvoker("TagScheduler").invoke({'regions': ["r1"]}))
+        if_mock.assert_called_once_with("TagScheduler", {'regions': ["r1"]})
+
+    def test_summary(self):
+        invoker = Mock()
+        invoker.invoke.side_effect = [
+            {'counters': {'instances': 2, 'actions': 1}},
+            {'counters': {'instances': 3}},
+            None,
+        ]
+        summary = fan_out([{}, {}, {}], invoker)
+        self.assertEqual(summary['counters'], {
+            'invocations': 3, 'workers.completed': 2, 'instances': 5, 'actions': 1
+        })
+
+    def test_invocation_error_isolated(self):
+        invoker = Mock()
+        invoker.invoke.side_effect = [Exception("Failure"), None]
+        summary = fan_out([{'regions': ["r1"]}, {'regions': ["r2"]}], invoker)
+        self.assertEqual(summary['counters']['invocations'], 1)
+        self.assertEqual(summary['counters']['errors.invocation'], 1)
+
+# vim: ft=python:ts=4:sw=4
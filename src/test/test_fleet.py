@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import unittest
+from mock import patch
+
+from benchmark.fleet import *
+from tagscheduler.awsobjects import clear_sessions, get_all_instances
+from tagscheduler.metrics import metrics
+from tagscheduler.tagscheduler import run_tagscheduler
+
+
+class GenerateFleetTest(unittest.TestCase):
+    """ generate_fleet() """
+
+    def test_sizes(self):
+        fleet = generate_fleet(['r1', 'r2'], 10, 3)
+        self.assertListEqual(list(fleet.keys()), ['r1', 'r2'])
+        self.assertEqual(len(fleet['r1']['ec2']), 10)
+        self.assertEqual(len(fleet['r2']['rds']), 3)
+
+    def test_same_seed_same_fleet(self):
+        self.assertEqual(generate_fleet(['r1'], 20, 5, seed=7), generate_fleet(['r1'], 20, 5, seed=7))
+
+    def test_tag_mix(self):
+        fleet = generate_fleet(['r1'], 50, 0, tag_mix={'ignore': 1})
+        for instance in fleet['r1']['ec2']:
+            self.assertIn("scheduler-ignore_all", [t['Key'] for t in instance['Tags']])
+
+
+class FakeSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fleet = generate_fleet(['r1'], 250, 20, tag_mix={'daily': 1, 'none': 1})
+        self.session = FakeSession(self.fleet, region_name='r1')
+
+    """ Discovery """
+
+    def test_ec2_tag_filter(self):
+        tagged = [
+            i for i in self.fleet['r1']['ec2']
+            if any(t['Key'].startswith("scheduler-") for t in i['Tags'])
+        ]
+        instances = list(get_all_instances('r1', self.session, "scheduler")['EC2'])
+        self.assertEqual(len(instances), len(tagged))
+
+    def test_pages_counted(self):
+        list(get_all_instances('r1', self.session)['EC2'])
+        self.assertEqual(self.session.calls.calls['ec2.DescribeInstances'], 3)
+
+    def test_ids_filter(self):
+        ids = {
+            'EC2': [self.fleet['r1']['ec2'][0]['InstanceId']],
+            'RDS': [self.fleet['r1']['rds'][0]['DbiResourceId'], self.fleet['r1']['rds'][1]['DBInstanceArn']],
+        }
+        instances = get_all_instances('r1', self.session, ids=ids)
+        self.assertEqual(len(list(instances['EC2'])), 1)
+        self.assertEqual(len(list(instances['RDS'])), 2)
+
+    def test_rds_without_tag_list(self):
+        session = FakeSession(self.fleet, rds_tag_list=False, region_name='r1')
+        instances = list(get_all_instances('r1', session, "scheduler")['RDS'])
+        for instance in instances:
+            instance.tags()
+        self.assertEqual(session.calls.calls['rds.ListTagsForResource'], 20)
+
+
+class PipelineTest(unittest.TestCase):
+    """ run_tagscheduler() on a synthetic fleet """
+
+    def test_run(self):
+        fleet = generate_fleet(['r1', 'r2'], 100, 20)
+        calls = ApiCalls()
+        session = lambda region_name=None: FakeSession(fleet, calls=calls, region_name=region_name)
+
+        clear_sessions()
+        with patch('boto3.session.Session', session):
+            run_tagscheduler(['r1', 'r2'], 2)
+
+        self.assertGreater(metrics.counter("instances"), 0)
+        self.assertEqual(metrics.counter("errors.instance"), 0)
+        self.assertEqual(metrics.counter("errors.region"), 0)
+        self.assertEqual(calls.calls['ec2.DescribeInstances'], 2)
+        self.assertEqual(calls.calls['rds.DescribeDBInstances'], 2)
+
+
+# vim: ft=python:ts=4:sw=4
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import sys
+import json
+import logging
+import unittest
+from datetime import datetime
+
+from tagscheduler.logger import *
+
+
+class JsonFormatterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.formatter = JsonFormatter()
+
+    def format(self, message, args=None, exc_info=None, **kwargs):
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, message, args, exc_info)
+        record.__dict__.update(kwargs)
+        return json.loads(self.formatter.format(record))
+
+    def test_base_fields(self):
+        result = self.format("Hello %s", ("World",))
+        self.assertEqual(result['level'], "INFO")
+        self.assertEqual(result['message'], "Hello World")
+        self.assertTrue(result['time'].endswith("Z"))
+
+    def test_extra_fields(self):
+        result = self.format("Message", **log_fields(region="eu-west-2", instances=3))
+        self.assertEqual(result['region'], "eu-west-2")
+        self.assertEqual(result['instances'], 3)
+
+    def test_reserved_fields(self):
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "Message", None, None)
+        expected = datetime.utcfromtimestamp(record.created).isoformat() + "Z"
+        record.__dict__.update(log_fields(time="2030-01-01T00:00:00", level="x", message="y"))
+        result = json.loads(self.formatter.format(record))
+        self.assertEqual(result['time'], expected)
+        self.assertEqual(result['level'], "INFO")
+        self.assertEqual(result['message'], "Message")
+        self.assertEqual(result['field_time'], "2030-01-01T00:00:00")
+        self.assertEqual(result['field_level'], "x")
+        self.assertEqual(result['field_message'], "y")
+
+    def test_no_exception(self):
+        result = self.format("Message", exc_info=(None, None, None))
+        self.assertNotIn('exception', result)
+
+    def test_exception(self):
+        try:
+            raise ValueError("Failure")
+        except ValueError:
+            result = self.format("Message", exc_info=sys.exc_info())
+        self.assertIn("ValueError: Failure", result['exception'])
+
+    def test_single_line(self):
+        result = self.formatter.format(
+            logging.LogRecord("test", logging.INFO, __file__, 1, "Line 1\nLine 2", None, None)
+        )
+        self.assertEqual(len(result.splitlines()), 1)
+
+
+class LoggerTest(unittest.TestCase):
+
+    def tearDown(self):
+        set_level(DEFAULT_LOG_LEVEL)
+
+    def test_single_handler(self):
+        get_logger()
+        self.assertEqual(len(get_logger().handlers), 1)
+
+    def test_set_level(self):
+        set_level("debug")
+        self.assertTrue(log.isEnabledFor(logging.DEBUG))
+
+    def test_set_level_invalid(self):
+        set_level("not_a_level")
+        self.assertEqual(log.level, logging.INFO)
+
+    def test_log_fields_sorted(self):
+        result = log_fields(b=1, a=2)
+        self.assertListEqual(result['fields'].keys(), ['a', 'b'])
+
+
+# vim: ft=python:ts=4:sw=4
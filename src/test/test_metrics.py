@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import json
+import threading
+import unittest
+from mock import Mock
+
+from tagscheduler.metrics import *
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+
+    """ incr() and add_time() """
+
+    def test_incr(self):
+        self.metrics.incr("a")
+        self.metrics.incr("a", 4)
+        self.assertEqual(self.metrics.counter("a"), 5)
+        self.assertEqual(self.metrics.counter("b"), 0)
+
+    def test_add_time(self):
+        self.metrics.add_time("t", 1.0)
+        self.metrics.add_time("t", 3.0, 2)
+        timer = self.metrics.report()['timers']['t']
+        self.assertEqual(timer['count'], 3)
+        self.assertEqual(timer['seconds'], 4.0)
+        self.assertEqual(timer['max_seconds'], 1.0)
+
+    def test_add_time_max(self):
+        self.metrics.add_time("t", 3.0, 2, 2.5)
+        self.metrics.add_time("t", 2.0)
+        self.assertEqual(self.metrics.report()['timers']['t']['max_seconds'], 2.5)
+
+    def test_timer(self):
+        with self.metrics.timer("t"):
+            pass
+        self.assertEqual(self.metrics.report()['timers']['t']['count'], 1)
+
+    def test_timer_exception(self):
+        with self.assertRaises(ValueError):
+            with self.metrics.timer("t"):
+                raise ValueError()
+        self.assertEqual(self.metrics.report()['timers']['t']['count'], 1)
+
+    def test_incr_threads(self):
+        def worker():
+            for i in range(1000):
+                self.metrics.incr("a")
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.metrics.counter("a"), 8000)
+
+    """ reset() """
+
+    def test_reset(self):
+        self.metrics.incr("a")
+        self.metrics.add_time("t", 1.0)
+        self.metrics.reset()
+        self.assertEqual(self.metrics.report(), {'counters': {}, 'timers': {}})
+
+    """ emf() """
+
+    def test_emf(self):
+        self.metrics.incr("instances", 3)
+        self.metrics.add_time("run", 0.5)
+        result = json.loads(self.metrics.emf("Test", {'Service': "TagScheduler"}))
+
+        self.assertEqual(result['instances'], 3)
+        self.assertEqual(result['run'], 500.0)
+        self.assertEqual(result['Service'], "TagScheduler")
+
+        directive = result['_aws']['CloudWatchMetrics'][0]
+        self.assertEqual(directive['Namespace'], "Test")
+        self.assertEqual(directive['Dimensions'], [["Service"]])
+        self.assertEqual(directive['Metrics'], [
+            {'Name': "instances", 'Unit': "Count"},
+            {'Name': "run", 'Unit': "Milliseconds"},
+        ])
+        self.assertIsInstance(result['_aws']['Timestamp'], int)
+
+
+class InstrumentSessionTest(unittest.TestCase):
+    """ instrument_session() """
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.session = Mock()
+        instrument_session(self.session, self.metrics)
+        self.hooks = dict(
+            (c[0][0], c[0][1]) for c in self.session.events.register.call_args_list
+        )
+
+    def test_registers_hooks(self):
+        self.assertItemsEqual(self.hooks.keys(), ['before-call', 'after-call'])
+
+    def test_times_api_calls(self):
+        model = Mock()
+        model.name = "DescribeInstances"
+        model.service_model.service_name = "ec2"
+        context = {}
+
+        self.hooks['before-call'](model=model, context=context, params={})
+        self.hooks['after-call'](model=model, context=context, parsed={})
+
+        self.assertEqual(context, {})
+        self.assertEqual(self.metrics.report()['timers']['api.ec2.DescribeInstances']['count'], 1)
+
+    def test_after_call_without_start(self):
+        model = Mock()
+        self.hooks['after-call'](model=model, context={}, parsed={})
+        self.assertEqual(self.metrics.report()['timers'], {})
+
+
+# vim: ft=python:ts=4:sw=4
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import json
+import unittest
+from StringIO import StringIO
+
+from mocked_objects import *
+from tagscheduler.plan import *
+
+
+class PlanRecordTest(unittest.TestCase):
+
+    def setUp(self):
+        self.instance = MockSchedulable(status="running")
+
+    def test_fields(self):
+        result = plan_record("eu-west-2", "EC2", self.instance, [], "stop")
+        self.assertListEqual(
+            result.keys(),
+            ['region', 'type', 'id', 'state', 'schedulers', 'action']
+        )
+
+    def test_values(self):
+        schedulers = [MockScheduler(name="", value="ignore")]
+        result = plan_record("eu-west-2", "EC2", self.instance, schedulers, None)
+        self.assertEqual(result['region'], "eu-west-2")
+        self.assertEqual(result['id'], "mock_schedulable")
+        self.assertEqual(result['state'], "running")
+        self.assertListEqual(result['schedulers'], ["mockscheduler=ignore"])
+        self.assertIsNone(result['action'])
+
+    """ scheduler_label() """
+
+    def test_label_no_name(self):
+        result = scheduler_label(MockScheduler(name="", value="start"))
+        self.assertEqual(result, "mockscheduler=start")
+
+    def test_label_with_name(self):
+        result = scheduler_label(MockScheduler(name="office", value="start"))
+        self.assertEqual(result, "mockscheduler-office=start")
+
+
+class PlanWriterTest(unittest.TestCase):
+
+    def test_write_json_lines(self):
+        stream = StringIO()
+        writer = PlanWriter(stream)
+        writer.write({'id': "a"})
+        writer.write({'id': "b"})
+        lines = stream.getvalue().splitlines()
+        self.assertListEqual([json.loads(l) for l in lines], [{'id': "a"}, {'id': "b"}])
+        self.assertEqual(writer.count, 2)
+
+    def test_write_read(self):
+        stream = StringIO()
+        record = plan_record("eu-west-2", "EC2", MockSchedulable(status="stopped"), [], "start")
+        PlanWriter(stream).write(record)
+        result = list(read_plan(StringIO(stream.getvalue())))
+        self.assertListEqual(result, [dict(record)])
+
+
+class ReadPlanTest(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertListEqual(list(read_plan(StringIO(""))), [])
+
+    def test_skip_blank_lines(self):
+        result = list(read_plan(StringIO('{"id": "a"}\n\n  \n{"id": "b"}\n')))
+        self.assertListEqual(result, [{'id': "a"}, {'id': "b"}])
+
+
+# vim: ft=python:ts=4:sw=4
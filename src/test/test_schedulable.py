@@ -26,9 +26,10 @@
 from __future__ import print_function
 
 import unittest
-from mock import patch
+from mock import patch, Mock
 
 import pytz as tz
+from botocore.exceptions import ClientError
 from mocked_objects import *
 from datetime import datetime, time
 from tagscheduler.schedulable import *
@@ -146,6 +147,117 @@ class EC2SchedulableTest(unittest.TestCase):
         result = EC2Schedulable(mock_ec2, mock_ec2).start()
         self.assertEquals(result, True)
 
+    """ start_batch() and stop_batch() """
+
+    def build_batch(self, count, client=None):
+        client = client or Mock()
+        return client, [
+            EC2Schedulable(client, MockEC2Instance(instance_id="i-%03d" % i))
+            for i in range(count)
+        ]
+
+    def test_start_batch_single_call(self):
+        client, instances = self.build_batch(3)
+        result = EC2Schedulable.start_batch(instances)
+        self.assertEqual(result, 3)
+        client.start_instances.assert_called_once_with(
+            InstanceIds=["i-000", "i-001", "i-002"]
+        )
+
+    def test_stop_batch_single_call(self):
+        client, instances = self.build_batch(3)
+        result = EC2Schedulable.stop_batch(instances)
+        self.assertEqual(result, 3)
+        client.stop_instances.assert_called_once_with(
+            InstanceIds=["i-000", "i-001", "i-002"]
+        )
+
+    def test_batch_chunks(self):
+        count = EC2Schedulable.BATCH_SIZE * 2 + 1
+        client, instances = self.build_batch(count)
+        result = EC2Schedulable.start_batch(instances)
+        self.assertEqual(result, count)
+        calls = client.start_instances.call_args_list
+        self.assertListEqual(
+            [len(c[1]['InstanceIds']) for c in calls],
+            [EC2Schedulable.BATCH_SIZE, EC2Schedulable.BATCH_SIZE, 1]
+        )
+
+    def test_batch_by_client(self):
+        client_1, instances_1 = self.build_batch(2)
+        client_2, instances_2 = self.build_batch(3)
+        EC2Schedulable.stop_batch(instances_1 + instances_2)
+        self.assertEqual(client_1.stop_instances.call_count, 1)
+        self.assertEqual(client_2.stop_instances.call_count, 1)
+
+    def test_batch_failure_fallback(self):
+        def batch_failure(InstanceIds):
+            if len(InstanceIds) > 1:
+                raise Exception("Batch failure")
+        client, instances = self.build_batch(3)
+        client.start_instances.side_effect = batch_failure
+        result = EC2Schedulable.start_batch(instances)
+        self.assertEqual(result, 3)
+        self.assertEqual(client.start_instances.call_count, 4)
+
+    def test_batch_failure_isolated(self):
+        def instance_failure(InstanceIds):
+            if len(InstanceIds) > 1 or InstanceIds[0] == "i-001":
+                raise Exception("Failure")
+        client, instances = self.build_batch(3)
+        client.stop_instances.side_effect = instance_failure
+        result = EC2Schedulable.stop_batch(instances)
+        self.assertEqual(result, 2)
+
+    @patch('tagscheduler.throttling.time.sleep')
+    def test_batch_throttled_retried(self, sleep_mock):
+        throttled = ClientError({'Error': {'Code': "RequestLimitExceeded"}}, "StopInstances")
+        client, instances = self.build_batch(3)
+        client.stop_instances.side_effect = [throttled, None]
+        result = EC2Schedulable.stop_batch(instances)
+        self.assertEqual(result, 3)
+        self.assertEqual(client.stop_instances.call_count, 2)
+        self.assertEqual(len(client.stop_instances.call_args[1]['InstanceIds']), 3)
+
+    """ to_record() and from_record() """
+
+    def test_to_record(self):
+        mock_ec2 = MockEC2Instance(instance_id="ABC", status="running")
+        result = EC2Schedulable(mock_ec2, mock_ec2).to_record()
+        self.assertDictEqual(dict(result), {'id': "ABC", 'state': "running"})
+
+    def test_from_record(self):
+        mock_ec2 = MockEC2Instance(instance_id="ABC", status="stopped")
+        record = EC2Schedulable(mock_ec2, mock_ec2).to_record()
+        result = EC2Schedulable.from_record(mock_ec2, record)
+        self.assertEqual(result.id(), "ABC")
+        self.assertEqual(result.status(), "stopped")
+
+    """ Snapshot """
+
+    def test_snapshot_slots(self):
+        mock_ec2 = MockEC2Instance()
+        result = EC2Schedulable(mock_ec2, mock_ec2)
+        with self.assertRaises(AttributeError):
+            result.other = True
+
+    def test_snapshot_detached(self):
+        mock_ec2 = MockEC2Instance(status="running", instance_id="ABC")
+        result = EC2Schedulable(mock_ec2, mock_ec2)
+        mock_ec2['State']['Name'] = "stopped"
+        self.assertEqual(result.status(), "running")
+
+    def test_start_time_aware(self):
+        mock_ec2 = MockEC2Instance(status="running")
+        mock_ec2['LaunchTime'] = tz.timezone("Europe/Rome").localize(datetime(2018, 5, 4, 5, 2, 1))
+        result = EC2Schedulable(mock_ec2, mock_ec2).start_time()
+        self.assertEquals(result, datetime(2018, 5, 4, 3, 2, 1, tzinfo=tz.utc))
+
+    def test_stop_time_no_reason(self):
+        mock_ec2 = MockEC2Instance(status="stopped", state_transition_reason="")
+        result = EC2Schedulable(mock_ec2, mock_ec2).stop_time()
+        self.assertIsNone(result)
+
 
 class RDSSchedulableTest(unittest.TestCase):
 
@@ -197,6 +309,34 @@ class RDSSchedulableTest(unittest.TestCase):
             'Value': 'value_2'
         }])
 
+    def test_tags_from_describe(self):
+        mock_rds = MockRDSInstance(tag_list={'test_2': 'value_2', 'test_1': 'value_1'})
+        with patch.object(MockRDSInstance, 'list_tags_for_resource') as list_tags:
+            result = RDSSchedulable(mock_rds, mock_rds).tags()
+        list_tags.assert_not_called()
+        self.assertListEqual(result, [{
+            'Key': 'test_1',
+            'Value': 'value_1'
+        }, {
+            'Key': 'test_2',
+            'Value': 'value_2'
+        }])
+
+    def test_tags_from_constructor(self):
+        mock_rds = MockRDSInstance(tags={'test_1': 'value_1'})
+        with patch.object(MockRDSInstance, 'list_tags_for_resource') as list_tags:
+            result = RDSSchedulable(mock_rds, mock_rds, [{'Key': 'test_2', 'Value': 'value_2'}]).tags()
+        list_tags.assert_not_called()
+        self.assertListEqual(result, [{'Key': 'test_2', 'Value': 'value_2'}])
+
+    def test_tags_fetched_once(self):
+        mock_rds = MockRDSInstance(tags={'test_1': 'value_1'})
+        with patch.object(MockRDSInstance, 'list_tags_for_resource', return_value=mock_rds.tags) as list_tags:
+            result = RDSSchedulable(mock_rds, mock_rds)
+            result.tags()
+            result.tags()
+        list_tags.assert_called_once_with(ResourceName="random_string")
+
     """ start_time() and stop_time() """
 
     def test_start_time_is_none(self):
@@ -221,5 +361,50 @@ class RDSSchedulableTest(unittest.TestCase):
         result = RDSSchedulable(mock_rds, mock_rds).start()
         self.assertEquals(result, True)
 
+    """ to_record() and from_record() """
+
+    def test_to_record(self):
+        mock_rds = MockRDSInstance(db_resource_id="ABC", db_instance_status="available")
+        result = RDSSchedulable(mock_rds, mock_rds).to_record()
+        self.assertDictEqual(dict(result), {'id': "ABC", 'state': "running", 'identifier': None})
+
+    def test_from_record(self):
+        record = {'id': "ABC", 'state': "running", 'identifier': "db-1"}
+        mock_rds = MockRDSInstance()
+        result = RDSSchedulable.from_record(mock_rds, record)
+        self.assertEqual(result.id(), "ABC")
+        self.assertEqual(result.status(), "running")
+        with patch.object(MockRDSInstance, 'stop_db_instance') as stop:
+            result.stop()
+        stop.assert_called_once_with(DBInstanceIdentifier="db-1")
+
+    """ Snapshot """
+
+    def test_snapshot_slots(self):
+        mock_rds = MockRDSInstance()
+        result = RDSSchedulable(mock_rds, mock_rds)
+        with self.assertRaises(AttributeError):
+            result.other = True
+
+    def test_status_other(self):
+        mock_rds = MockRDSInstance(db_instance_status="Starting")
+        result = RDSSchedulable(mock_rds, mock_rds)
+        self.assertIsNone(result.status())
+
+    """ start_batch() and stop_batch() """
+
+    def test_start_batch(self):
+        instances = [RDSSchedulable(MockRDSInstance(), MockRDSInstance()) for _ in range(3)]
+        with patch.object(MockRDSInstance, 'start_db_instance') as single_start:
+            result = RDSSchedulable.start_batch(instances)
+        self.assertEqual(result, 3)
+        self.assertEqual(single_start.call_count, 3)
+
+    def test_stop_batch_isolated(self):
+        instances = [RDSSchedulable(MockRDSInstance(), MockRDSInstance()) for _ in range(3)]
+        instances[0]._client.stop_db_instance = Mock(side_effect=Exception("Instance failure"))
+        result = RDSSchedulable.stop_batch(instances)
+        self.assertEqual(result, 2)
+
 
 # vim: ft=python:ts=4:sw=4
\ No newline at end of file
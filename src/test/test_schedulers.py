@@ -25,24 +25,172 @@
 
 from __future__ import print_function
 
+import threading
 import unittest
 
 import pytz as tz
+from mock import Mock, patch
 from mocked_objects import *
-from datetime import datetime, time
+from datetime import date, datetime, time, timedelta
 from tagscheduler.schedulers import *
 
 
-class SchedulerTest(unittest.TestCase):
+class RunContextTest(unittest.TestCase):
     """
-    Tests for concrete methods of Scheduler
+    Tests for RunContext
     """
+    def test_create_naive_is_utc(self):
+        result = RunContext.create(datetime(2018, 2, 1, 14, 30))
+        self.assertEqual(result.now, datetime(2018, 2, 1, 14, 30, tzinfo=tz.utc))
+
+    def test_create_converts_to_utc(self):
+        now = tz.timezone("Europe/Rome").localize(datetime(2018, 2, 1, 14, 30))
+        result = RunContext.create(now)
+        self.assertEqual(result.time, time(13, 30, tzinfo=tz.utc))
+
+    def test_create_default_now(self):
+        result = RunContext.create()
+        self.assertEqual(result.now.tzinfo, tz.utc)
+
+    def test_day(self):
+        result = RunContext.create(datetime(2018, 2, 1, 14))     # It's a Thursday
+        self.assertEqual(result.day, DAY_BITS['thu'])
+
+    def test_time(self):
+        result = RunContext.create(datetime(2018, 2, 1, 14, 30, 15))
+        self.assertEqual(result.time, time(14, 30, 15, tzinfo=tz.utc))
+
+    def test_create_no_decisions(self):
+        result = RunContext.create(datetime(2018, 2, 1, 14))
+        self.assertEqual(result.decisions, {})
+        self.assertIsNot(result.decisions, RunContext.create(datetime(2018, 2, 1, 14)).decisions)
+
+
+class EvaluationContextTest(unittest.TestCase):
+    """
+    Tests for EvaluationContext
+    """
+    def setUp(self):
+        self.run = RunContext.create(datetime(2018, 2, 1, 14))
+        self.time = datetime(2018, 2, 1, 12, tzinfo=tz.utc)
+
+    def test_of_running(self):
+        mock = MockSchedulable(status="running", start_time=self.time, stop_time=self.run.now)
+        result = EvaluationContext.of(mock, self.run)
+        self.assertEqual(result, EvaluationContext(self.run, "running", self.time))
 
-    """ now_utc() """
+    def test_of_stopped(self):
+        mock = MockSchedulable(status="stopped", start_time=self.run.now, stop_time=self.time)
+        result = EvaluationContext.of(mock, self.run)
+        self.assertEqual(result, EvaluationContext(self.run, "stopped", self.time))
 
-    def test_now_utc_is_utc(self):
-        result = MockScheduler().now_utc()
-        self.assertEqual(result.tzinfo, tz.utc)
+    def test_of_other_status(self):
+        mock = MockSchedulable(status="pending", start_time=self.time, stop_time=self.time)
+        result = EvaluationContext.of(mock, self.run)
+        self.assertIsNone(result.status_time)
+
+    def test_of_default_run(self):
+        result = EvaluationContext.of(MockSchedulable())
+        self.assertEqual(result.now.tzinfo, tz.utc)
+
+    def test_now(self):
+        result = EvaluationContext.of(MockSchedulable(), self.run)
+        self.assertEqual(result.now, self.run.now)
+
+
+class CustomScheduler(Scheduler):
+    def __str__(self):
+        return "CustomScheduler"
+
+    @staticmethod
+    def type():
+        return "custom"
+
+    def check(self, context=None):
+        return None
+
+
+class SchedulerTest(unittest.TestCase):
+    """
+    Tests for concrete methods of Scheduler
+    """
+    def tearDown(self):
+        SCHEDULERS.pop(CustomScheduler.type(), None)
+        unknown_schedulers.clear()
+
+    """ build() """
+
+    def test_build_registered_types(self):
+        for sched_type in ["daily", "timer", "ignore_all", "fixed"]:
+            self.assertEqual(SCHEDULERS[sched_type].type(), sched_type)
+
+    def test_build_ignores_case(self):
+        result = Scheduler.build(MockSchedulable(), "Daily", "", "0800/1800")
+        self.assertIsInstance(result, DailyScheduler)
+
+    def test_build_registered_scheduler(self):
+        register_scheduler(CustomScheduler)
+        result = Scheduler.build(MockSchedulable(), "custom", "", "")
+        self.assertIsInstance(result, CustomScheduler)
+
+    @patch('pkg_resources.iter_entry_points')
+    def test_build_entry_point_scheduler(self, entry_points):
+        entry_points.return_value = [Mock(load=Mock(return_value=CustomScheduler))]
+        result = Scheduler.build(MockSchedulable(), "custom", "", "")
+        self.assertIsInstance(result, CustomScheduler)
+        entry_points.assert_called_once_with(SCHEDULERS_ENTRY_POINTS, "custom")
+        self.assertIs(SCHEDULERS["custom"], CustomScheduler)
+
+    @patch('pkg_resources.iter_entry_points')
+    def test_build_invalid_entry_point(self, entry_points):
+        entry_points.return_value = [Mock(load=Mock(side_effect=ImportError))]
+        self.assertIsNone(Scheduler.build(MockSchedulable(), "custom", "", ""))
+
+    @patch('pkg_resources.iter_entry_points')
+    def test_build_unknown_reads_entry_points_once(self, entry_points):
+        entry_points.return_value = []
+        self.assertIsNone(Scheduler.build(MockSchedulable(), "custom", "", ""))
+        self.assertIsNone(Scheduler.build(MockSchedulable(), "custom", "", ""))
+        self.assertEqual(entry_points.call_count, 1)
+
+    @patch('pkg_resources.iter_entry_points')
+    def test_build_registered_skips_entry_points(self, entry_points):
+        Scheduler.build(MockSchedulable(), "fixed", "", "start")
+        entry_points.assert_not_called()
+
+    """ context() """
+
+    def test_context_of_run(self):
+        run = RunContext.create(datetime(2018, 2, 1, 14))
+        result = MockScheduler().context(run)
+        self.assertIs(result.run, run)
+
+    def test_context_now_is_utc(self):
+        result = MockScheduler().context()
+        self.assertEqual(result.now.tzinfo, tz.utc)
+
+    """ compile() """
+
+    def test_compile_shared_spec(self):
+        first = Scheduler.build(MockSchedulable(), "daily", "", "0800/1800/weekdays/Europe-London")
+        second = Scheduler.build(MockSchedulable(), "daily", "other", "0800/1800/weekdays/Europe-London")
+        self.assertIs(first._spec, second._spec)
+
+    def test_compile_keyed_by_type(self):
+        self.assertIsNot(DailyScheduler.compile("start/10"), TimerScheduler.compile("start/10"))
+
+    def test_compile_counters(self):
+        Scheduler.spec_cache.clear()
+        DailyScheduler.compile("1300/1500")
+        DailyScheduler.compile("1300/1500")
+        DailyScheduler.compile("1400/1500")
+        self.assertEqual(Scheduler.spec_cache.hits, 1)
+        self.assertEqual(Scheduler.spec_cache.misses, 2)
+
+    def test_compile_spec_immutable(self):
+        spec = DailyScheduler.compile("1300/1500")
+        with self.assertRaises(AttributeError):
+            spec.start_time = None
 
     """ parse_timezone() """
 
@@ -58,28 +206,23 @@ class SchedulerTest(unittest.TestCase):
         result = Scheduler.parse_timezone("Canada-Yukon")
         self.assertEqual(result, tz.timezone("Canada/Yukon"))
 
-    """ parse_time() """
+    """ parse_local_time() """
 
     def test_parse_none_time(self):
-        result = Scheduler.parse_time(None, None)
+        result = Scheduler.parse_local_time(None)
         self.assertIsNone(result)
 
     def test_parse_empty_time(self):
-        result = Scheduler.parse_time("", None)
+        result = Scheduler.parse_local_time("")
         self.assertIsNone(result)
 
     def test_parse_time(self):
-        result = Scheduler.parse_time("1122", None)
-        self.assertEqual(result, time(11, 22, tzinfo=tz.utc))
+        result = Scheduler.parse_local_time(" 1122 ")
+        self.assertEqual(result, time(11, 22))
 
-    def test_parse_time_is_utc(self):
-        result = Scheduler.parse_time("1122", None)
-        self.assertEqual(result.tzinfo, tz.utc)
-
-    def test_parse_time_withtz(self):
-        # UTC is 0 hour ahead of Yukon
-        result = Scheduler.parse_time("1122", "Canada-Yukon")
-        self.assertEqual(result, time(20, 22, tzinfo=tz.utc))
+    def test_parse_time_invalid(self):
+        with self.assertRaises(ValueError):
+            Scheduler.parse_local_time("2500")
 
     """ parse_day() """
 
@@ -89,27 +232,34 @@ class SchedulerTest(unittest.TestCase):
 
     def test_parse_empty_day(self):
         result = Scheduler.parse_day("")
-        self.assertEqual(result, ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun'])
+        self.assertEqual(day_names(result), ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun'])
 
     def test_parse_all_day(self):
         result = Scheduler.parse_day("all")
-        self.assertEqual(result, ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun'])
+        self.assertEqual(day_names(result), ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun'])
 
     def test_parse_weekdays_day(self):
         result = Scheduler.parse_day("weekdays")
-        self.assertEqual(result, ['mon', 'tue', 'wed', 'thu', 'fri'])
+        self.assertEqual(day_names(result), ['mon', 'tue', 'wed', 'thu', 'fri'])
 
     def test_parse_weekends_day(self):
         result = Scheduler.parse_day("weekends")
-        self.assertEqual(result, ['sat', 'sun'])
+        self.assertEqual(day_names(result), ['sat', 'sun'])
 
     def test_parse_single_day(self):
         result = Scheduler.parse_day("mon")
-        self.assertEqual(result, ['mon'])
+        self.assertEqual(result, 0b0000001)
 
     def test_parse_list_day(self):
         result = Scheduler.parse_day("tue.thu")
-        self.assertEqual(result, ['tue', 'thu'])
+        self.assertEqual(result, 0b0001010)
+
+    def test_parse_unknown_day(self):
+        result = Scheduler.parse_day("tue.xyz")
+        self.assertEqual(day_names(result), ['tue'])
+
+    def test_parse_groups_shared(self):
+        self.assertIs(Scheduler.parse_day("weekdays"), Scheduler.parse_day("mon.tue.wed.thu.fri"))
 
     def test_parse_range_day(self):
         result = Scheduler.parse_day("tue-thu")
@@ -127,7 +277,7 @@ class DailySchedulerTest(unittest.TestCase):
     def setUp(self):
         self.mock = MockSchedulable()
         self.type = DailyScheduler.type()
-        self.all_days = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+        self.all_days = ALL_DAYS
 
     """ Identifier """
 
@@ -195,78 +345,223 @@ class DailySchedulerTest(unittest.TestCase):
 
     def test_check_outofday(self):
         scheduler = Scheduler.build(MockSchedulable(), self.type, "", "1122/2211/mon")
-        scheduler._mock_now_time = datetime(2018, 2, 1, 12, 34, 56)  # It's a Thursday
-        self.assertIsNone(scheduler.check())
+        run = RunContext.create(datetime(2018, 2, 1, 12, 34, 56))  # It's a Thursday
+        self.assertIsNone(scheduler.check(scheduler.context(run)))
 
     def test_check_singleday(self):
         scheduler = Scheduler.build(MockSchedulable(), self.type, "", "1300/1500/thu")
-        scheduler._mock_now_time = datetime(2018, 2, 1, 14)
-        self.assertEqual(scheduler.check(), "start")
+        run = RunContext.create(datetime(2018, 2, 1, 14))
+        self.assertEqual(scheduler.check(scheduler.context(run)), "start")
 
     def test_check_listofdays(self):
         scheduler = Scheduler.build(MockSchedulable(), self.type, "", "1300/1500/wed.thu.fri")
-        scheduler._mock_now_time = datetime(2018, 2, 1, 14)
-        self.assertEqual(scheduler.check(), "start")
+        run = RunContext.create(datetime(2018, 2, 1, 14))
+        self.assertEqual(scheduler.check(scheduler.context(run)), "start")
 
     def test_check_shortcutdays(self):
         scheduler = Scheduler.build(MockSchedulable(), self.type, "", "1300/1500/weekdays")
-        scheduler._mock_now_time = datetime(2018, 2, 1, 14)
-        self.assertEqual(scheduler.check(), "start")
+        run = RunContext.create(datetime(2018, 2, 1, 14))
+        self.assertEqual(scheduler.check(scheduler.context(run)), "start")
 
     def test_nostarttime_before_stoptime(self):
         scheduler = Scheduler.build(MockSchedulable(), self.type, "", "/1400")
-        scheduler._mock_now_time = datetime(2018, 2, 1, 10)
-        self.assertIsNone(scheduler.check())
+        run = RunContext.create(datetime(2018, 2, 1, 10))
+        self.assertIsNone(scheduler.check(scheduler.context(run)))
 
     def test_nostarttime_after_stoptime(self):
         scheduler = Scheduler.build(MockSchedulable(), self.type, "", "/1400")
-        scheduler._mock_now_time = datetime(2018, 2, 1, 18)
-        self.assertEqual(scheduler.check(), "stop")
+        run = RunContext.create(datetime(2018, 2, 1, 18))
+        self.assertEqual(scheduler.check(scheduler.context(run)), "stop")
 
     def test_nostoptime_before_starttime(self):
         scheduler = Scheduler.build(MockSchedulable(), self.type, "", "1400/")
-        scheduler._mock_now_time = datetime(2018, 2, 1, 10)
-        self.assertEqual(scheduler.check(), "start")
+        run = RunContext.create(datetime(2018, 2, 1, 10))
+        self.assertEqual(scheduler.check(scheduler.context(run)), "start")
 
     def test_nostoptime_after_starttime(self):
         scheduler = Scheduler.build(MockSchedulable(), self.type, "", "1400/")
-        scheduler._mock_now_time = datetime(2018, 2, 1, 18)
-        self.assertIsNone(scheduler.check())
+        run = RunContext.create(datetime(2018, 2, 1, 18))
+        self.assertIsNone(scheduler.check(scheduler.context(run)))
 
     def test_before_starttime(self):
         scheduler = Scheduler.build(MockSchedulable(), self.type, "", "1300/1500")
-        scheduler._mock_now_time = datetime(2018, 2, 1, 10)
-        self.assertIsNone(scheduler.check())
+        run = RunContext.create(datetime(2018, 2, 1, 10))
+        self.assertIsNone(scheduler.check(scheduler.context(run)))
 
     def test_between_startstoptime(self):
         scheduler = Scheduler.build(MockSchedulable(), self.type, "", "1300/1500")
-        scheduler._mock_now_time = datetime(2018, 2, 1, 14)
-        self.assertEqual(scheduler.check(), "start")
+        run = RunContext.create(datetime(2018, 2, 1, 14))
+        self.assertEqual(scheduler.check(scheduler.context(run)), "start")
 
     def test_after_stoptime(self):
         scheduler = Scheduler.build(MockSchedulable(), self.type, "", "1300/1500")
-        scheduler._mock_now_time = datetime(2018, 2, 1, 18)
-        self.assertEqual(scheduler.check(), "stop")
+        run = RunContext.create(datetime(2018, 2, 1, 18))
+        self.assertEqual(scheduler.check(scheduler.context(run)), "stop")
 
     def test_before_starttime_reversed(self):
         scheduler = Scheduler.build(MockSchedulable(), self.type, "", "1500/1300")
-        scheduler._mock_now_time = datetime(2018, 2, 1, 10)
-        self.assertIsNone(scheduler.check())
+        run = RunContext.create(datetime(2018, 2, 1, 10))
+        self.assertIsNone(scheduler.check(scheduler.context(run)))
 
     def test_between_startstoptime_reversed(self):
         scheduler = Scheduler.build(MockSchedulable(), self.type, "", "1500/1300")
-        scheduler._mock_now_time = datetime(2018, 2, 1, 14)
-        self.assertEqual(scheduler.check(), "start")
+        run = RunContext.create(datetime(2018, 2, 1, 14))
+        self.assertEqual(scheduler.check(scheduler.context(run)), "start")
 
     def test_after_stoptime_reversed(self):
         scheduler = Scheduler.build(MockSchedulable(), self.type, "", "1500/1300")
-        scheduler._mock_now_time = datetime(2018, 2, 1, 18)
-        self.assertEqual(scheduler.check(), "stop")
+        run = RunContext.create(datetime(2018, 2, 1, 18))
+        self.assertEqual(scheduler.check(scheduler.context(run)), "stop")
 
     def test_different_timezone(self):
         scheduler = Scheduler.build(MockSchedulable(), self.type, "", "1300/1500//Canada-Yukon")
-        scheduler._mock_now_time = datetime(2018, 2, 1, 5)
-        self.assertEqual(scheduler.check(), "start")
+        run = RunContext.create(datetime(2018, 2, 1, 22))
+        self.assertEqual(scheduler.check(scheduler.context(run)), "start")
+
+    def test_different_timezone_dst(self):
+        # 1300 in Rome is 1200 UTC in winter and 1100 UTC in summer
+        scheduler = Scheduler.build(MockSchedulable(), self.type, "", "1300/1500//Europe-Rome")
+        run = RunContext.create(datetime(2018, 2, 1, 11, 30))
+        self.assertIsNone(scheduler.check(scheduler.context(run)))
+        run = RunContext.create(datetime(2018, 7, 1, 11, 30))
+        self.assertEqual(scheduler.check(scheduler.context(run)), "start")
+
+    def test_evening_before_dst_far_from_utc(self):
+        # Summer time starts in New York on Sunday 2018-03-11, while it's still
+        # Saturday evening in New York it's already Sunday in UTC
+        scheduler = Scheduler.build(MockSchedulable(), self.type, "", "/2200/all/America-New_York")
+        run = RunContext.create(datetime(2018, 3, 11, 2, 30))       # 2130 EST
+        self.assertIsNone(scheduler.check(scheduler.context(run)))
+        run = RunContext.create(datetime(2018, 3, 11, 3, 0))        # 2200 EST
+        self.assertEqual(scheduler.check(scheduler.context(run)), "stop")
+
+    def test_next_transition_evening_before_dst(self):
+        scheduler = Scheduler.build(MockSchedulable(), self.type, "", "/2200/all/America-New_York")
+        run = RunContext.create(datetime(2018, 3, 11, 2, 30))       # 2130 EST
+        self.assertEqual(
+            scheduler.next_transition(scheduler.context(run)),
+            datetime(2018, 3, 11, 3, tzinfo=tz.utc)
+        )
+
+    def test_next_transition_matches_check(self):
+        # Walking minute by minute across the changes of a far zone, the
+        # decision changes exactly at the transitions
+        scheduler = Scheduler.build(MockSchedulable(), self.type, "", "0730/2200/weekdays/America-New_York")
+        for start in [datetime(2018, 3, 9, 12), datetime(2018, 11, 2, 12)]:
+            now = start
+            while now < start + timedelta(days=4):
+                run = RunContext.create(now)
+                current = scheduler.check(scheduler.context(run))
+                transition = scheduler.next_transition(scheduler.context(run))
+                for minute in range(0, 24 * 60, 30):
+                    later = now + timedelta(minutes=minute)
+                    if transition is not None and later >= transition.replace(tzinfo=None):
+                        break
+                    self.assertEqual(scheduler.check(scheduler.context(RunContext.create(later))), current)
+                if transition is not None:
+                    self.assertNotEqual(
+                        scheduler.check(scheduler.context(RunContext.create(transition))), current
+                    )
+                now += timedelta(minutes=37)
+
+    def test_next_transition_across_dst(self):
+        # Summer time starts in Rome on Sunday 2018-03-25
+        scheduler = Scheduler.build(MockSchedulable(), self.type, "", "0800/1800//Europe-Rome")
+        run = RunContext.create(datetime(2018, 3, 25, 3))
+        self.assertEqual(
+            scheduler.next_transition(scheduler.context(run)),
+            datetime(2018, 3, 25, 6, tzinfo=tz.utc)
+        )
+
+
+    def test_check_with_context(self):
+        scheduler = Scheduler.build(MockSchedulable(), self.type, "", "1300/1500")
+        context = EvaluationContext(RunContext.create(datetime(2018, 2, 1, 14)), "stopped", None)
+        self.assertEqual(scheduler.check(context), "start")
+
+    def test_check_is_pure(self):
+        scheduler = Scheduler.build(MockSchedulable(), self.type, "", "1500/1300")
+        before = dict(scheduler.__dict__)
+        scheduler.check(scheduler.context(RunContext.create(datetime(2018, 2, 1, 14))))
+        self.assertDictEqual(scheduler.__dict__, before)
+
+    def test_check_decided_once_per_run(self):
+        run = RunContext.create(datetime(2018, 2, 1, 14))
+        first = Scheduler.build(MockSchedulable(), self.type, "", "1300/1500/thu/Europe-Rome")
+        second = Scheduler.build(MockSchedulable(), self.type, "", "1300/1500/thu/Europe-Rome")
+        self.assertEqual(first.check(first.context(run)), "stop")
+        with patch.object(DailyScheduler, 'decision', side_effect=AssertionError):
+            self.assertEqual(second.check(second.context(run)), "stop")
+        self.assertEqual(len(run.decisions), 1)
+
+    def test_check_decisions_not_shared_between_runs(self):
+        scheduler = Scheduler.build(MockSchedulable(), self.type, "", "1300/1500")
+        self.assertEqual(scheduler.check(scheduler.context(RunContext.create(datetime(2018, 2, 1, 14)))), "start")
+        self.assertEqual(scheduler.check(scheduler.context(RunContext.create(datetime(2018, 2, 1, 16)))), "stop")
+
+    def test_check_shared_run_matches_own_runs(self):
+        values = ["0730/2200/weekdays/America-New_York", "2200/0600//Asia-Tokyo", "0800/1800//Europe-Rome", "/1900/sat"]
+        now = datetime(2018, 3, 9, 12)
+        while now < datetime(2018, 3, 13):
+            run = RunContext.create(now)
+            for value in values * 2:
+                scheduler = Scheduler.build(MockSchedulable(), self.type, "", value)
+                self.assertEqual(
+                    scheduler.check(scheduler.context(run)),
+                    scheduler.check(scheduler.context(RunContext.create(now)))
+                )
+            now += timedelta(minutes=47)
+
+    """ Next transition """
+
+    def next_transition(self, value, now):
+        scheduler = Scheduler.build(MockSchedulable(), self.type, "", value)
+        return scheduler.next_transition(scheduler.context(RunContext.create(now)))
+
+    def test_next_transition_start(self):
+        result = self.next_transition("1300/1500", datetime(2018, 2, 1, 10))
+        self.assertEqual(result, datetime(2018, 2, 1, 13, tzinfo=tz.utc))
+
+    def test_next_transition_stop(self):
+        result = self.next_transition("1300/1500", datetime(2018, 2, 1, 14))
+        self.assertEqual(result, datetime(2018, 2, 1, 15, tzinfo=tz.utc))
+
+    def test_next_transition_midnight(self):
+        # Stopping at 15:00 becomes nothing at midnight
+        result = self.next_transition("1300/1500", datetime(2018, 2, 1, 18))
+        self.assertEqual(result, datetime(2018, 2, 2, tzinfo=tz.utc))
+
+    def test_next_transition_at_start_time(self):
+        result = self.next_transition("1300/1500", datetime(2018, 2, 1, 13))
+        self.assertEqual(result, datetime(2018, 2, 1, 15, tzinfo=tz.utc))
+
+    def test_next_transition_next_active_day(self):
+        # Thursday, the next Monday is the 5th
+        result = self.next_transition("1300/1500/mon", datetime(2018, 2, 1, 14))
+        self.assertEqual(result, datetime(2018, 2, 5, 13, tzinfo=tz.utc))
+
+    def test_next_transition_timezone(self):
+        # 13:00 in Etc-GMT+5 is 18:00 UTC
+        result = self.next_transition("1300/1500//Etc-GMT+5", datetime(2018, 2, 1, 10))
+        self.assertEqual(result, datetime(2018, 2, 1, 18, tzinfo=tz.utc))
+
+    def test_next_transition_never(self):
+        self.assertIsNone(self.next_transition("//", datetime(2018, 2, 1, 10)))
+
+    def test_next_transition_error(self):
+        self.assertIsNone(self.next_transition("asdfghj", datetime(2018, 2, 1, 10)))
+
+    def test_next_transition_changes_check(self):
+        scheduler = Scheduler.build(MockSchedulable(), self.type, "", "0830/1745/mon.wed.sat/Europe-Rome")
+        now = datetime(2018, 2, 1, 7, 15, tzinfo=tz.utc)
+        for _ in range(20):
+            run = RunContext.create(now)
+            transition = scheduler.next_transition(scheduler.context(run))
+            before = scheduler.check(scheduler.context(RunContext.create(transition - timedelta(minutes=1))))
+            after = scheduler.check(scheduler.context(RunContext.create(transition)))
+            self.assertEqual(before, scheduler.check(scheduler.context(run)))
+            self.assertNotEqual(before, after)
+            now = transition
 
 
 class TimerSchedulerTest(unittest.TestCase):
@@ -374,6 +669,89 @@ class TimerSchedulerTest(unittest.TestCase):
         self.assertIsNone(result)
 
 
+    """ Shared schedulers """
+
+    def test_check_is_pure(self):
+        scheduler = Scheduler.build(self.mock, self.type, "", "start/10")
+        before = dict(scheduler.__dict__)
+        scheduler.check(EvaluationContext(RunContext.create(self.now_minus5), "running", self.now_minus15))
+        self.assertDictEqual(scheduler.__dict__, before)
+
+    def test_check_reused(self):
+        scheduler = Scheduler.build(self.mock, self.type, "", "start/10")
+        run = RunContext.create()
+        scheduler.check(EvaluationContext(run, "running", self.now_minus15))
+        result = scheduler.check(EvaluationContext(run, "stopped", self.now_minus15))
+        self.assertEqual(result, "start")
+
+    """ Next transition """
+
+    def test_next_transition_pending(self):
+        scheduler = Scheduler.build(self.mock, self.type, "", "stop/10")
+        context = EvaluationContext(RunContext.create(), "running", self.now_minus5)
+        self.assertEqual(scheduler.next_transition(context), self.now_minus5 + timedelta(minutes=10))
+
+    def test_next_transition_elapsed(self):
+        scheduler = Scheduler.build(self.mock, self.type, "", "stop/10")
+        context = EvaluationContext(RunContext.create(), "running", self.now_minus15)
+        self.assertIsNone(scheduler.next_transition(context))
+
+    def test_next_transition_other_status(self):
+        scheduler = Scheduler.build(self.mock, self.type, "", "start/10")
+        context = EvaluationContext(RunContext.create(), "running", self.now_minus5)
+        self.assertIsNone(scheduler.next_transition(context))
+
+    def test_next_transition_no_time(self):
+        scheduler = Scheduler.build(self.mock, self.type, "", "start/10")
+        context = EvaluationContext(RunContext.create(), "stopped", None)
+        self.assertIsNone(scheduler.next_transition(context))
+
+
+class ConcurrentCheckTest(unittest.TestCase):
+    """
+    Shared schedulers evaluated by many threads at the same time
+    """
+    THREADS = 16
+    ITERATIONS = 500
+
+    def hammer(self, scheduler, cases):
+        errors = []
+
+        def worker(offset):
+            for i in range(self.ITERATIONS):
+                context, expected = cases[(i + offset) % len(cases)]
+                result = scheduler.check(context)
+                if result != expected:
+                    errors.append((context, expected, result))
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.THREADS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return errors
+
+    def test_shared_timer(self):
+        run = RunContext.create(datetime(2018, 2, 1, 14))
+        scheduler = Scheduler.build(MockSchedulable(), TimerScheduler.type(), "", "start/10")
+        cases = [
+            (EvaluationContext(run, "running", run.now - timedelta(minutes=15)), None),
+            (EvaluationContext(run, "stopped", run.now - timedelta(minutes=15)), "start"),
+            (EvaluationContext(run, "stopped", run.now - timedelta(minutes=5)), None),
+        ]
+        self.assertListEqual(self.hammer(scheduler, cases), [])
+
+    def test_shared_daily(self):
+        scheduler = Scheduler.build(MockSchedulable(), DailyScheduler.type(), "", "1500/1300/weekdays")
+        cases = [
+            (EvaluationContext(RunContext.create(datetime(2018, 2, 1, 10)), "stopped", None), None),
+            (EvaluationContext(RunContext.create(datetime(2018, 2, 1, 14)), "stopped", None), "start"),
+            (EvaluationContext(RunContext.create(datetime(2018, 2, 1, 18)), "running", None), "stop"),
+            (EvaluationContext(RunContext.create(datetime(2018, 2, 3, 14)), "stopped", None), None),
+        ]
+        self.assertListEqual(self.hammer(scheduler, cases), [])
+
+
 class IgnoreSchedulerTest(unittest.TestCase):
     """
     Tests for IgnoreScheduler
@@ -451,5 +829,9 @@ class FixedSchedulerTest(unittest.TestCase):
         result = Scheduler.build(self.mock, self.type, "", "stop").check()
         self.assertEqual(result, "stop")
 
+    def test_next_transition(self):
+        result = Scheduler.build(self.mock, self.type, "", "stop").next_transition()
+        self.assertIsNone(result)
+
 
 # vim: ft=python:ts=4:sw=4
\ No newline at end of file
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import Mock
+
+import pytz as tz
+from mocked_objects import *
+from datetime import datetime
+from tagscheduler.schedulers import *
+from tagscheduler.statestore import *
+
+
+class MockDynamoDBClient(object):
+    """
+    In memory stand-in of a DynamoDB client supporting the calls used by
+    DynamoDBStateStore. The first "unprocessed" items written are returned
+    as UnprocessedItems
+    """
+    def __init__(self, unprocessed=0):
+        self.items = {}
+        self.unprocessed = unprocessed
+        self.batch_calls = 0
+
+    def get_paginator(self, operation_name):
+        client = self
+
+        class Paginator(object):
+            def paginate(self, **kwargs):
+                region = kwargs['ExpressionAttributeValues'][':r']['S']
+                return [{'Items': [i for (r, _), i in client.items.items() if r == region]}]
+
+        return Paginator()
+
+    def batch_write_item(self, RequestItems):
+        self.batch_calls += 1
+        table, requests = list(RequestItems.items())[0]
+        if len(requests) > 25:
+            raise ValueError("Too many items")
+
+        unprocessed = requests[:self.unprocessed]
+        self.unprocessed -= len(unprocessed)
+        for request in requests[len(unprocessed):]:
+            if 'PutRequest' in request:
+                item = request['PutRequest']['Item']
+                self.items[(item['region']['S'], item['instance']['S'])] = item
+            else:
+                key = request['DeleteRequest']['Key']
+                self.items.pop((key['region']['S'], key['instance']['S']), None)
+
+        return {'UnprocessedItems': {table: unprocessed} if unprocessed else {}}
+
+
+class FingerprintTest(unittest.TestCase):
+    """ instance_fingerprint() """
+
+    def fingerprint(self, tags, status="running", status_time=None):
+        instance = MockSchedulable(status=status, start_time=status_time, tags=tags)
+        return instance_fingerprint(instance, EvaluationContext.of(instance, RunContext.create()))
+
+    def test_same_inputs(self):
+        tags = [{'Key': "scheduler-daily", 'Value': "0800/1800"}]
+        self.assertEqual(self.fingerprint(tags), self.fingerprint(list(reversed(tags))))
+
+    def test_tags_changed(self):
+        self.assertNotEqual(
+            self.fingerprint([{'Key': "scheduler-daily", 'Value': "0800/1800"}]),
+            self.fingerprint([{'Key': "scheduler-daily", 'Value': "0900/1800"}])
+        )
+
+    def test_status_changed(self):
+        self.assertNotEqual(self.fingerprint([], "running"), self.fingerprint([], "stopped"))
+
+    def test_status_time_changed(self):
+        self.assertNotEqual(
+            self.fingerprint([], "running", datetime(2018, 2, 1, tzinfo=tz.utc)),
+            self.fingerprint([], "running", datetime(2018, 2, 2, tzinfo=tz.utc))
+        )
+
+
+class CreateStateStoreTest(unittest.TestCase):
+    """ create_state_store() """
+
+    def test_none(self):
+        self.assertIsNone(create_state_store(""))
+        self.assertIsNone(create_state_store(None))
+
+    def test_file(self):
+        result = create_state_store("file:/tmp/state.json")
+        self.assertIsInstance(result, FileStateStore)
+        self.assertEqual(result.path, "/tmp/state.json")
+
+    def test_dynamodb(self):
+        result = create_state_store("dynamodb:TagSchedulerState", "http://localhost:8000")
+        self.assertIsInstance(result, DynamoDBStateStore)
+        self.assertEqual(result.table, "TagSchedulerState")
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            create_state_store("redis:localhost")
+        with self.assertRaises(ValueError):
+            create_state_store("file:")
+
+
+class FileStateStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "state.json")
+        self.record = StateRecord("abc", "running", None, 1517500800)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_load_missing_file(self):
+        self.assertDictEqual(FileStateStore(self.path).load("r1"), {})
+
+    def test_load_invalid_file(self):
+        with open(self.path, 'w') as f:
+            f.write("{invalid")
+        self.assertDictEqual(FileStateStore(self.path).load("r1"), {})
+
+    def test_save_and_load(self):
+        FileStateStore(self.path).save("r1", {'EC2:i-1': self.record})
+        result = FileStateStore(self.path).load("r1")
+        self.assertDictEqual(result, {'EC2:i-1': self.record})
+        self.assertDictEqual(FileStateStore(self.path).load("r2"), {})
+
+    def test_save_removed(self):
+        store = FileStateStore(self.path)
+        store.save("r1", {'EC2:i-1': self.record, 'EC2:i-2': self.record})
+        store.save("r1", {}, ['EC2:i-1'])
+        self.assertListEqual(list(FileStateStore(self.path).load("r1").keys()), ['EC2:i-2'])
+
+
+class DynamoDBStateStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = MockDynamoDBClient()
+        self.store = DynamoDBStateStore("table", client=self.client)
+
+    def test_save_and_load(self):
+        records = {
+            'EC2:i-1': StateRecord("abc", "running", None, 1517500800),
+            'RDS:db-1': StateRecord("def", None, "stop", None),
+        }
+        self.store.save("r1", records)
+        self.assertDictEqual(self.store.load("r1"), records)
+        self.assertDictEqual(self.store.load("r2"), {})
+
+    def test_save_batches(self):
+        records = dict(("EC2:i-%d" % i, StateRecord("abc", "running", None, None)) for i in range(60))
+        self.store.save("r1", records)
+        self.assertEqual(self.client.batch_calls, 3)
+        self.assertEqual(len(self.store.load("r1")), 60)
+
+    def test_save_unprocessed_retried(self):
+        self.client.unprocessed = 2
+        self.store.save("r1", {'EC2:i-1': StateRecord("abc", "running", None, None)})
+        self.assertEqual(len(self.store.load("r1")), 1)
+
+    def test_save_removed(self):
+        record = StateRecord("abc", "running", None, None)
+        self.store.save("r1", {'EC2:i-1': record, 'EC2:i-2': record})
+        self.store.save("r1", {}, ['EC2:i-2'])
+        self.assertListEqual(list(self.store.load("r1").keys()), ['EC2:i-1'])
+
+
+class RegionStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = datetime(2018, 2, 1, 12, tzinfo=tz.utc)
+        self.store = Mock()
+        self.store.load.return_value = {
+            'EC2:i-1': StateRecord("abc", "stopped", None, epoch_seconds(datetime(2018, 2, 1, 13, tzinfo=tz.utc))),
+            'EC2:i-2': StateRecord("abc", "running", "stop", None),
+            'EC2:i-3': StateRecord("abc", "stopped", None, None),
+        }
+        self.state = RegionState(self.store, "r1")
+
+    """ skippable() """
+
+    def test_skippable_unchanged(self):
+        self.assertIsNotNone(self.state.skippable('EC2', "i-1", "abc", self.now))
+        self.assertIsNotNone(self.state.skippable('EC2', "i-3", "abc", self.now))
+        self.assertEqual(self.state.skipped, 2)
+
+    def test_skippable_changed_inputs(self):
+        self.assertIsNone(self.state.skippable('EC2', "i-1", "xyz", self.now))
+
+    def test_skippable_transition_arrived(self):
+        now = datetime(2018, 2, 1, 13, tzinfo=tz.utc)
+        self.assertIsNone(self.state.skippable('EC2', "i-1", "abc", now))
+
+    def test_skippable_pending_action(self):
+        self.assertIsNone(self.state.skippable('EC2', "i-2", "abc", self.now))
+
+    def test_skippable_unknown(self):
+        self.assertIsNone(self.state.skippable('RDS', "i-1", "abc", self.now))
+
+    """ update() and save() """
+
+    def test_save_changed_only(self):
+        self.state.update('EC2', "i-3", StateRecord("abc", "stopped", None, None))
+        self.state.update('EC2', "i-4", StateRecord("abc", "running", None, None))
+        self.state.skippable('EC2', "i-1", "abc", self.now)
+        self.state.skippable('EC2', "i-2", "abc", self.now)
+        self.state.save()
+        self.store.save.assert_called_once_with(
+            "r1", {'EC2:i-4': StateRecord("abc", "running", None, None)}, []
+        )
+
+    def test_save_removes_not_found(self):
+        self.state.skippable('EC2', "i-1", "abc", self.now)
+        self.state.save()
+        self.assertItemsEqual(self.store.save.call_args[0][2], ['EC2:i-2', 'EC2:i-3'])
+
+    def test_save_keeps_found(self):
+        self.state.found('EC2', "i-1")
+        self.state.found('EC2', "i-2")
+        self.state.save()
+        self.store.save.assert_called_once_with("r1", {}, ['EC2:i-3'])
+
+    def test_save_partial_keeps_not_found(self):
+        self.state.skippable('EC2', "i-1", "abc", self.now)
+        self.state.save(full=False)
+        self.store.save.assert_not_called()
+
+
+# vim: ft=python:ts=4:sw=4
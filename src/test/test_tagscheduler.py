@@ -25,8 +25,12 @@
 
 from __future__ import print_function
 
+import json
+import shutil
+import tempfile
 import unittest
-from mock import patch
+from mock import patch, Mock
+from StringIO import StringIO
 
 from mocked_objects import *
 from tagscheduler.tagscheduler import *
@@ -50,6 +54,28 @@ class ProcessInstanceTest(unittest.TestCase):
         result = process_instance(MockSchedulable())
         self.assertIsNone(result)
 
+    def test_run_context(self):
+        scheduler = MockScheduler(check_result="start")
+        self.bis_mock.return_value = [scheduler]
+        run = RunContext.create(datetime(2018, 2, 1, 14))
+        with patch.object(MockScheduler, 'check', return_value="start") as check:
+            process_instance(MockSchedulable(status="stopped"), run)
+        self.assertIs(check.call_args[0][0].run, run)
+
+    def test_details_only_on_debug(self):
+        self.bis_mock.return_value = [MockScheduler(check_result="start")]
+        with patch.object(MockScheduler, '__str__', return_value="") as description:
+            set_level("INFO")
+            process_instance(MockSchedulable(status="stopped"))
+            description.assert_not_called()
+
+            set_level("DEBUG")
+            try:
+                process_instance(MockSchedulable(status="stopped"))
+            finally:
+                set_level(DEFAULT_LOG_LEVEL)
+            description.assert_called_once_with()
+
     def test_scheduler_bad(self):
         self.bis_mock.return_value = []
         result = process_instance(MockSchedulable())
@@ -193,6 +219,38 @@ class BuildInstanceSchedulersTest(unittest.TestCase):
         result = build_instance_schedulers(mock_ec2)
         self.assertEqual(len(result), 3)
 
+    def test_non_scheduler_tags(self):
+        schedulers = [
+            {'Key': 'scheduler', 'Value': 'ignore'},
+            {'Key': 'schedulers-ignore_all', 'Value': 'ignore'},
+            {'Key': 'Scheduler-ignore_all', 'Value': 'ignore'},
+            {'Key': 'cost-center', 'Value': 'scheduler-ignore_all'},
+            {'Key': 'my-scheduler-ignore_all', 'Value': 'ignore'},
+            {'Key': 'scheduler-', 'Value': 'ignore'}
+        ]
+        mock_ec2 = MockSchedulable(tags=schedulers)
+        result = build_instance_schedulers(mock_ec2)
+        self.assertListEqual(result, [])
+
+    def test_extra_key_fields(self):
+        schedulers = [{'Key': 'scheduler-fixed-name-extra-fields', 'Value': 'start'}]
+        mock_ec2 = MockSchedulable(tags=schedulers)
+        result = build_instance_schedulers(mock_ec2)
+        self.assertEqual([(s.type(), s.name) for s in result], [('fixed', 'name')])
+
+    def test_sorting_stable(self):
+        schedulers = [
+            {'Key': 'scheduler-fixed-b', 'Value': 'stop'},
+            {'Key': 'scheduler-fixed-a', 'Value': 'start'},
+            {'Key': 'scheduler-fixed-b', 'Value': 'start'},
+            {'Key': 'scheduler-fixed-a', 'Value': 'stop'}
+        ]
+        mock_ec2 = MockSchedulable(tags=schedulers)
+        result = build_instance_schedulers(mock_ec2)
+        self.assertListEqual([(s.name, s.value) for s in result], [
+            ('a', 'start'), ('a', 'stop'), ('b', 'stop'), ('b', 'start')
+        ])
+
     def test_sorting(self):
         schedulers = [
             {'Key': 'scheduler-ignore_all', 'Value': 'ignore'},
@@ -214,6 +272,64 @@ class BuildInstanceSchedulersTest(unittest.TestCase):
         self.assertListEqual(result, expected)
 
 
+class PlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session_patch = patch('tagscheduler.tagscheduler.get_session')
+        self.session = self.session_patch.start()
+
+        self.gai_patch = patch('tagscheduler.tagscheduler.get_all_instances')
+        self.gai_mock = self.gai_patch.start()
+        self.gai_mock.side_effect = lambda *args: {'EC2': [
+            MockSchedulable(status="stopped", tags=[{'Key': 'scheduler-fixed', 'Value': 'start'}]),
+            MockSchedulable(status="running", tags=[{'Key': 'scheduler-fixed', 'Value': 'start'}]),
+        ]}
+
+        self.ea_patch = patch('tagscheduler.tagscheduler.execute_actions')
+        self.ea_mock = self.ea_patch.start()
+        self.ea_mock.return_value = 0
+
+    def tearDown(self):
+        self.ea_patch.stop()
+        self.gai_patch.stop()
+        self.session_patch.stop()
+
+    """ plan_tagscheduler() """
+
+    def test_plan_no_actions_executed(self):
+        plan_tagscheduler(['r1', 'r2'], StringIO())
+        self.ea_mock.assert_not_called()
+
+    def test_plan_records(self):
+        stream = StringIO()
+        plan_tagscheduler(['r1', 'r2'], stream, 2)
+        records = list(read_plan(StringIO(stream.getvalue())))
+        self.assertEqual(len(records), 4)
+        self.assertListEqual(sorted(r['action'] for r in records), [None, None, "start", "start"])
+        self.assertListEqual(records[0]['schedulers'], ["fixed=start"])
+
+    """ apply_plan() """
+
+    def test_apply_plan(self):
+        plan = StringIO(
+            '{"region": "r1", "type": "EC2", "id": "i-1", "state": "stopped", "schedulers": [], "action": "start"}\n'
+            '{"region": "r1", "type": "EC2", "id": "i-2", "state": "running", "schedulers": [], "action": null}\n'
+            '{"region": "r2", "type": "EC2", "id": "i-3", "state": "running", "schedulers": [], "action": "stop"}\n'
+        )
+        apply_plan(plan)
+        self.assertEqual(self.ea_mock.call_count, 2)
+        actions = [(i.id(), a) for c in self.ea_mock.call_args_list for i, a in c[0][0]]
+        self.assertListEqual(actions, [("i-1", "start"), ("i-3", "stop")])
+
+    def test_apply_plan_region_error(self):
+        plan = StringIO(
+            '{"region": "r1", "type": "XXX", "id": "i-1", "state": "stopped", "schedulers": [], "action": "start"}\n'
+            '{"region": "r2", "type": "EC2", "id": "i-3", "state": "running", "schedulers": [], "action": "stop"}\n'
+        )
+        apply_plan(plan)
+        self.assertEqual(self.ea_mock.call_count, 1)
+
+
 class ExecuteActionsTest(unittest.TestCase):
 
     def setUp(self):
@@ -270,10 +386,422 @@ class ExecuteActionsTest(unittest.TestCase):
 
     """ More than one instance and actions """
 
+    def test_executed_count(self):
+        result = execute_actions(self.instances_mixed)
+        self.assertEqual(result, 4)
+
     def test_stop_single_mixed(self):
         execute_actions(self.instances_mixed)
         self.assertEquals(self.schedulable_start.call_count, 2)
         self.assertEquals(self.schedulable_stop.call_count, 2)
 
+    def test_grouped_by_action(self):
+        with patch.object(MockSchedulable, 'start_batch', return_value=2) as start_batch, \
+             patch.object(MockSchedulable, 'stop_batch', return_value=2) as stop_batch:
+            execute_actions(self.instances_mixed)
+        self.assertEqual(len(start_batch.call_args[0][0]), 2)
+        self.assertEqual(len(stop_batch.call_args[0][0]), 2)
+
+
+class RunTagSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session_patch = patch('tagscheduler.tagscheduler.get_session')
+        self.session = self.session_patch.start()
+
+        self.gai_patch = patch('tagscheduler.tagscheduler.get_all_instances')
+        self.gai_mock = self.gai_patch.start()
+        self.gai_mock.return_value = {'EC2': [], 'RDS': []}
+
+        self.ea_patch = patch('tagscheduler.tagscheduler.execute_actions')
+        self.ea_mock = self.ea_patch.start()
+        self.ea_mock.return_value = 0
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.ea_patch.stop()
+        self.gai_patch.stop()
+        self.session_patch.stop()
+        shutil.rmtree(self.directory)
+
+    """ Regions """
+
+    def test_all_regions_when_none_given(self):
+        with patch('tagscheduler.tagscheduler.get_all_regions', return_value=['r1', 'r2']):
+            run_tagscheduler([])
+        self.assertEqual(self.gai_mock.call_count, 2)
+
+    def test_regions_list_error(self):
+        with patch('tagscheduler.tagscheduler.get_all_regions', side_effect=Exception()):
+            try:
+                run_tagscheduler([])
+            except:
+                self.fail()
+        self.gai_mock.assert_not_called()
+
+    def test_serial_regions(self):
+        run_tagscheduler(['r1', 'r2', 'r3'], 1)
+        regions = [c[0][0] for c in self.gai_mock.call_args_list]
+        self.assertListEqual(regions, ['r1', 'r2', 'r3'])
+
+    def test_concurrent_regions(self):
+        run_tagscheduler(['r%d' % i for i in range(10)], 4)
+        regions = sorted(c[0][0] for c in self.gai_mock.call_args_list)
+        self.assertListEqual(regions, sorted('r%d' % i for i in range(10)))
+
+    def test_filter_on_prefix(self):
+        run_tagscheduler(['r1'])
+        self.assertEqual(self.gai_mock.call_args[0][2], SCHEDULER_PREFIX)
+
+    def test_session_per_region(self):
+        run_tagscheduler(['r1', 'r2'], 2)
+        regions = sorted(c[0][0] for c in self.session.call_args_list)
+        self.assertListEqual(regions, ['r1', 'r2'])
+
+    def test_single_run_context(self):
+        self.gai_mock.side_effect = lambda *args: {'EC2': [MockSchedulable(), MockSchedulable()]}
+        with patch('tagscheduler.tagscheduler.process_instance', return_value=None) as pi_mock:
+            run_tagscheduler(['r1', 'r2'], 2)
+        runs = set(id(c[0][1]) for c in pi_mock.call_args_list)
+        self.assertEqual(pi_mock.call_count, 4)
+        self.assertEqual(len(runs), 1)
+
+    """ Failures isolation """
+
+    def test_region_error_isolated(self):
+        def failing_region(region, *args):
+            if region == "bad":
+                raise Exception("Region failure")
+            return {'EC2': [MockSchedulable()], 'RDS': []}
+        self.gai_mock.side_effect = failing_region
+
+        with patch('tagscheduler.tagscheduler.process_instance', return_value="stop"):
+            run_tagscheduler(['r1', 'bad', 'r2'], 2)
+        self.assertEqual(self.gai_mock.call_count, 3)
+        self.assertEqual(self.ea_mock.call_count, 2)
+        self.assertEqual(metrics.counter("errors.region"), 1)
+
+    """ Metrics """
+
+    def test_metrics_counters(self):
+        self.gai_mock.side_effect = lambda *args: {'EC2': [MockSchedulable(), MockSchedulable()]}
+        with patch('tagscheduler.tagscheduler.process_instance', return_value="start"):
+            run_tagscheduler(['r1', 'r2'], 2)
+        self.assertEqual(metrics.counter("instances"), 4)
+        self.assertEqual(metrics.counter("actions"), 4)
+        self.assertItemsEqual(
+            metrics.report()['timers'].keys(), ['run', 'evaluation', 'execution']
+        )
+
+    """ Targeted runs """
+
+    def test_targets_only(self):
+        targets = {'r1': {'EC2': ["i-1"]}, 'r2': {'RDS': ["db-1"]}}
+        run_tagscheduler([], 1, targets)
+        calls = sorted((c[0][0], c[0][3]) for c in self.gai_mock.call_args_list)
+        self.assertListEqual(calls, [('r1', {'EC2': ["i-1"]}), ('r2', {'RDS': ["db-1"]})])
+
+    def test_targets_outside_regions(self):
+        run_tagscheduler(['r1'], 1, {'r1': {'EC2': ["i-1"]}, 'r2': {'EC2': ["i-2"]}})
+        self.assertListEqual([c[0][0] for c in self.gai_mock.call_args_list], ['r1'])
+
+    def test_targets_empty(self):
+        with patch('tagscheduler.tagscheduler.get_all_regions') as gar_mock:
+            run_tagscheduler([], 1, {})
+        gar_mock.assert_not_called()
+        self.gai_mock.assert_not_called()
+
+    def test_lambda_handler_event(self):
+        event = {
+            'source': "aws.ec2",
+            'detail-type': EC2_STATE_CHANGE,
+            'region': "r1",
+            'detail': {'instance-id': "i-1", 'state': "running"},
+        }
+        with patch.dict('os.environ', {}, clear=True):
+            lambda_handler(event, None)
+        self.assertEqual(self.gai_mock.call_args[0][3], {'EC2': ["i-1"]})
+
+    def test_lambda_handler_scheduled(self):
+        with patch.dict('os.environ', {'RUN_ON_REGIONS': "r1,r2"}):
+            lambda_handler({'source': "aws.events", 'detail-type': "Scheduled Event"}, None)
+        self.assertEqual(self.gai_mock.call_count, 2)
+        self.assertIsNone(self.gai_mock.call_args[0][3])
+
+    """ State store """
+
+    def test_state_skips_unchanged(self):
+        tags = [{'Key': "scheduler-fixed", 'Value': "stop"}]
+        instance = MockSchedulable(status="stopped", tags=tags)
+        self.gai_mock.side_effect = lambda *args: {'EC2': [instance]}
+        store = FileStateStore(os.path.join(self.directory, "state.json"))
+
+        run_tagscheduler(['r1'], 1, None, store)
+        self.assertEqual(metrics.counter("skipped"), 0)
+        run_tagscheduler(['r1'], 1, None, store)
+        self.assertEqual(metrics.counter("skipped"), 1)
+
+    def test_state_evaluates_pending_action(self):
+        tags = [{'Key': "scheduler-fixed", 'Value': "start"}]
+        instance = MockSchedulable(status="stopped", tags=tags)
+        self.gai_mock.side_effect = lambda *args: {'EC2': [instance]}
+        store = FileStateStore(os.path.join(self.directory, "state.json"))
+
+        run_tagscheduler(['r1'], 1, None, store)
+        run_tagscheduler(['r1'], 1, None, store)
+        self.assertEqual(metrics.counter("skipped"), 0)
+        self.assertEqual(metrics.counter("actions"), 1)
+
+    def test_state_error_evaluates_all(self):
+        store = Mock()
+        store.load.side_effect = Exception("Unavailable")
+        self.gai_mock.side_effect = lambda *args: {'EC2': [MockSchedulable()]}
+        run_tagscheduler(['r1'], 1, None, store)
+        self.assertEqual(metrics.counter("instances"), 1)
+        self.assertEqual(metrics.counter("errors.region"), 0)
+
+    def test_state_store_from_env(self):
+        with patch.dict('os.environ', {'STATE_STORE': "file:/tmp/state.json"}):
+            self.assertIsInstance(get_state_store(), FileStateStore)
+        with patch.dict('os.environ', {'STATE_STORE': "invalid"}):
+            self.assertIsNone(get_state_store())
+        with patch.dict('os.environ', {}, clear=True):
+            self.assertIsNone(get_state_store())
+
+    """ Transitions """
+
+    def test_transitions_indexed(self):
+        tags = [{'Key': "scheduler-daily", 'Value': "0800/1800"}]
+        self.gai_mock.side_effect = lambda *args: {'EC2': [MockSchedulable(status="running", tags=tags)]}
+        index = TransitionIndex()
+        process_region('r1', RunContext.create(datetime(2018, 2, 1, 10)), index)
+        self.assertEqual(index.earliest(), (datetime(2018, 2, 1, 18, tzinfo=tz.utc), "mock_schedulable"))
+
+    def test_transitions_reported(self):
+        index = TransitionIndex()
+        index.push(datetime(2018, 2, 1, 18, tzinfo=tz.utc), "i-1")
+        with patch('tagscheduler.tagscheduler.log') as log_mock:
+            report_transitions(index, RunContext.create(datetime(2018, 2, 1, 10)))
+        fields = log_mock.info.call_args[1]['extra']['fields']
+        self.assertEqual(fields['transition'], "2018-02-01T18:00:00+00:00")
+        self.assertNotIn('time', fields)
+
+    def test_metrics_reset_each_run(self):
+        self.gai_mock.side_effect = lambda *args: {'EC2': [MockSchedulable()]}
+        run_tagscheduler(['r1'])
+        run_tagscheduler(['r1'])
+        self.assertEqual(metrics.counter("instances"), 1)
+
+    def test_metrics_emf(self):
+        with patch.dict('os.environ', {'METRICS_NAMESPACE': "Test"}):
+            with patch('sys.stdout', new_callable=StringIO) as stdout:
+                run_tagscheduler(['r1'])
+        lines = [l for l in stdout.getvalue().splitlines() if '"_aws"' in l]
+        self.assertEqual(len(lines), 1)
+
+    def test_metrics_no_emf(self):
+        with patch.dict('os.environ', {}, clear=True):
+            with patch('sys.stdout', new_callable=StringIO) as stdout:
+                run_tagscheduler(['r1'])
+        self.assertNotIn('"_aws"', stdout.getvalue())
+
+    """ Deadline and priorities """
+
+    def mock_instances(self, *names):
+        instances = []
+        for name in names:
+            instance = MockSchedulable()
+            instance.id = lambda name=name: name
+            instances.append(instance)
+        return {'EC2': instances}
+
+    def mock_actions(self):
+        return patch(
+            'tagscheduler.tagscheduler.process_instance',
+            side_effect=lambda instance, *args: instance.id().split("-")[0]
+        )
+
+    def test_stops_first(self):
+        fleet = {
+            'r1': self.mock_instances("start-1", "stop-1"),
+            'r2': self.mock_instances("start-2", "stop-2", "stop-3"),
+        }
+        self.gai_mock.side_effect = lambda region, *args: fleet[region]
+        with self.mock_actions():
+            run_tagscheduler(['r1', 'r2'])
+        calls = [(c[0][1], c[0][0][0][1]) for c in self.ea_mock.call_args_list]
+        self.assertListEqual(calls, [('r2', "stop"), ('r1', "stop"), ('r1', "start"), ('r2', "start")])
+
+    def test_deadline_expired_before_evaluation(self):
+        handoff = Mock()
+        run_tagscheduler(['r1', 'r2'], 1, None, None, Deadline(0), handoff)
+        self.gai_mock.assert_not_called()
+        handoff.assert_called_once_with({}, ['r1', 'r2'])
+        self.assertEqual(metrics.counter("deferred.regions"), 2)
+
+    def test_deadline_expired_before_execution(self):
+        deadline = Mock()
+        deadline.remaining.return_value = None
+        deadline.expired.side_effect = [False, False, False, False, True, True]
+        handoff = Mock()
+        self.gai_mock.side_effect = lambda region, *args: self.mock_instances("stop-" + region, "start-" + region)
+        with self.mock_actions():
+            run_tagscheduler(['r1', 'r2'], 1, None, None, deadline, handoff)
+        self.assertEqual(self.ea_mock.call_count, 2)
+        handoff.assert_called_once_with({'r1': {'EC2': ["start-r1"]}, 'r2': {'EC2': ["start-r2"]}}, [])
+        self.assertEqual(metrics.counter("deferred.actions"), 2)
+
+    def test_deadline_without_handoff(self):
+        try:
+            run_tagscheduler(['r1'], 1, None, None, Deadline(0), None)
+        except:
+            self.fail()
+
+    def test_handoff_error_contained(self):
+        try:
+            run_tagscheduler(['r1'], 1, None, None, Deadline(0), Mock(side_effect=Exception()))
+        except:
+            self.fail()
+
+    def test_lambda_handler_hands_off(self):
+        context = Mock()
+        context.invoked_function_arn = "arn:aws:lambda:eu-west-1:123456789012:function:TagScheduler"
+        context.get_remaining_time_in_millis.return_value = 0
+        with patch.dict('os.environ', {'RUN_ON_REGIONS': "r1"}):
+            with patch('tagscheduler.tagscheduler.invoke_function') as if_mock:
+                lambda_handler({'regions': ["r1"], 'handoffs': 1}, context)
+        function, event = if_mock.call_args[0]
+        self.assertEqual(function, context.invoked_function_arn)
+        self.assertDictEqual(event, {'targets': [], 'regions': ["r1"], 'handoffs': 2})
+
+    def test_targeted_handoff_keeps_targets(self):
+        handoff = Mock()
+        targets = OrderedDict([('r1', OrderedDict([('EC2', ["i-1", "i-2"])])), ('r2', None)])
+        run_tagscheduler([], 1, targets, None, Deadline(0), handoff)
+        continued, regions = handoff.call_args[0]
+        self.assertDictEqual(continued, {'r1': {'EC2': ["i-1", "i-2"]}})
+        self.assertListEqual(regions, ["r2"])
+
+    def test_large_handoff_split(self):
+        handoff = Mock()
+        count = MAX_WORKER_TARGETS * 2 + 1
+        actions = [
+            ('r1', 'EC2', self.mock_instances("i-%017x" % i)['EC2'][0], "stop") for i in range(count)
+        ]
+        hand_off(handoff, ["r2"], actions)
+        self.assertEqual(handoff.call_count, 3)
+        self.assertListEqual([c[0][1] for c in handoff.call_args_list], [["r2"], [], []])
+        ids = [i for c in handoff.call_args_list for i in c[0][0]['r1']['EC2']]
+        self.assertEqual(len(ids), count)
+        self.assertEqual(len(set(ids)), count)
+        # Each payload fits an asynchronous invocation
+        for c in handoff.call_args_list:
+            self.assertLess(len(json.dumps(continuation_event(*c[0]))), 256 * 1024)
+
+    def test_large_handoff_error_isolated(self):
+        handoff = Mock(side_effect=[Exception(), None])
+        actions = [
+            ('r1', 'EC2', self.mock_instances("i-%d" % i)['EC2'][0], "stop")
+            for i in range(MAX_WORKER_TARGETS + 1)
+        ]
+        hand_off(handoff, [], actions)
+        self.assertEqual(handoff.call_count, 2)
+
+    def test_handoffs_limited(self):
+        context = Mock()
+        context.invoked_function_arn = "arn:aws:lambda:eu-west-1:123456789012:function:TagScheduler"
+        self.assertIsNotNone(get_handoff(context, MAX_HANDOFFS - 1))
+        self.assertIsNone(get_handoff(context, MAX_HANDOFFS))
+        self.assertIsNone(get_handoff(None))
+
+    """ Fan-out """
+
+    def fanout_instances(self, region, session=None, prefix=None, ids=None):
+        names = ["stop-%s-%d" % (region, i) for i in range(20)]
+        if ids is not None:
+            names = [n for n in names if n in ids.get('EC2', [])]
+        return self.mock_instances(*names)
+
+    def test_fanout_local(self):
+        self.gai_mock.side_effect = self.fanout_instances
+        with patch.dict('os.environ', {'RUN_ON_REGIONS': "r1,r2", 'FANOUT_SHARDS': "1,r2=3"}):
+            with self.mock_actions() as pi_mock:
+                summary = lambda_handler({'source': "aws.events", 'detail-type': "Scheduled Event"}, None)
+        evaluated = [c[0][0].id() for c in pi_mock.call_args_list]
+        self.assertEqual(len(evaluated), 40)
+        self.assertEqual(len(set(evaluated)), 40)
+        self.assertEqual(summary['counters']['invocations'], 4)
+        self.assertEqual(summary['counters']['instances'], 40)
+
+    def test_fanout_lambda(self):
+        context = Mock()
+        context.invoked_function_arn = "arn:aws:lambda:eu-west-1:123456789012:function:TagScheduler"
+        self.gai_mock.side_effect = self.fanout_instances
+        with patch.dict('os.environ', {'RUN_ON_REGIONS': "r1,r2", 'FANOUT_SHARDS': "2"}):
+            with patch('tagscheduler.fanout.invoke_function') as if_mock:
+                lambda_handler({'source': "aws.events", 'detail-type': "Scheduled Event"}, context)
+        # Each region is described once, by the coordinator
+        self.assertListEqual([c[0][0] for c in self.gai_mock.call_args_list], ["r1", "r2"])
+        self.assertEqual(if_mock.call_count, 4)
+        targets = [t['id'] for c in if_mock.call_args_list for t in c[0][1]['targets']]
+        self.assertEqual(len(targets), 40)
+        self.assertEqual(len(set(targets)), 40)
+
+    def test_fanout_local_workers_describe_own_instances(self):
+        self.gai_mock.side_effect = self.fanout_instances
+        with patch.dict('os.environ', {'RUN_ON_REGIONS': "r1", 'FANOUT_SHARDS': "4"}):
+            with self.mock_actions():
+                lambda_handler({'source': "aws.events", 'detail-type': "Scheduled Event"}, None)
+        # The coordinator describes the region, each worker only its IDs
+        self.assertEqual(len(self.gai_mock.call_args_list[0][0]), 3)
+        ids = [c[0][3] for c in self.gai_mock.call_args_list[1:]]
+        self.assertEqual(sum(len(i['EC2']) for i in ids), 20)
+
+    def test_fanout_prunes_state(self):
+        self.gai_mock.side_effect = self.fanout_instances
+        store = FileStateStore(os.path.join(self.directory, "state.json"))
+        record = StateRecord("fingerprint", "stopped", None, None)
+        store.save('r1', {"EC2:stop-r1-0": record, "EC2:terminated": record})
+        run_coordinator(['r1'], (2, {}), LocalInvoker(Mock(return_value=None)), store)
+        self.assertListEqual(store.load('r1').keys(), ["EC2:stop-r1-0"])
+
+    def test_fanout_not_on_targets(self):
+        with patch.dict('os.environ', {'FANOUT_SHARDS': "2"}):
+            with patch('tagscheduler.tagscheduler.run_coordinator') as rc_mock:
+                lambda_handler({'targets': [{'region': "r1", 'type': "EC2", 'id': "i-1"}]}, None)
+        rc_mock.assert_not_called()
+        self.assertEqual(self.gai_mock.call_args[0][3], {'EC2': ["i-1"]})
+
+    def test_shard_keeps_other_states(self):
+        self.gai_mock.side_effect = lambda *args: self.mock_instances(*["i-%d" % i for i in range(10)])
+        store = FileStateStore(os.path.join(self.directory, "state.json"))
+        run_tagscheduler(['r1'], 1, None, store)
+        saved = len(store.load('r1'))
+        self.assertEqual(saved, 10)
+        run_tagscheduler(['r1'], 1, {'r1': None}, store, shard=(0, 2))
+        self.assertEqual(len(store.load('r1')), saved)
+
+    def test_invalid_fanout_shards(self):
+        with patch.dict('os.environ', {'FANOUT_SHARDS': "none"}):
+            self.assertIsNone(get_fanout_shards())
+
+    """ get_region_concurrency() """
+
+    def test_concurrency_default(self):
+        with patch.dict('os.environ', {}, clear=True):
+            self.assertEqual(get_region_concurrency(), DEFAULT_REGION_CONCURRENCY)
+
+    def test_concurrency_from_env(self):
+        with patch.dict('os.environ', {'REGION_CONCURRENCY': '8'}):
+            self.assertEqual(get_region_concurrency(), 8)
+
+    def test_concurrency_invalid(self):
+        with patch.dict('os.environ', {'REGION_CONCURRENCY': 'abc'}):
+            self.assertEqual(get_region_concurrency(), DEFAULT_REGION_CONCURRENCY)
+
+    def test_concurrency_at_least_one(self):
+        with patch.dict('os.environ', {'REGION_CONCURRENCY': '0'}):
+            self.assertEqual(get_region_concurrency(), 1)
+
 
 # vim: ft=python:ts=4:sw=4
\ No newline at end of file
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import unittest
+from mock import Mock, patch
+from botocore.exceptions import ClientError
+from botocore.hooks import HierarchicalEmitter
+
+from tagscheduler import throttling
+from tagscheduler.metrics import metrics
+from tagscheduler.throttling import *
+
+
+def throttling_error(code="Throttling"):
+    return ClientError({'Error': {'Code': code, 'Message': "Rate exceeded"}}, "StopInstances")
+
+
+class ThrottlingErrorTest(unittest.TestCase):
+
+    def test_throttling_codes(self):
+        self.assertTrue(is_throttling(throttling_error()))
+        self.assertTrue(is_throttling(throttling_error("RequestLimitExceeded")))
+
+    def test_other_errors(self):
+        self.assertFalse(is_throttling(throttling_error("UnauthorizedOperation")))
+        self.assertFalse(is_throttling(ValueError("Throttling")))
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst(self):
+        bucket = TokenBucket(5)
+        with patch.object(throttling.time, 'sleep') as sleep_mock:
+            for _ in range(5):
+                bucket.acquire()
+        self.assertFalse(sleep_mock.called)
+
+    def test_waits_when_empty(self):
+        bucket = TokenBucket(5)
+        bucket._tokens, bucket._updated = 0.0, 0.0
+        sleeps = []
+        with patch.object(throttling.time, 'sleep', side_effect=sleeps.append):
+            with patch.object(throttling, 'default_timer', side_effect=[0.0, 0.2]):
+                bucket.acquire()
+        self.assertEqual(sleeps, [0.2])
+
+    def test_throttled_halves_the_rate(self):
+        bucket = TokenBucket(8)
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 4.0)
+        for _ in range(10):
+            bucket.throttled()
+        self.assertEqual(bucket.rate, MIN_RATE)
+
+    def test_succeeded_grows_the_rate(self):
+        bucket = TokenBucket(10)
+        bucket.throttled()
+        bucket.succeeded()
+        self.assertEqual(bucket.rate, 6.0)
+        for _ in range(10):
+            bucket.succeeded()
+        self.assertEqual(bucket.rate, 10.0)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_bucket_per_region_and_service(self):
+        limiter = RateLimiter({'ec2': 20.0})
+        self.assertIs(limiter.bucket("eu-west-1", "ec2"), limiter.bucket("eu-west-1", "ec2"))
+        self.assertIsNot(limiter.bucket("eu-west-1", "ec2"), limiter.bucket("us-east-1", "ec2"))
+        self.assertEqual(limiter.bucket("eu-west-1", "ec2").max_rate, 20.0)
+        self.assertEqual(limiter.bucket("eu-west-1", "rds").max_rate, DEFAULT_RATE)
+
+    def test_reset(self):
+        limiter = RateLimiter()
+        bucket = limiter.bucket("eu-west-1", "ec2")
+        limiter.reset()
+        self.assertIsNot(limiter.bucket("eu-west-1", "ec2"), bucket)
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.sleep_patch = patch.object(throttling.time, 'sleep')
+        self.sleep_mock = self.sleep_patch.start()
+
+    def tearDown(self):
+        self.sleep_patch.stop()
+
+    def test_success(self):
+        self.assertEqual(RetryPolicy().call(lambda: 42), 42)
+        self.assertFalse(self.sleep_mock.called)
+
+    def test_retries_throttling(self):
+        function = Mock(side_effect=[throttling_error(), throttling_error(), 42])
+        self.assertEqual(RetryPolicy().call(function), 42)
+        self.assertEqual(function.call_count, 3)
+        self.assertEqual(self.sleep_mock.call_count, 2)
+        self.assertEqual(metrics.counter("retries"), 2)
+
+    def test_backoff_is_capped(self):
+        function = Mock(side_effect=[throttling_error()] * 12 + [42])
+        RetryPolicy(budget=1000).call(function)
+        for call in self.sleep_mock.call_args_list:
+            self.assertLessEqual(call[0][0], RETRY_MAX_SECONDS)
+
+    def test_other_errors_not_retried(self):
+        function = Mock(side_effect=ValueError())
+        self.assertRaises(ValueError, RetryPolicy().call, function)
+        self.assertEqual(function.call_count, 1)
+
+    def test_budget_exhausted(self):
+        function = Mock(side_effect=throttling_error())
+        self.assertRaises(ClientError, RetryPolicy(budget=0).call, function)
+        self.assertEqual(function.call_count, 1)
+        self.assertEqual(metrics.counter("retries.exhausted"), 1)
+
+
+class ThrottleSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.session = Mock()
+        self.session.events = HierarchicalEmitter()
+        self.limiter = RateLimiter()
+        throttle_session(self.session, "eu-west-1", self.limiter)
+        self.operation = Mock()
+        self.operation.service_model.service_name = "ec2"
+
+    def test_before_call_acquires(self):
+        bucket = self.limiter.bucket("eu-west-1", "ec2")
+        with patch.object(bucket, 'acquire') as acquire_mock:
+            self.session.events.emit('before-call.ec2.StopInstances', model=self.operation)
+        self.assertTrue(acquire_mock.called)
+
+    def test_throttled_response(self):
+        response = (Mock(), {'Error': {'Code': "RequestLimitExceeded"}})
+        self.session.events.emit(
+            'needs-retry.ec2.StopInstances', response=response, operation=self.operation, attempts=1
+        )
+        self.assertEqual(self.limiter.bucket("eu-west-1", "ec2").rate, DEFAULT_RATES['ec2'] / 2)
+        self.assertEqual(metrics.counter("throttles"), 1)
+
+    def test_successful_response(self):
+        self.limiter.bucket("eu-west-1", "ec2").throttled()
+        self.session.events.emit(
+            'needs-retry.ec2.StopInstances', response=(Mock(), {}), operation=self.operation, attempts=1
+        )
+        self.assertEqual(self.limiter.bucket("eu-west-1", "ec2").rate, 12.0)
+        self.assertEqual(metrics.counter("throttles"), 0)
+
+
+# vim: ft=python:ts=4:sw=4
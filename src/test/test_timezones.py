@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import random
+import unittest
+from datetime import date, datetime, timedelta
+
+import pytz as tz
+from tagscheduler.timezones import *
+
+
+# Zones with and without daylight saving time, in both hemispheres, with
+# changes at midnight and of half an hour
+ZONES = [
+    "UTC", "Etc/GMT+5", "Europe/Rome", "Europe/London", "America/New_York", "America/Sao_Paulo",
+    "Australia/Sydney", "Australia/Lord_Howe", "Canada/Yukon", "Asia/Tokyo",
+]
+
+
+def transition_days(zone, first, last):
+    """ The local dates between the years "first" and "last" with a change of UTC offset """
+    return [
+        (t + zone._transition_info[i][0]).date()
+        for i, t in enumerate(zone._utc_transition_times)
+        if first <= t.year <= last and i > 0
+    ] if hasattr(zone, '_utc_transition_times') else []
+
+
+class TimezonesTest(unittest.TestCase):
+
+    def setUp(self):
+        offset_cache.clear()
+        self.rome = tz.timezone("Europe/Rome")
+
+    """ day_offsets() """
+
+    def test_day_without_change(self):
+        self.assertEqual(day_offsets(self.rome, date(2018, 2, 1)), DayOffsets(60, None, 60))
+
+    def test_day_spring_forward(self):
+        # At 0200 local the clocks jump to 0300
+        self.assertEqual(day_offsets(self.rome, date(2018, 3, 25)), DayOffsets(60, 180, 120))
+
+    def test_day_fall_back(self):
+        # At 0300 local the clocks go back to 0200
+        self.assertEqual(day_offsets(self.rome, date(2018, 10, 28)), DayOffsets(120, 120, 60))
+
+    def test_day_offsets_cached(self):
+        day_offsets(self.rome, date(2018, 3, 25))
+        day_offsets(tz.timezone("Europe/Rome"), date(2018, 3, 25))
+        day_offsets(self.rome, date(2018, 3, 26))
+        self.assertEqual(offset_cache.hits, 1)
+        self.assertEqual(offset_cache.misses, 2)
+
+    """ local_to_utc() """
+
+    def test_local_to_utc(self):
+        self.assertEqual(local_to_utc(self.rome, date(2018, 7, 1), 13 * 60), 11 * 60)
+
+    def test_local_to_utc_wraps(self):
+        self.assertEqual(local_to_utc(self.rome, date(2018, 7, 1), 60), 23 * 60)
+
+    def test_local_to_utc_skipped_time(self):
+        # 0230 doesn't exist and takes the offset of standard time
+        self.assertEqual(local_to_utc(self.rome, date(2018, 3, 25), 150), 90)
+
+    def test_local_to_utc_repeated_time(self):
+        # 0230 happens twice and takes the offset of standard time
+        self.assertEqual(local_to_utc(self.rome, date(2018, 10, 28), 150), 90)
+
+    def test_same_as_localize(self):
+        rnd = random.Random(0)
+        for name in ZONES:
+            zone = tz.timezone(name)
+            days = transition_days(zone, 2017, 2021)
+            days += [d + timedelta(days=rnd.choice([-1, 1])) for d in days]
+            days += [date(2017, 1, 1) + timedelta(days=rnd.randint(0, 5 * 365)) for _ in range(50)]
+            for day in days:
+                # All the minutes around the changes of the day, some others at random
+                offsets = day_offsets(zone, day)
+                minutes = [rnd.randint(0, MINUTES_PER_DAY - 1) for _ in range(20)]
+                if offsets.change is not None:
+                    minutes += range(max(0, offsets.change - 90), min(MINUTES_PER_DAY, offsets.change + 90))
+                for minute in minutes:
+                    local = datetime(day.year, day.month, day.day, minute // 60, minute % 60)
+                    expected = zone.localize(local, is_dst=False).astimezone(tz.utc)
+                    self.assertEqual(
+                        local_to_utc(zone, day, minute), expected.hour * 60 + expected.minute,
+                        "%s %s" % (name, local)
+                    )
+
+    """ local_midnight() """
+
+    def test_local_midnight(self):
+        result = local_midnight(tz.timezone("America/New_York"), date(2018, 3, 11))
+        self.assertEqual(result, datetime(2018, 3, 11, 5, tzinfo=tz.utc))
+
+    """ utc_time() """
+
+    def test_utc_time(self):
+        result = utc_time(self.rome, date(2018, 2, 1), datetime(2018, 2, 1, 13, 30).time())
+        self.assertEqual(result, datetime(2018, 2, 1, 12, 30, tzinfo=tz.utc).timetz())
+
+# vim: ft=python:ts=4:sw=4
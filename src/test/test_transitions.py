@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#
+# MIT License
+#
+# Copyright (c) 2017 Fabrizio Colonna <colofabrix@tin.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+from __future__ import print_function
+
+import unittest
+
+import pytz as tz
+from mocked_objects import *
+from datetime import datetime, timedelta
+from tagscheduler.schedulers import *
+from tagscheduler.transitions import *
+
+
+class NextTransitionTest(unittest.TestCase):
+    """ next_transition() """
+
+    def setUp(self):
+        self.run = RunContext.create(datetime(2018, 2, 1, 10))
+        self.context = EvaluationContext(self.run, "stopped", None)
+
+    def build(self, sched_type, value):
+        return Scheduler.build(MockSchedulable(), sched_type, "", value)
+
+    def test_earliest(self):
+        schedulers = [self.build("daily", "1400/1800"), self.build("daily", "1200/1900")]
+        result = next_transition(schedulers, self.context)
+        self.assertEqual(result, datetime(2018, 2, 1, 12, tzinfo=tz.utc))
+
+    def test_none_changing(self):
+        schedulers = [self.build("fixed", "stop"), self.build("ignore_all", "ignore")]
+        self.assertIsNone(next_transition(schedulers, self.context))
+
+    def test_no_schedulers(self):
+        self.assertIsNone(next_transition([], self.context))
+
+
+class TransitionIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = TransitionIndex()
+        self.base = datetime(2018, 2, 1, tzinfo=tz.utc)
+
+    """ push() and earliest() """
+
+    def test_empty(self):
+        self.assertEqual(len(self.index), 0)
+        self.assertIsNone(self.index.earliest())
+
+    def test_earliest(self):
+        self.index.push(self.base + timedelta(hours=3), "i-3")
+        self.index.push(self.base + timedelta(hours=1), "i-1")
+        self.index.push(self.base + timedelta(hours=2), "i-2")
+        self.assertEqual(self.index.earliest(), (self.base + timedelta(hours=1), "i-1"))
+        self.assertEqual(len(self.index), 3)
+
+    def test_push_none(self):
+        self.index.push(None, "i-1")
+        self.assertEqual(len(self.index), 0)
+
+    """ aligned_interval() """
+
+    def test_aligned_interval_empty(self):
+        self.assertEqual(self.index.aligned_interval(), MAX_INTERVAL_MINUTES)
+
+    def test_aligned_interval_hours(self):
+        self.index.push(self.base + timedelta(hours=8), "i-1")
+        self.index.push(self.base + timedelta(hours=18), "i-2")
+        self.assertEqual(self.index.aligned_interval(), 60)
+
+    def test_aligned_interval_minutes(self):
+        self.index.push(self.base + timedelta(hours=8, minutes=30), "i-1")
+        self.index.push(self.base + timedelta(hours=18, minutes=45), "i-2")
+        self.assertEqual(self.index.aligned_interval(), 15)
+
+    def test_aligned_interval_ignores_seconds(self):
+        self.index.push(self.base + timedelta(hours=8), "i-1")
+        self.index.push(self.base + timedelta(hours=9, minutes=7, seconds=12), "i-2")
+        self.assertEqual(self.index.aligned_interval(), 60)
+
+
+# vim: ft=python:ts=4:sw=4